@@ -0,0 +1,249 @@
+"""
+Analítica de inicios de sesión de SECURELINK
+
+Mantiene contadores incrementales por intervalo de tiempo (minuto, hora y
+día), rol y resultado, alimentados con los lotes que vuelca AuditLog.
+Nunca se recorren usuarios ni eventos crudos para pintar el panel:
+
+- rollups_auth: (granularidad, bucket, rol, resultado) -> total
+  resultado es 'ok', 'fallo' o 'activos' (usuarios distintos, solo para
+  intervalos ya cerrados)
+- rollups_activos: usuarios distintos con login correcto en intervalos
+  todavía abiertos; al compactar se resumen en rollups_auth y se borran
+- rollups_compactados: por granularidad, hasta qué bucket se compactó.
+  Los eventos que llegan tarde (volcados con retraso, lotes
+  reintentados, buffers de otros workers) ya no añaden usuarios activos
+  a esos intervalos; si no, se contarían dos veces. Para que casi no
+  haya eventos tardíos, solo se compacta un intervalo `margen` segundos
+  después de cerrarse.
+
+La compactación también elimina los intervalos de minuto y hora más
+antiguos que su retención.
+"""
+
+import sqlite3
+import time
+from collections import Counter
+
+import audit
+
+GRANULARIDADES = {
+    'minuto': 60,
+    'hora': 3600,
+    'dia': 86400,
+}
+
+# Segundos que se conserva cada granularidad (None = siempre)
+RETENCION = {
+    'minuto': 2 * 3600,
+    'hora': 30 * 86400,
+    'dia': None,
+}
+
+RESULTADOS = {
+    audit.LOGIN_OK: 'ok',
+    audit.LOGIN_FALLO: 'fallo',
+}
+
+SCHEMA_ROLLUPS = [
+    '''
+    CREATE TABLE IF NOT EXISTS rollups_auth (
+        granularidad TEXT NOT NULL,
+        bucket INTEGER NOT NULL,
+        rol TEXT NOT NULL,
+        resultado TEXT NOT NULL,
+        total INTEGER NOT NULL,
+        PRIMARY KEY (granularidad, bucket, rol, resultado)
+    ) WITHOUT ROWID
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS rollups_activos (
+        granularidad TEXT NOT NULL,
+        bucket INTEGER NOT NULL,
+        rol TEXT NOT NULL,
+        user_id INTEGER NOT NULL,
+        PRIMARY KEY (granularidad, bucket, rol, user_id)
+    ) WITHOUT ROWID
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS rollups_compactados (
+        granularidad TEXT PRIMARY KEY,
+        hasta INTEGER NOT NULL
+    ) WITHOUT ROWID
+    ''',
+]
+
+
+def inicio_bucket(ts, granularidad):
+    segundos = GRANULARIDADES[granularidad]
+    return int(ts // segundos) * segundos
+
+
+def max_buckets(granularidad, limite=500):
+    """Intervalos que se pueden pedir sin pasar de la retención"""
+    retencion = RETENCION[granularidad]
+    if retencion is None:
+        return limite
+    return min(limite, retencion // GRANULARIDADES[granularidad])
+
+
+class RollupEngine:
+    """Contadores por intervalo actualizados por lotes"""
+
+    def __init__(self, database, intervalo_compactacion=300, margen=300):
+        self.database = database
+        self.intervalo_compactacion = intervalo_compactacion
+        # Segundos que un intervalo cerrado sigue aceptando usuarios activos
+        self.margen = margen
+        self._ultima_compactacion = 0.0
+        self._esquema_listo = False
+
+    def connect(self):
+        conn = sqlite3.connect(self.database)
+        conn.row_factory = sqlite3.Row
+        # Las tablas se crean en el primer uso, no al arrancar
+        if not self._esquema_listo:
+            for sentencia in SCHEMA_ROLLUPS:
+                conn.execute(sentencia)
+            conn.commit()
+            self._esquema_listo = True
+        return conn
+
+    # --- Actualización -----------------------------------------------------
+
+    def procesar(self, eventos):
+        """
+        Suma un lote de eventos de auditoría a los contadores
+
+        Pensado como suscriptor de AuditLog: corre en su hilo de volcado.
+        """
+        contadores = Counter()
+        activos = set()
+
+        for evento in eventos:
+            resultado = RESULTADOS.get(evento['tipo'])
+            if resultado is None:
+                continue
+            rol = evento['rol'] or 'desconocido'
+            for granularidad in GRANULARIDADES:
+                bucket = inicio_bucket(evento['ts'], granularidad)
+                contadores[(granularidad, bucket, rol, resultado)] += 1
+                if resultado == 'ok' and evento['user_id'] is not None:
+                    activos.add((granularidad, bucket, rol, evento['user_id']))
+
+        if contadores:
+            conn = self.connect()
+            with conn:
+                conn.executemany('''
+                    INSERT INTO rollups_auth (granularidad, bucket, rol, resultado, total)
+                    VALUES (?, ?, ?, ?, ?)
+                    ON CONFLICT (granularidad, bucket, rol, resultado)
+                    DO UPDATE SET total = total + excluded.total
+                ''', [clave + (total,) for clave, total in contadores.items()])
+                # Mismo INSERT que comprueba la marca: no hay carrera con compactar()
+                conn.executemany('''
+                    INSERT OR IGNORE INTO rollups_activos (granularidad, bucket, rol, user_id)
+                    SELECT ?1, ?2, ?3, ?4
+                    WHERE ?2 >= COALESCE(
+                        (SELECT hasta FROM rollups_compactados WHERE granularidad = ?1), 0
+                    )
+                ''', list(activos))
+            conn.close()
+
+        if time.time() - self._ultima_compactacion >= self.intervalo_compactacion:
+            self.compactar()
+
+    def compactar(self, ahora=None):
+        """
+        Cierra los intervalos terminados y aplica la retención
+
+        - Los usuarios activos de intervalos cerrados hace más de `margen`
+          segundos pasan a una fila resultado='activos', se borra su
+          detalle y se avanza la marca de rollups_compactados.
+        - Se eliminan los intervalos más antiguos que RETENCION.
+        """
+        ahora = time.time() if ahora is None else ahora
+        conn = self.connect()
+        with conn:
+            for granularidad, segundos in GRANULARIDADES.items():
+                abierto = inicio_bucket(ahora, granularidad)
+                cerrado = inicio_bucket(ahora - self.margen, granularidad)
+                conn.execute('''
+                    INSERT INTO rollups_auth (granularidad, bucket, rol, resultado, total)
+                    SELECT granularidad, bucket, rol, 'activos', COUNT(*)
+                    FROM rollups_activos
+                    WHERE granularidad = ? AND bucket < ?
+                    GROUP BY granularidad, bucket, rol
+                    ON CONFLICT (granularidad, bucket, rol, resultado)
+                    DO UPDATE SET total = total + excluded.total
+                ''', (granularidad, cerrado))
+                conn.execute(
+                    'DELETE FROM rollups_activos WHERE granularidad = ? AND bucket < ?',
+                    (granularidad, cerrado)
+                )
+                conn.execute('''
+                    INSERT INTO rollups_compactados (granularidad, hasta) VALUES (?, ?)
+                    ON CONFLICT (granularidad) DO UPDATE SET hasta = MAX(hasta, excluded.hasta)
+                ''', (granularidad, cerrado))
+
+                retencion = RETENCION[granularidad]
+                if retencion is not None:
+                    conn.execute(
+                        'DELETE FROM rollups_auth WHERE granularidad = ? AND bucket < ?',
+                        (granularidad, abierto - retencion)
+                    )
+        conn.close()
+        self._ultima_compactacion = ahora
+
+    # --- Consulta ----------------------------------------------------------
+
+    def serie(self, granularidad='hora', buckets=24, ahora=None):
+        """
+        Últimos `buckets` intervalos, del más antiguo al más reciente
+
+        Cada elemento: {'bucket', 'ok', 'fallo', 'tasa_fallo', 'por_rol'}
+        con por_rol = {rol: {'ok', 'fallo', 'activos'}}.
+        """
+        ahora = time.time() if ahora is None else ahora
+        segundos = GRANULARIDADES[granularidad]
+        ultimo = inicio_bucket(ahora, granularidad)
+        primero = ultimo - (buckets - 1) * segundos
+
+        serie = {
+            primero + i * segundos: {'ok': 0, 'fallo': 0, 'por_rol': {}}
+            for i in range(buckets)
+        }
+
+        def por_rol(bucket, rol):
+            return serie[bucket]['por_rol'].setdefault(
+                rol, {'ok': 0, 'fallo': 0, 'activos': 0}
+            )
+
+        conn = self.connect()
+        filas = conn.execute('''
+            SELECT bucket, rol, resultado, total FROM rollups_auth
+            WHERE granularidad = ? AND bucket >= ?
+        ''', (granularidad, primero)).fetchall()
+        # Intervalos aún abiertos: usuarios activos desde el detalle
+        abiertos = conn.execute('''
+            SELECT bucket, rol, 'activos' AS resultado, COUNT(*) AS total
+            FROM rollups_activos
+            WHERE granularidad = ? AND bucket >= ?
+            GROUP BY bucket, rol
+        ''', (granularidad, primero)).fetchall()
+        conn.close()
+
+        for fila in list(filas) + list(abiertos):
+            if fila['bucket'] not in serie:
+                continue
+            por_rol(fila['bucket'], fila['rol'])[fila['resultado']] += fila['total']
+            if fila['resultado'] in ('ok', 'fallo'):
+                serie[fila['bucket']][fila['resultado']] += fila['total']
+
+        resultado = []
+        for bucket, datos in serie.items():
+            intentos = datos['ok'] + datos['fallo']
+            datos['bucket'] = bucket
+            datos['tasa_fallo'] = datos['fallo'] / intentos if intentos else 0.0
+            resultado.append(datos)
+        return resultado
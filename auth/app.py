@@ -1,48 +1,207 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash
-import sqlite3
+import time
+_inicio_arranque = time.perf_counter()
+
+from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify, g
 import bcrypt
+from concurrent.futures import ThreadPoolExecutor
 from functools import wraps
 import os
 from datetime import datetime
+from storage import crear_storage, UsuarioExistenteError, SCHEMA_VERSION, ROLES
+from templating import configurar_plantillas, precompilar_plantillas
+from assets import AssetPipeline
+import audit
+import tokens
+from mailer import MailQueue, crear_transport
+from usercache import UserCache
+import hashlib
+import hmac
+import secrets
+import threading
+from salud import MonitorSalud
+
+# Desglose del tiempo de arranque (segundos por fase)
+TIEMPOS_ARRANQUE = {}
+_ultima_marca = _inicio_arranque
+
+def marcar_fase(fase):
+    """Guarda en TIEMPOS_ARRANQUE el tiempo transcurrido desde la fase anterior"""
+    global _ultima_marca
+    ahora = time.perf_counter()
+    TIEMPOS_ARRANQUE[fase] = ahora - _ultima_marca
+    _ultima_marca = ahora
+
+marcar_fase('imports')
 
 app = Flask(__name__)
 app.secret_key = 'securelink_clave_ultra_secreta_2024_bcrypt'
+# La cookie de sesión no viaja en POST iniciados desde otros sitios
+app.config['SESSION_COOKIE_SAMESITE'] = 'Lax'
 
 DATABASE = 'securelink.db'
 
+# Backend de almacenamiento: 'sqlite' (un archivo) o 'sharded' (varios archivos)
+STORAGE_BACKEND = os.environ.get('SECURELINK_STORAGE', 'sqlite')
+STORAGE_SHARDS = int(os.environ.get('SECURELINK_SHARDS', '4'))
+
+# Réplica de lectura: segundos entre copias (0 = desactivada)
+REPLICA_INTERVAL = float(os.environ.get('SECURELINK_REPLICA_INTERVAL', '0'))
+
+# Antigüedad máxima aceptada (segundos) por cada lectura que puede usar réplica
+STALENESS_ADMIN = 30
+STALENESS_PERFIL = 10
+
+storage = crear_storage(DATABASE, STORAGE_BACKEND, STORAGE_SHARDS, REPLICA_INTERVAL)
+
+# Registros de usuario usados para validar sesiones (segundos de vida en caché)
+USER_CACHE_TTL = float(os.environ.get('SECURELINK_USER_CACHE_TTL', '5'))
+user_cache = UserCache(storage, USER_CACHE_TTL)
+marcar_fase('storage')
+
+# Caché de bytecode de Jinja en disco + caché de fragmentos por rol
+TEMPLATE_CACHE_DIR = os.environ.get(
+    'SECURELINK_TEMPLATE_CACHE', os.path.join(app.root_path, '.jinja_cache')
+)
+configurar_plantillas(app, TEMPLATE_CACHE_DIR)
+marcar_fase('plantillas')
+
+# Al importar el módulo: los workers WSGI no pasan por __main__
+TOTAL_PLANTILLAS = precompilar_plantillas(app)
+marcar_fase('precompilar')
+
+# Archivos estáticos con huella, ETag y variantes gzip/brotli en /assets
+ASSET_CACHE_DIR = os.environ.get(
+    'SECURELINK_ASSET_CACHE', os.path.join(app.root_path, '.asset_cache')
+)
+assets = AssetPipeline(app, ASSET_CACHE_DIR)
+marcar_fase('assets')
+
+# Auditoría de autenticación: 'sqlite' (tabla eventos_auth) o 'jsonl'
+AUDIT_SINK = os.environ.get('SECURELINK_AUDIT_SINK', 'sqlite')
+AUDIT_DIR = os.environ.get('SECURELINK_AUDIT_DIR', 'logs')
+
+audit_log = audit.crear_audit_log(DATABASE, AUDIT_SINK, AUDIT_DIR)
+
+# Contadores de logins por minuto/hora/día, alimentados por la auditoría
+audit_log.suscribir(lambda eventos: obtener_rollups().procesar(eventos))
+marcar_fase('auditoria')
+
+# Correo saliente: 'archivo' (.eml en MAIL_DIR) o 'smtp'
+MAIL_TRANSPORT = os.environ.get('SECURELINK_MAIL_TRANSPORT', 'archivo')
+MAIL_FROM = os.environ.get('SECURELINK_MAIL_FROM', 'no-reply@securelink.com')
+MAIL_DIR = os.environ.get('SECURELINK_MAIL_DIR', 'correo_saliente')
+SMTP_HOST = os.environ.get('SECURELINK_SMTP_HOST', 'localhost')
+SMTP_PORT = int(os.environ.get('SECURELINK_SMTP_PORT', '1025'))
+
+# Dirección pública con la que se construyen los enlaces de los correos.
+# Nunca se toma de la petición: la cabecera Host la elige el cliente.
+BASE_URL = os.environ.get('SECURELINK_BASE_URL', 'http://127.0.0.1:5000').rstrip('/')
+
+# Vigencia de los enlaces enviados por correo (segundos)
+TTL_RESET_PASSWORD = 3600
+TTL_VERIFICAR_EMAIL = 48 * 3600
+
+tokens_cuenta = tokens.TokenStore(DATABASE)
+
+# Segundo factor TOTP: clave maestra para cifrar los secretos en la base de datos
+MFA_KEY = os.environ.get('SECURELINK_MFA_KEY', app.secret_key)
+# Segundos para introducir el código tras validar la contraseña
+MFA_PENDIENTE_TTL = 300
+# Intentos fallidos seguidos antes de bloquear el segundo paso (segundos de bloqueo)
+MFA_MAX_INTENTOS = 5
+MFA_BLOQUEO = 300
+
+mail_queue = MailQueue(
+    DATABASE,
+    crear_transport(MAIL_TRANSPORT, MAIL_FROM, MAIL_DIR, SMTP_HOST, SMTP_PORT)
+)
+
+# Snapshots online de DATABASE y sus shards (páginas por paso y pausa entre pasos)
+BACKUP_DIR = os.environ.get('SECURELINK_BACKUP_DIR', 'backups')
+BACKUP_PAGINAS = int(os.environ.get('SECURELINK_BACKUP_PAGES', '64'))
+BACKUP_PAUSA = float(os.environ.get('SECURELINK_BACKUP_PAUSE', '0.005'))
+
+
+# Umbrales de /readyz: peticiones en curso, bcrypt en curso y tasa de errores 5xx
+READY_MAX_PETICIONES = int(os.environ.get('SECURELINK_READY_MAX_REQUESTS', '32'))
+READY_MAX_BCRYPT = int(os.environ.get('SECURELINK_READY_MAX_BCRYPT', str((os.cpu_count() or 1) * 2)))
+READY_MAX_ERRORES = float(os.environ.get('SECURELINK_READY_MAX_ERROR_RATE', '0.2'))
+
+# Acceso a /estado sin sesión de admin: token en la cabecera X-Estado-Token
+# o IPs permitidas (separadas por comas). Vacíos por defecto: solo admins.
+ESTADO_TOKEN = os.environ.get('SECURELINK_ESTADO_TOKEN', '')
+ESTADO_IPS = {ip.strip() for ip in os.environ.get('SECURELINK_ESTADO_IPS', '').split(',') if ip.strip()}
+
+# Se comprueban los archivos con la tabla usuarios (DATABASE o cada shard)
+monitor = MonitorSalud(
+    [s.database for s in getattr(storage, 'shards', [storage])],
+    READY_MAX_PETICIONES, READY_MAX_BCRYPT, READY_MAX_ERRORES
+)
+
 # ============================================================================
-# FUNCIONES DE BASE DE DATOS
+# SERVICIOS PEREZOSOS
 # ============================================================================
+# analytics, mfa y backup no se importan al arrancar: el módulo y su objeto
+# se crean en el primer uso (un lote de auditoría, un login con MFA o el
+# panel de backups).
+
+_servicios = {}
+_lock_servicios = threading.Lock()
+
+def _servicio(nombre, crear):
+    servicio = _servicios.get(nombre)
+    if servicio is None:
+        with _lock_servicios:
+            servicio = _servicios.get(nombre)
+            if servicio is None:
+                servicio = _servicios[nombre] = crear()
+    return servicio
 
-def get_db_connection():
-    """Establece conexión con la base de datos SQLite"""
-    conn = sqlite3.connect(DATABASE)
-    conn.row_factory = sqlite3.Row
-    return conn
+def obtener_rollups():
+    def crear():
+        from analytics import RollupEngine
+        return RollupEngine(DATABASE)
+    return _servicio('rollups', crear)
+
+def obtener_mfa_store():
+    def crear():
+        from mfa import MFAStore
+        return MFAStore(
+            DATABASE, hashlib.sha256(MFA_KEY.encode('utf-8')).digest(),
+            max_fallos=MFA_MAX_INTENTOS, bloqueo=MFA_BLOQUEO
+        )
+    return _servicio('mfa', crear)
+
+def obtener_backups():
+    def crear():
+        from backup import GestorBackups, archivos_de_storage
+        return GestorBackups(
+            archivos_de_storage(DATABASE, storage), BACKUP_DIR, BACKUP_PAGINAS, BACKUP_PAUSA
+        )
+    return _servicio('backups', crear)
+
+# ============================================================================
+# FUNCIONES DE BASE DE DATOS
+# ============================================================================
 
 def init_db():
-    """Inicializa la base de datos y crea usuarios de ejemplo"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
+    """
+    Inicializa la base de datos y crea usuarios de ejemplo
+
+    Si PRAGMA user_version ya marca SCHEMA_VERSION (base de datos caliente)
+    no se ejecuta nada más: ni CREATE TABLE ni conteo de usuarios.
+    """
+    if storage.version_esquema() >= SCHEMA_VERSION:
+        print(f"\n✅ Base de datos lista (esquema v{SCHEMA_VERSION})")
+        storage.iniciar()
+        mail_queue.iniciar()
+        return
     
     # Crear tabla de usuarios
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS usuarios (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT UNIQUE NOT NULL,
-            password_hash TEXT NOT NULL,
-            rol TEXT NOT NULL CHECK(rol IN ('admin', 'usuario', 'invitado')),
-            nombre_completo TEXT NOT NULL,
-            email TEXT NOT NULL,
-            fecha_creacion TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            ultimo_acceso TIMESTAMP,
-            activo INTEGER DEFAULT 1
-        )
-    ''')
+    storage.init_schema()
     
     # Verificar si ya existen usuarios
-    cursor.execute('SELECT COUNT(*) FROM usuarios')
-    count = cursor.fetchone()[0]
+    count = storage.contar_usuarios()
     
     if count == 0:
         print("\n" + "="*70)
@@ -81,15 +240,15 @@ def init_db():
             }
         ]
         
-        for user in usuarios_iniciales:
-            password_hash = hash_password(user['password'])
-            cursor.execute('''
-                INSERT INTO usuarios (username, password_hash, rol, nombre_completo, email)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (user['username'], password_hash, user['rol'], user['nombre'], user['email']))
-            print(f"✅ Usuario creado: {user['username']} ({user['rol']})")
+        # bcrypt libera el GIL: los hashes se calculan en paralelo
+        with ThreadPoolExecutor(max_workers=len(usuarios_iniciales)) as pool:
+            hashes = list(pool.map(hash_password, [u['password'] for u in usuarios_iniciales]))
         
-        conn.commit()
+        for user, password_hash in zip(usuarios_iniciales, hashes):
+            storage.crear_usuario(
+                user['username'], password_hash, user['rol'], user['nombre'], user['email']
+            )
+            print(f"✅ Usuario creado: {user['username']} ({user['rol']})")
         
         print("\n🔑 CREDENCIALES DE ACCESO:")
         print("="*70)
@@ -99,19 +258,15 @@ def init_db():
     else:
         print(f"\n✅ Base de datos encontrada con {count} usuarios")
     
-    conn.close()
+    storage.marcar_version(SCHEMA_VERSION)
+    storage.iniciar()
+    
+    # Enviar lo que quedara en la cola de correo de ejecuciones anteriores
+    mail_queue.iniciar()
 
 def actualizar_ultimo_acceso(user_id):
     """Actualiza la fecha del último acceso del usuario"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('''
-        UPDATE usuarios 
-        SET ultimo_acceso = CURRENT_TIMESTAMP 
-        WHERE id = ?
-    ''', (user_id,))
-    conn.commit()
-    conn.close()
+    storage.registrar_acceso(user_id)
 
 # ============================================================================
 # FUNCIONES CRIPTOGRÁFICAS CON BCRYPT
@@ -129,7 +284,8 @@ def hash_password(password):
     """
     password_bytes = password.encode('utf-8')
     salt = bcrypt.gensalt(rounds=12)
-    password_hash = bcrypt.hashpw(password_bytes, salt)
+    with monitor.hash_en_curso():
+        password_hash = bcrypt.hashpw(password_bytes, salt)
     return password_hash.decode('utf-8')
 
 def verify_password(password, password_hash):
@@ -143,7 +299,8 @@ def verify_password(password, password_hash):
     try:
         password_bytes = password.encode('utf-8')
         password_hash_bytes = password_hash.encode('utf-8')
-        return bcrypt.checkpw(password_bytes, password_hash_bytes)
+        with monitor.hash_en_curso():
+            return bcrypt.checkpw(password_bytes, password_hash_bytes)
     except Exception as e:
         print(f"Error al verificar password: {e}")
         return False
@@ -152,6 +309,29 @@ def verify_password(password, password_hash):
 # DECORADORES DE PROTECCIÓN DE RUTAS
 # ============================================================================
 
+def huella_password(password_hash):
+    """Huella corta del hash de la contraseña que se guarda en la sesión"""
+    return hashlib.sha256(password_hash.encode('utf-8')).hexdigest()[:16]
+
+def sesion_vigente():
+    """
+    Comprueba que el usuario de la sesión sigue existiendo y activo
+
+    Si un admin cambió su rol, se actualiza en la sesión. Si fue
+    desactivado o eliminado, o su contraseña cambió desde el login, la
+    sesión se cierra.
+    """
+    user = user_cache.obtener(session['user_id'])
+    if user is None or user['activo'] != 1:
+        session.clear()
+        return False
+    if session.get('huella') != huella_password(user['password_hash']):
+        session.clear()
+        return False
+    if user['rol'] != session.get('rol'):
+        session['rol'] = user['rol']
+    return True
+
 def login_required(f):
     """
     Decorador que protege rutas requiriendo autenticación
@@ -162,6 +342,9 @@ def login_required(f):
         if 'user_id' not in session:
             flash('⚠️ Debes iniciar sesión para acceder a esta página', 'warning')
             return redirect(url_for('login'))
+        if not sesion_vigente():
+            flash('⚠️ Tu sesión ya no es válida. Inicia sesión de nuevo', 'warning')
+            return redirect(url_for('login'))
         return f(*args, **kwargs)
     return decorated_function
 
@@ -177,6 +360,10 @@ def role_required(roles):
                 flash('⚠️ Debes iniciar sesión', 'warning')
                 return redirect(url_for('login'))
             
+            if not sesion_vigente():
+                flash('⚠️ Tu sesión ya no es válida. Inicia sesión de nuevo', 'warning')
+                return redirect(url_for('login'))
+            
             if session.get('rol') not in roles:
                 flash('❌ No tienes permisos para acceder a esta página', 'danger')
                 return redirect(url_for('dashboard'))
@@ -214,42 +401,97 @@ def login():
             return render_template('login.html')
         
         # Buscar usuario en la base de datos
-        conn = get_db_connection()
-        user = conn.execute(
-            'SELECT * FROM usuarios WHERE username = ? AND activo = 1', 
-            (username,)
-        ).fetchone()
-        conn.close()
+        user = storage.obtener_usuario_por_username(username, solo_activos=True)
         
         # Verificar credenciales
         if user and verify_password(password, user['password_hash']):
-            # ✅ Credenciales correctas - Crear sesión
-            session['user_id'] = user['id']
-            session['username'] = user['username']
-            session['rol'] = user['rol']
-            session['nombre'] = user['nombre_completo']
-            session['email'] = user['email']
-            
-            # Actualizar último acceso
-            actualizar_ultimo_acceso(user['id'])
-            
-            flash(f'🎉 ¡Bienvenido {user["nombre_completo"]}!', 'success')
+            # Con MFA activo la sesión se crea tras el segundo paso
+            if obtener_mfa_store().activo(user['id']):
+                session['mfa_pendiente'] = {'user_id': user['id'], 'desde': time.time()}
+                return redirect(url_for('login_mfa'))
             
-            # Redirigir según rol
-            if user['rol'] == 'admin':
-                return redirect(url_for('admin_panel'))
-            elif user['rol'] == 'usuario':
-                return redirect(url_for('user_panel'))
-            elif user['rol'] == 'invitado':
-                return redirect(url_for('guest_panel'))
-            else:
-                return redirect(url_for('dashboard'))
+            return completar_login(user)
         else:
             # ❌ Credenciales incorrectas
+            audit_log.registrar(
+                audit.LOGIN_FALLO,
+                username,
+                user['id'] if user else None,
+                user['rol'] if user else None,
+                request.remote_addr,
+                'password_incorrecta' if user else 'usuario_inexistente_o_inactivo'
+            )
             flash('❌ Usuario o contraseña incorrectos', 'danger')
     
     return render_template('login.html')
 
+def completar_login(user):
+    """Crea la sesión del usuario autenticado y redirige según su rol"""
+    # ✅ Credenciales correctas - Crear sesión
+    session['user_id'] = user['id']
+    session['username'] = user['username']
+    session['rol'] = user['rol']
+    session['nombre'] = user['nombre_completo']
+    session['email'] = user['email']
+    session['huella'] = huella_password(user['password_hash'])
+    
+    # Actualizar último acceso
+    actualizar_ultimo_acceso(user['id'])
+    audit_log.registrar(
+        audit.LOGIN_OK, user['username'], user['id'], user['rol'], request.remote_addr
+    )
+    
+    flash(f'🎉 ¡Bienvenido {user["nombre_completo"]}!', 'success')
+    
+    # Redirigir según rol
+    if user['rol'] == 'admin':
+        return redirect(url_for('admin_panel'))
+    elif user['rol'] == 'usuario':
+        return redirect(url_for('user_panel'))
+    elif user['rol'] == 'invitado':
+        return redirect(url_for('guest_panel'))
+    else:
+        return redirect(url_for('dashboard'))
+
+@app.route('/login/mfa', methods=['GET', 'POST'])
+def login_mfa():
+    """Segundo paso del login: código TOTP o código de respaldo"""
+    pendiente = session.get('mfa_pendiente')
+    
+    if not pendiente or time.time() - pendiente['desde'] > MFA_PENDIENTE_TTL:
+        session.pop('mfa_pendiente', None)
+        flash('⚠️ Inicia sesión de nuevo', 'warning')
+        return redirect(url_for('login'))
+    
+    if request.method == 'POST':
+        user = storage.obtener_usuario(pendiente['user_id'])
+        codigo = request.form.get('codigo', '')
+        mfa_store = obtener_mfa_store()
+        
+        if user and user['activo'] == 1 and mfa_store.verificar(user['id'], codigo):
+            session.pop('mfa_pendiente', None)
+            return completar_login(user)
+        
+        audit_log.registrar(
+            audit.LOGIN_FALLO,
+            user['username'] if user else None,
+            pendiente['user_id'],
+            user['rol'] if user else None,
+            request.remote_addr,
+            'codigo_mfa_incorrecto'
+        )
+        
+        # El contador de intentos está en la base de datos: reenviar la cookie no lo reinicia
+        espera = mfa_store.bloqueado(pendiente['user_id'])
+        if espera:
+            session.pop('mfa_pendiente', None)
+            flash(f'❌ Demasiados intentos. Vuelve a intentarlo en {int(espera // 60) + 1} min', 'danger')
+            return redirect(url_for('login'))
+        
+        flash('❌ Código incorrecto', 'danger')
+    
+    return render_template('login_mfa.html')
+
 @app.route('/registro', methods=['GET', 'POST'])
 def registro():
     """Página de registro de nuevos usuarios CON SELECCIÓN DE ROL"""
@@ -280,14 +522,9 @@ def registro():
             return render_template('registro.html')
         
         # Verificar si el usuario ya existe
-        conn = get_db_connection()
-        existing_user = conn.execute(
-            'SELECT * FROM usuarios WHERE username = ?', 
-            (username,)
-        ).fetchone()
+        existing_user = storage.obtener_usuario_por_username(username)
         
         if existing_user:
-            conn.close()
             flash('⚠️ El nombre de usuario ya está en uso', 'danger')
             return render_template('registro.html')
         
@@ -295,15 +532,9 @@ def registro():
         password_hash = hash_password(password)
         
         try:
-            cursor = conn.cursor()
-            cursor.execute('''
-                INSERT INTO usuarios (username, password_hash, rol, nombre_completo, email)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (username, password_hash, rol, nombre_completo, email))
-            conn.commit()
-            
-            user_id = cursor.lastrowid
-            conn.close()
+            user_id = storage.crear_usuario(username, password_hash, rol, nombre_completo, email)
+            audit_log.registrar(audit.REGISTRO, username, user_id, rol, request.remote_addr)
+            enviar_verificacion_email(user_id, email, nombre_completo)
             
             print(f"\n✅ Nuevo usuario registrado:")
             print(f"   ID: {user_id}")
@@ -314,13 +545,125 @@ def registro():
             flash(f'✅ Registro exitoso como {rol}. Ahora puedes iniciar sesión', 'success')
             return redirect(url_for('login'))
             
+        except UsuarioExistenteError:
+            flash('⚠️ El nombre de usuario ya está en uso', 'danger')
         except Exception as e:
-            conn.close()
             flash(f'❌ Error al registrar usuario: {str(e)}', 'danger')
             print(f"Error en registro: {e}")
     
     return render_template('registro.html')
 
+# ============================================================================
+# RECUPERACIÓN DE CONTRASEÑA Y VERIFICACIÓN DE EMAIL
+# ============================================================================
+
+def enlace_externo(endpoint, **valores):
+    """URL absoluta para un correo, sobre BASE_URL"""
+    return BASE_URL + url_for(endpoint, **valores)
+
+def enviar_verificacion_email(user_id, email, nombre):
+    """Emite un token de verificación y encola el correo (no espera al envío)"""
+    token = tokens_cuenta.emitir(user_id, tokens.VERIFICAR_EMAIL, TTL_VERIFICAR_EMAIL)
+    enlace = enlace_externo('verificar_email', token=token)
+    mail_queue.encolar(
+        email,
+        'SECURELINK - Verifica tu correo electrónico',
+        f"Hola {nombre},\n\n"
+        f"Confirma tu correo electrónico abriendo este enlace:\n{enlace}\n\n"
+        f"El enlace caduca en {TTL_VERIFICAR_EMAIL // 3600} horas."
+    )
+
+@app.route('/recuperar', methods=['GET', 'POST'])
+def recuperar():
+    """Solicitud de restablecimiento de contraseña por email"""
+    if request.method == 'POST':
+        email = request.form.get('email', '').strip()
+        
+        if not email:
+            flash('⚠️ Introduce tu correo electrónico', 'danger')
+            return render_template('recuperar.html')
+        
+        user = storage.obtener_usuario_por_email(email)
+        if user and user['activo'] == 1:
+            token = tokens_cuenta.emitir(user['id'], tokens.RESET_PASSWORD, TTL_RESET_PASSWORD)
+            enlace = enlace_externo('restablecer', token=token)
+            mail_queue.encolar(
+                user['email'],
+                'SECURELINK - Restablecer contraseña',
+                f"Hola {user['nombre_completo']},\n\n"
+                f"Para elegir una contraseña nueva abre este enlace:\n{enlace}\n\n"
+                f"El enlace caduca en {TTL_RESET_PASSWORD // 60} minutos y solo "
+                f"puede usarse una vez. Si no lo pediste, ignora este correo."
+            )
+        
+        # Mismo mensaje exista o no la cuenta (no revela qué emails están registrados)
+        flash('📧 Si el correo está registrado, recibirás un enlace para restablecer tu contraseña', 'info')
+        return redirect(url_for('login'))
+    
+    return render_template('recuperar.html')
+
+@app.route('/restablecer/<token>', methods=['GET', 'POST'])
+def restablecer(token):
+    """Formulario de contraseña nueva a partir de un token de un solo uso"""
+    if tokens_cuenta.validar(token, tokens.RESET_PASSWORD) is None:
+        flash('❌ El enlace no es válido o ha caducado', 'danger')
+        return redirect(url_for('recuperar'))
+    
+    if request.method == 'POST':
+        password = request.form.get('password', '')
+        password_confirm = request.form.get('password_confirm', '')
+        
+        if password != password_confirm:
+            flash('⚠️ Las contraseñas no coinciden', 'danger')
+            return render_template('restablecer.html', token=token)
+        
+        if len(password) < 8:
+            flash('⚠️ La contraseña debe tener al menos 8 caracteres', 'danger')
+            return render_template('restablecer.html', token=token)
+        
+        password_hash = hash_password(password)
+        
+        # El token se consume justo antes de escribir: un segundo envío falla aquí
+        user_id = tokens_cuenta.consumir(token, tokens.RESET_PASSWORD)
+        if user_id is None:
+            flash('❌ El enlace no es válido o ha caducado', 'danger')
+            return redirect(url_for('recuperar'))
+        
+        storage.actualizar_password(user_id, password_hash)
+        # Las sesiones abiertas con la contraseña anterior dejan de valer
+        user_cache.invalidar([user_id])
+        flash('✅ Contraseña actualizada. Ya puedes iniciar sesión', 'success')
+        return redirect(url_for('login'))
+    
+    return render_template('restablecer.html', token=token)
+
+@app.route('/verificar-email/<token>')
+def verificar_email(token):
+    """Confirma el email del usuario con el enlace recibido"""
+    user_id = tokens_cuenta.consumir(token, tokens.VERIFICAR_EMAIL)
+    
+    if user_id is None:
+        flash('❌ El enlace de verificación no es válido o ha caducado', 'danger')
+    else:
+        storage.marcar_email_verificado(user_id)
+        flash('✅ Correo electrónico verificado', 'success')
+    
+    if 'user_id' in session:
+        return redirect(url_for('perfil'))
+    return redirect(url_for('login'))
+
+@app.route('/perfil/verificar-email', methods=['POST'])
+@login_required
+def reenviar_verificacion():
+    """Vuelve a enviar el correo de verificación al usuario actual"""
+    user = storage.obtener_usuario(session['user_id'])
+    
+    if user and not user.get('email_verificado'):
+        enviar_verificacion_email(user['id'], user['email'], user['nombre_completo'])
+        flash(f'📧 Te enviamos un enlace de verificación a {user["email"]}', 'info')
+    
+    return redirect(url_for('perfil'))
+
 # ============================================================================
 # RUTAS PROTEGIDAS (requieren autenticación)
 # ============================================================================
@@ -338,28 +681,19 @@ def dashboard():
     elif rol == 'invitado':
         return redirect(url_for('guest_panel'))
     
-    return render_template('dashboard.html')
+    # Rol desconocido: no hay panel para él
+    session.clear()
+    flash('❌ Tu cuenta no tiene un rol válido', 'danger')
+    return redirect(url_for('login'))
 
 @app.route('/admin')
 @role_required(['admin'])
 def admin_panel():
     """Panel de administración - Solo para admins"""
-    conn = get_db_connection()
-    usuarios = conn.execute('''
-        SELECT * FROM usuarios 
-        ORDER BY fecha_creacion DESC
-    ''').fetchall()
-    
-    # Estadísticas
-    stats = {
-        'total': len(usuarios),
-        'admins': len([u for u in usuarios if u['rol'] == 'admin']),
-        'usuarios': len([u for u in usuarios if u['rol'] == 'usuario']),
-        'invitados': len([u for u in usuarios if u['rol'] == 'invitado']),
-        'activos': len([u for u in usuarios if u['activo'] == 1])
-    }
+    usuarios = storage.listar_usuarios(max_staleness=STALENESS_ADMIN)
     
-    conn.close()
+    # Estadísticas (agregadas en la base de datos)
+    stats = storage.estadisticas(max_staleness=STALENESS_ADMIN)
     
     return render_template('admin.html', usuarios=usuarios, stats=stats)
 
@@ -379,18 +713,62 @@ def guest_panel():
 @login_required
 def perfil():
     """Página de perfil del usuario"""
-    conn = get_db_connection()
-    user = conn.execute(
-        'SELECT * FROM usuarios WHERE id = ?', 
-        (session['user_id'],)
-    ).fetchone()
-    conn.close()
+    user = storage.obtener_usuario(session['user_id'], max_staleness=STALENESS_PERFIL)
     
     if not user:
         flash('❌ Usuario no encontrado', 'danger')
         return redirect(url_for('logout'))
     
-    return render_template('perfil.html', user=user)
+    return render_template('perfil.html', user=user, mfa_activo=obtener_mfa_store().activo(user['id']))
+
+@app.route('/perfil/mfa')
+@login_required
+def perfil_mfa():
+    """Estado y alta de la verificación en dos pasos"""
+    from mfa import uri_otpauth
+    
+    mfa_store = obtener_mfa_store()
+    user_id = session['user_id']
+    
+    if mfa_store.activo(user_id):
+        return render_template(
+            'perfil_mfa.html',
+            activo=True,
+            restantes=mfa_store.codigos_respaldo_restantes(user_id)
+        )
+    
+    secreto = mfa_store.secreto_pendiente(user_id) or mfa_store.iniciar_alta(user_id)
+    return render_template(
+        'perfil_mfa.html',
+        activo=False,
+        secreto=secreto,
+        uri=uri_otpauth(secreto, session['username'])
+    )
+
+@app.route('/perfil/mfa/activar', methods=['POST'])
+@login_required
+def perfil_mfa_activar():
+    """Confirma el alta con un código de la app y muestra los códigos de respaldo"""
+    respaldo = obtener_mfa_store().confirmar_alta(session['user_id'], request.form.get('codigo', '').strip())
+    
+    if respaldo is None:
+        flash('❌ Código incorrecto. Revisa la hora de tu dispositivo e inténtalo de nuevo', 'danger')
+        return redirect(url_for('perfil_mfa'))
+    
+    flash('✅ Verificación en dos pasos activada', 'success')
+    return render_template('perfil_mfa.html', activo=True, respaldo=respaldo)
+
+@app.route('/perfil/mfa/desactivar', methods=['POST'])
+@login_required
+def perfil_mfa_desactivar():
+    """Desactiva MFA; exige un código válido"""
+    if not obtener_mfa_store().verificar(session['user_id'], request.form.get('codigo', '')):
+        flash('❌ Código incorrecto', 'danger')
+        return redirect(url_for('perfil_mfa'))
+    
+    obtener_mfa_store().desactivar(session['user_id'])
+    flash('✅ Verificación en dos pasos desactivada', 'info')
+    return redirect(url_for('perfil'))
 
 # ============================================================================
 # GESTIÓN DE USUARIOS (Solo Admin)
@@ -399,15 +777,199 @@ def perfil():
 @app.route('/admin/usuarios')
 @role_required(['admin'])
 def admin_usuarios():
-    """Administración de usuarios"""
-    conn = get_db_connection()
-    usuarios = conn.execute('''
-        SELECT * FROM usuarios 
-        ORDER BY fecha_creacion DESC
-    ''').fetchall()
-    conn.close()
+    """Administración de usuarios (HTML o JSON con ?formato=json)"""
+    # Tras una acción se lee del primario para mostrar el cambio
+    fresco = request.args.get('fresco') == '1'
+    usuarios = storage.listar_usuarios(max_staleness=None if fresco else STALENESS_ADMIN)
+    
+    if request.args.get('formato') == 'json':
+        return jsonify([
+            {k: v for k, v in u.items() if k != 'password_hash'} for u in usuarios
+        ])
+    
+    return render_template('admin_usuarios.html', usuarios=usuarios, roles=ROLES)
+
+ACCIONES_USUARIOS = ('activar', 'desactivar', 'cambiar_rol', 'eliminar')
+
+def aplicar_accion_usuarios(accion, ids, rol=None):
+    """
+    Ejecuta una acción masiva y revoca las sesiones afectadas
+
+    La cuenta del propio admin se excluye para que no pueda bloquearse.
+    Devuelve (afectados, excluidos).
+    """
+    excluidos = [i for i in ids if i == session['user_id']]
+    ids = [i for i in ids if i != session['user_id']]
+    # Antes del cambio: tras eliminar ya no se podría saber a quién afectó
+    anteriores = [u for u in (storage.obtener_usuario(i) for i in ids) if u is not None]
+    
+    if accion == 'activar':
+        afectados = storage.modificar_usuarios(ids, activo=True)
+    elif accion == 'desactivar':
+        afectados = storage.modificar_usuarios(ids, activo=False)
+    elif accion == 'cambiar_rol':
+        afectados = storage.modificar_usuarios(ids, rol=rol)
+    else:
+        afectados = storage.eliminar_usuarios(ids)
+    
+    # La siguiente petición de esos usuarios vuelve a leer su registro
+    user_cache.invalidar(ids)
+    print(f"🛠️  {session.get('username')} -> {accion} {ids} ({afectados} afectados)")
+    
+    for user in anteriores:
+        detalle = f"{accion} por {session.get('username')}"
+        if accion == 'cambiar_rol':
+            detalle = f"cambiar_rol {user['rol']} -> {rol} por {session.get('username')}"
+        audit_log.registrar(
+            audit.CUENTA_ADMIN, user['username'], user['id'], user['rol'],
+            request.remote_addr, detalle
+        )
+    
+    return afectados, excluidos
+
+@app.route('/admin/usuarios/accion', methods=['POST'])
+@role_required(['admin'])
+def admin_usuarios_accion():
+    """
+    Activar, desactivar, cambiar rol o eliminar varios usuarios a la vez
+
+    Formulario: ids (repetido), accion, rol
+    JSON: {"ids": [1, 2], "accion": "cambiar_rol", "rol": "invitado"}
+    """
+    if request.is_json:
+        datos = request.get_json(silent=True) or {}
+        ids_crudos = datos.get('ids') or []
+        accion = datos.get('accion')
+        rol = datos.get('rol')
+    else:
+        # Un formulario se puede enviar desde otro sitio; un POST JSON no sin CORS
+        if not hmac.compare_digest(request.form.get('csrf_token', ''), csrf_token()):
+            flash('⚠️ El formulario caducó, vuelve a intentarlo', 'danger')
+            return redirect(url_for('admin_usuarios'))
+        ids_crudos = request.form.getlist('ids')
+        accion = request.form.get('accion')
+        rol = request.form.get('rol')
+    
+    try:
+        ids = sorted({int(i) for i in ids_crudos})
+    except (TypeError, ValueError):
+        ids = None
+    
+    error = None
+    if accion not in ACCIONES_USUARIOS:
+        error = 'Acción inválida'
+    elif not ids:
+        error = 'No se seleccionó ningún usuario válido'
+    elif accion == 'cambiar_rol' and rol not in ROLES:
+        error = 'Rol inválido'
+    
+    if error:
+        if request.is_json:
+            return jsonify({'ok': False, 'error': error}), 400
+        flash(f'⚠️ {error}', 'danger')
+        return redirect(url_for('admin_usuarios'))
+    
+    afectados, excluidos = aplicar_accion_usuarios(accion, ids, rol)
+    
+    if request.is_json:
+        return jsonify({'ok': True, 'accion': accion, 'afectados': afectados, 'excluidos': excluidos})
+    
+    if excluidos:
+        flash('⚠️ Tu propia cuenta no se modifica desde aquí', 'warning')
+    flash(f'✅ Acción "{accion}" aplicada a {afectados} usuario(s)', 'success')
+    return redirect(url_for('admin_usuarios', fresco=1))
+
+@app.route('/admin/auditoria')
+@role_required(['admin'])
+def admin_auditoria():
+    """Eventos de autenticación recientes (filtrables por tipo, usuario y horas)"""
+    tipo = request.args.get('tipo', audit.LOGIN_FALLO)
+    if tipo not in audit.TIPOS:
+        tipo = None
+    username = request.args.get('username', '').strip() or None
+    horas = request.args.get('horas', 24, type=int)
+    
+    eventos = audit_log.consultar(
+        tipo=tipo,
+        username=username,
+        desde=datetime.now().timestamp() - horas * 3600,
+        limite=200
+    )
+    
+    return render_template(
+        'admin_auditoria.html',
+        eventos=eventos,
+        tipos=audit.TIPOS,
+        filtro={'tipo': tipo, 'username': username or '', 'horas': horas}
+    )
+
+@app.route('/admin/analytics')
+@role_required(['admin'])
+def admin_analytics():
+    """Logins por intervalo, tasa de fallos y usuarios activos por rol"""
+    from analytics import GRANULARIDADES, max_buckets
+    
+    granularidad = request.args.get('granularidad', 'hora')
+    if granularidad not in GRANULARIDADES:
+        granularidad = 'hora'
+    # Más allá de la retención los intervalos ya se borraron y saldrían a 0
+    buckets = min(max(request.args.get('buckets', 24, type=int), 1), max_buckets(granularidad))
+    
+    serie = obtener_rollups().serie(granularidad, buckets)
+    maximo = max([b['ok'] + b['fallo'] for b in serie] + [1])
+    
+    return render_template(
+        'admin_analytics.html',
+        serie=serie,
+        maximo=maximo,
+        granularidad=granularidad,
+        granularidades=GRANULARIDADES,
+        buckets=buckets
+    )
+
+@app.route('/admin/backups', methods=['GET', 'POST'])
+@role_required(['admin'])
+def admin_backups():
+    """
+    Snapshots de la base de datos
+
+    GET: lista (HTML o JSON con ?formato=json)
+    POST: lanza un backup en segundo plano (completa=1 para forzar copia completa)
+    """
+    if request.method == 'POST':
+        completa = (request.get_json(silent=True) or {}).get('completa') if request.is_json \
+            else request.form.get('completa') == '1'
+        lanzado = obtener_backups().crear_en_segundo_plano(bool(completa))
+        if lanzado:
+            print(f"💾 {session.get('username')} -> backup {'completo' if completa else 'incremental'}")
+        
+        if request.is_json:
+            if not lanzado:
+                return jsonify({'ok': False, 'error': 'Ya hay un backup en curso'}), 409
+            return jsonify({'ok': True}), 202
+        if lanzado:
+            flash('💾 Backup iniciado en segundo plano', 'success')
+        else:
+            flash('⚠️ Ya hay un backup en curso', 'warning')
+        return redirect(url_for('admin_backups'))
     
-    return render_template('admin_usuarios.html', usuarios=usuarios)
+    estado = obtener_backups().estado()
+    if request.args.get('formato') == 'json':
+        return jsonify(estado)
+    
+    return render_template('admin_backups.html', estado=estado)
+
+@app.template_global()
+def csrf_token():
+    """Token por sesión para los formularios que cambian datos"""
+    if 'csrf_token' not in session:
+        session['csrf_token'] = secrets.token_urlsafe(32)
+    return session['csrf_token']
+
+@app.template_filter('fecha')
+def formato_fecha(ts):
+    """Convierte un timestamp Unix en fecha legible"""
+    return datetime.fromtimestamp(ts).strftime('%Y-%m-%d %H:%M:%S')
 
 # ============================================================================
 # CERRAR SESIÓN
@@ -417,10 +979,84 @@ def admin_usuarios():
 def logout():
     """Cierra la sesión del usuario"""
     nombre = session.get('nombre', 'Usuario')
+    if 'user_id' in session:
+        audit_log.registrar(
+            audit.LOGOUT, session.get('username'), session['user_id'], session.get('rol'),
+            request.remote_addr
+        )
     session.clear()
     flash(f'👋 Hasta luego, {nombre}. Has cerrado sesión correctamente', 'info')
     return redirect(url_for('login'))
 
+# ============================================================================
+# SALUD Y DISPONIBILIDAD
+# ============================================================================
+
+# No cuentan como tráfico: un balanceador las consulta cada segundo
+RUTAS_SALUD = ('/healthz', '/readyz', '/estado')
+
+@app.before_request
+def contar_peticion():
+    if request.path not in RUTAS_SALUD:
+        g.contada = True
+        monitor.inicio_peticion()
+
+@app.after_request
+def registrar_respuesta(response):
+    if g.get('contada'):
+        monitor.registrar_respuesta(response.status_code)
+    return response
+
+@app.teardown_request
+def fin_peticion(exc):
+    if g.get('contada'):
+        monitor.fin_peticion()
+
+@app.route('/healthz')
+def healthz():
+    """Vivo: el proceso responde (no comprueba dependencias)"""
+    return jsonify({'status': 'ok'})
+
+@app.route('/readyz')
+def readyz():
+    """Disponible para recibir tráfico: 200 o 503 con el detalle de cada comprobación"""
+    preparado, comprobaciones = monitor.disponibilidad()
+    return jsonify({
+        'status': 'ok' if preparado else 'no_disponible',
+        'pid': os.getpid(),
+        'comprobaciones': comprobaciones,
+    }), 200 if preparado else 503
+
+@app.route('/estado')
+def estado_worker():
+    """
+    Estado de este worker en JSON: memoria, hilos, uptime, colas y arranque
+
+    Con sesión de admin, con ESTADO_TOKEN o desde una IP de ESTADO_IPS.
+    No se fía de loopback: detrás de un proxy en la misma máquina todas
+    las peticiones llegan desde 127.0.0.1.
+    """
+    token = request.headers.get('X-Estado-Token', '')
+    autorizado = (
+        (ESTADO_TOKEN and hmac.compare_digest(token.encode('utf-8'), ESTADO_TOKEN.encode('utf-8')))
+        or request.remote_addr in ESTADO_IPS
+        or ('user_id' in session and sesion_vigente() and session.get('rol') == 'admin')
+    )
+    if not autorizado:
+        return jsonify({'error': 'No autorizado'}), 403
+    
+    estado = monitor.estado()
+    estado['arranque_ms'] = {fase: round(s * 1000, 1) for fase, s in TIEMPOS_ARRANQUE.items()}
+    estado['colas'] = {
+        'auditoria': audit_log.pendientes(),
+        'backup_en_curso': 'backups' in _servicios and _servicios['backups'].en_curso,
+    }
+    estado['user_cache'] = len(user_cache)
+    replicas = [s for s in getattr(storage, 'shards', [storage]) if hasattr(s, 'antiguedad_replica')]
+    if replicas:
+        estado['replica_antiguedad_s'] = [s.antiguedad_replica() for s in replicas]
+    return jsonify(estado)
+
 # ============================================================================
 # MANEJO DE ERRORES
 # ============================================================================
@@ -444,13 +1080,22 @@ if __name__ == '__main__':
     
     # Inicializar base de datos
     init_db()
+    marcar_fase('init_db')
+    
+    print(f"\n🧩 Plantillas precompiladas: {TOTAL_PLANTILLAS}")
+    
+    print("\n⏱️  TIEMPO DE ARRANQUE")
+    print("="*70)
+    for fase, segundos in TIEMPOS_ARRANQUE.items():
+        print(f"   {fase:15} {segundos * 1000:8.1f} ms")
+    print(f"   {'TOTAL':15} {sum(TIEMPOS_ARRANQUE.values()) * 1000:8.1f} ms")
     
     print("\n🌐 SERVIDOR INICIADO")
     print("="*70)
     print(f"📍 URL: http://127.0.0.1:5000")
     print(f"📍 URL Local: http://localhost:5000")
     print(f"🔐 Algoritmo: bcrypt (rounds=12)")
-    print(f"💾 Base de datos: {DATABASE}")
+    print(f"💾 Base de datos: {DATABASE} (backend: {STORAGE_BACKEND})")
     print("="*70)
     print("\n💡 Presiona Ctrl+C para detener el servidor\n")
     
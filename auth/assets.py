@@ -0,0 +1,263 @@
+"""
+Pipeline de archivos estáticos de SECURELINK
+
+- Huella digital: cada archivo de static/ se publica también como
+  /assets/<ruta con hash>, p. ej. css/custom.3f9a1c2b.css, y se sirve con
+  Cache-Control inmutable de un año. Si el archivo cambia, cambia la URL.
+- ETag y 304: el ETag es el hash del contenido.
+- Variantes precomprimidas: al arrancar se generan .gz (y .br si el módulo
+  brotli está instalado) y se eligen según Accept-Encoding.
+- CDN local: `python assets.py vendor` descarga Bootstrap, Bootstrap
+  Icons y la fuente Inter a static/vendor/; si existen, las plantillas
+  los usan en lugar del CDN. El CSS de Google Fonts se reescribe para
+  apuntar a los .woff2 descargados, así no queda ninguna petición a
+  terceros.
+
+Uso en plantillas:
+    {{ asset_url('css/custom.css') }}
+    {{ cdn_url('bootstrap_css') }}
+"""
+
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+import sys
+import tempfile
+
+from flask import abort, request, send_file, url_for
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Un año: los archivos con huella nunca cambian de contenido
+MAX_AGE_INMUTABLE = 31536000
+
+# Solo se precomprimen formatos de texto
+EXTENSIONES_COMPRIMIBLES = {'.css', '.js', '.svg', '.json', '.txt', '.ico', '.map'}
+
+# Recursos de CDN que se pueden servir localmente: nombre -> (url, ruta en static/)
+CDN_ASSETS = {
+    'bootstrap_css': (
+        'https://cdn.jsdelivr.net/npm/bootstrap@5.3.0/dist/css/bootstrap.min.css',
+        'vendor/bootstrap/bootstrap.min.css',
+    ),
+    'bootstrap_js': (
+        'https://cdn.jsdelivr.net/npm/bootstrap@5.3.0/dist/js/bootstrap.bundle.min.js',
+        'vendor/bootstrap/bootstrap.bundle.min.js',
+    ),
+    'bootstrap_icons_css': (
+        'https://cdn.jsdelivr.net/npm/bootstrap-icons@1.11.0/font/bootstrap-icons.css',
+        'vendor/bootstrap-icons/bootstrap-icons.css',
+    ),
+    # bootstrap-icons.css referencia ./fonts/ con rutas relativas
+    'bootstrap_icons_woff2': (
+        'https://cdn.jsdelivr.net/npm/bootstrap-icons@1.11.0/font/fonts/bootstrap-icons.woff2',
+        'vendor/bootstrap-icons/fonts/bootstrap-icons.woff2',
+    ),
+    'bootstrap_icons_woff': (
+        'https://cdn.jsdelivr.net/npm/bootstrap-icons@1.11.0/font/fonts/bootstrap-icons.woff',
+        'vendor/bootstrap-icons/fonts/bootstrap-icons.woff',
+    ),
+    # vendor() descarga también los .woff2 que referencia y reescribe sus URLs
+    'fuentes_css': (
+        'https://fonts.googleapis.com/css2?family=Inter:wght@400;500;600;700;800&display=swap',
+        'vendor/fonts/inter.css',
+    ),
+}
+
+# Google Fonts solo devuelve woff2 a navegadores que lo soportan
+USER_AGENT_FUENTES = (
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 '
+    '(KHTML, like Gecko) Chrome/120.0 Safari/537.36'
+)
+URL_FUENTE = re.compile(r'url\((https://fonts\.gstatic\.com/[^)]+)\)')
+
+
+class AssetPipeline:
+    """Manifiesto de huellas y servidor de /assets para una app Flask"""
+
+    def __init__(self, app, cache_dir):
+        self.app = app
+        self.static_folder = app.static_folder
+        self.cache_dir = cache_dir
+        self.manifest = {}    # ruta lógica -> ruta con huella
+        self.archivos = {}    # ruta con huella -> (ruta lógica, hash)
+        self.hashes = {}      # ruta lógica -> hash
+
+        self.construir()
+
+        app.add_url_rule('/assets/<path:filename>', 'assets', self.servir)
+        app.add_url_rule('/favicon.ico', 'favicon', self.servir_favicon)
+        app.jinja_env.globals['asset_url'] = self.asset_url
+        app.jinja_env.globals['cdn_url'] = self.cdn_url
+        app.jinja_env.globals['cdn_local'] = self.cdn_local
+
+    # --- Construcción ------------------------------------------------------
+
+    def construir(self):
+        """Calcula las huellas y genera las variantes comprimidas"""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.manifest.clear()
+        self.archivos.clear()
+        self.hashes.clear()
+
+        for raiz, _, nombres in os.walk(self.static_folder):
+            for nombre in nombres:
+                path = os.path.join(raiz, nombre)
+                logica = os.path.relpath(path, self.static_folder).replace(os.sep, '/')
+                with open(path, 'rb') as f:
+                    contenido = f.read()
+
+                digest = hashlib.sha256(contenido).hexdigest()[:16]
+                base, ext = os.path.splitext(logica)
+                con_huella = f'{base}.{digest[:8]}{ext}'
+
+                self.manifest[logica] = con_huella
+                self.archivos[con_huella] = (logica, digest)
+                self.hashes[logica] = digest
+
+                if ext.lower() in EXTENSIONES_COMPRIMIBLES:
+                    self._precomprimir(digest, contenido)
+
+    def _precomprimir(self, digest, contenido):
+        variantes = [('gz', lambda datos: gzip.compress(datos, compresslevel=9, mtime=0))]
+        if brotli is not None:
+            variantes.append(('br', lambda datos: brotli.compress(datos, quality=11)))
+
+        for sufijo, comprimir in variantes:
+            destino = os.path.join(self.cache_dir, f'{digest}.{sufijo}')
+            if os.path.exists(destino):
+                continue
+            comprimido = comprimir(contenido)
+            # Si no ahorra nada no merece la pena servirlo
+            if len(comprimido) >= len(contenido):
+                continue
+            # Temporal único: varios workers construyen la caché a la vez al arrancar
+            fd, temporal = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(comprimido)
+                os.replace(temporal, destino)
+            finally:
+                if os.path.exists(temporal):
+                    os.remove(temporal)
+
+    # --- Helpers de plantillas ---------------------------------------------
+
+    def asset_url(self, filename):
+        """URL con huella de un archivo de static/ (o /static si no existe)"""
+        con_huella = self.manifest.get(filename)
+        if con_huella is None:
+            return url_for('static', filename=filename)
+        return url_for('assets', filename=con_huella)
+
+    def cdn_local(self, nombre):
+        """True si el recurso se descargó con `vendor`"""
+        return CDN_ASSETS[nombre][1] in self.manifest
+
+    def cdn_url(self, nombre):
+        """Copia local del recurso si se descargó con `vendor`; si no, el CDN"""
+        url, local = CDN_ASSETS[nombre]
+        if local in self.manifest:
+            return self.asset_url(local)
+        return url
+
+    # --- Servidor ----------------------------------------------------------
+
+    def servir(self, filename):
+        entrada = self.archivos.get(filename)
+        if entrada is not None:
+            logica, digest = entrada
+            inmutable = True
+        elif filename in self.hashes:
+            # Ruta sin huella (p. ej. fuentes referenciadas desde un CSS)
+            logica, digest = filename, self.hashes[filename]
+            inmutable = False
+        else:
+            abort(404)
+
+        path = os.path.join(self.static_folder, logica)
+        mimetype = mimetypes.guess_type(logica)[0] or 'application/octet-stream'
+
+        encoding = None
+        for sufijo, nombre in (('br', 'br'), ('gz', 'gzip')):
+            variante = os.path.join(self.cache_dir, f'{digest}.{sufijo}')
+            if request.accept_encodings[nombre] and os.path.exists(variante):
+                path, encoding = variante, nombre
+                break
+
+        etag = f'{digest}-{encoding}' if encoding else digest
+        # Sin huella: max_age=None hace que send_file responda con no-cache
+        response = send_file(
+            path,
+            mimetype=mimetype,
+            etag=etag,
+            conditional=True,
+            max_age=MAX_AGE_INMUTABLE if inmutable else None,
+        )
+
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        response.vary.add('Accept-Encoding')
+        if inmutable:
+            response.cache_control.public = True
+            response.cache_control.immutable = True
+        return response
+
+    def servir_favicon(self):
+        # Los navegadores piden /favicon.ico sin huella: se revalida con ETag
+        return self.servir('favicon.ico')
+
+
+def _descargar(url):
+    # Solo lo usa `vendor`: no se carga al arrancar la app
+    import urllib.request
+
+    peticion = urllib.request.Request(url, headers={'User-Agent': USER_AGENT_FUENTES})
+    with urllib.request.urlopen(peticion, timeout=30) as respuesta:
+        return respuesta.read()
+
+
+def _localizar_fuentes(css, directorio):
+    """
+    Descarga los archivos de fuente que referencia un CSS de Google Fonts
+
+    Devuelve el CSS con las URLs cambiadas a rutas relativas a su carpeta.
+    """
+    locales = {}
+    for url in URL_FUENTE.findall(css):
+        if url in locales:
+            continue
+        nombre = url.rsplit('/', 1)[-1]
+        contenido = _descargar(url)
+        with open(os.path.join(directorio, nombre), 'wb') as f:
+            f.write(contenido)
+        print(f"   ✅ {nombre} ({len(contenido)} bytes)")
+        locales[url] = nombre
+    return URL_FUENTE.sub(lambda m: f'url(./{locales[m.group(1)]})', css)
+
+
+def vendor(static_folder):
+    """Descarga los recursos de CDN_ASSETS a static/vendor/"""
+    for nombre, (url, local) in CDN_ASSETS.items():
+        destino = os.path.join(static_folder, local)
+        os.makedirs(os.path.dirname(destino), exist_ok=True)
+        print(f"📥 {nombre}: {url}")
+        contenido = _descargar(url)
+        if nombre == 'fuentes_css':
+            css = _localizar_fuentes(contenido.decode('utf-8'), os.path.dirname(destino))
+            contenido = css.encode('utf-8')
+        with open(destino, 'wb') as f:
+            f.write(contenido)
+        print(f"   ✅ {local} ({len(contenido)} bytes)")
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2 or sys.argv[1] != 'vendor':
+        print("Uso: python assets.py vendor")
+        sys.exit(1)
+    vendor(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static'))
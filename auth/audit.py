@@ -0,0 +1,278 @@
+"""
+Registro de auditoría de autenticación de SECURELINK
+
+Los eventos (login correcto, login fallido, logout, registro y cambios de
+cuentas hechos por un admin) se apuntan
+en un buffer circular en memoria; un hilo en segundo plano los vuelca por
+lotes fuera del camino de la petición a uno de estos destinos:
+
+- SQLiteAuditSink: tabla append-only eventos_auth (triggers impiden
+  UPDATE y DELETE), indexada por usuario y por fecha
+- JsonlAuditSink: archivos JSONL con rotación por tamaño
+
+Si una escritura falla, el lote vuelve al principio del buffer y se
+reintenta en el siguiente volcado. Si el buffer se llena antes de
+volcarse, se descartan los eventos más antiguos y se cuentan en
+`descartados`.
+"""
+
+import atexit
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+
+LOGIN_OK = 'login_ok'
+LOGIN_FALLO = 'login_fallo'
+LOGOUT = 'logout'
+REGISTRO = 'registro'
+# Activar, desactivar, cambiar rol o eliminar una cuenta desde el panel de admin
+CUENTA_ADMIN = 'cuenta_admin'
+
+TIPOS = (LOGIN_OK, LOGIN_FALLO, LOGOUT, REGISTRO, CUENTA_ADMIN)
+
+SCHEMA_EVENTOS = [
+    '''
+    CREATE TABLE IF NOT EXISTS eventos_auth (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        ts REAL NOT NULL,
+        tipo TEXT NOT NULL,
+        username TEXT,
+        user_id INTEGER,
+        rol TEXT,
+        ip TEXT,
+        detalle TEXT
+    )
+    ''',
+    'CREATE INDEX IF NOT EXISTS idx_eventos_username_ts ON eventos_auth (username, ts)',
+    'CREATE INDEX IF NOT EXISTS idx_eventos_tipo_ts ON eventos_auth (tipo, ts)',
+    '''
+    CREATE TRIGGER IF NOT EXISTS eventos_auth_no_update
+    BEFORE UPDATE ON eventos_auth
+    BEGIN SELECT RAISE(ABORT, 'eventos_auth es append-only'); END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS eventos_auth_no_delete
+    BEFORE DELETE ON eventos_auth
+    BEGIN SELECT RAISE(ABORT, 'eventos_auth es append-only'); END
+    ''',
+]
+
+COLUMNAS = ('ts', 'tipo', 'username', 'user_id', 'rol', 'ip', 'detalle')
+
+
+# ============================================================================
+# DESTINOS
+# ============================================================================
+
+class SQLiteAuditSink:
+    """Tabla append-only eventos_auth en la base de datos principal"""
+
+    def __init__(self, database):
+        self.database = database
+        self._esquema_listo = False
+
+    def _conectar(self):
+        # La tabla se crea en el primer uso (hilo de volcado), no al arrancar
+        conn = sqlite3.connect(self.database)
+        if not self._esquema_listo:
+            for sentencia in SCHEMA_EVENTOS:
+                conn.execute(sentencia)
+            conn.commit()
+            self._esquema_listo = True
+        return conn
+
+    def escribir(self, eventos):
+        conn = self._conectar()
+        with conn:
+            conn.executemany(
+                'INSERT INTO eventos_auth (ts, tipo, username, user_id, rol, ip, detalle) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                [tuple(e[c] for c in COLUMNAS) for e in eventos]
+            )
+        conn.close()
+
+    def consultar(self, tipo=None, username=None, desde=None, limite=100):
+        condiciones, params = [], []
+        if tipo:
+            condiciones.append('tipo = ?')
+            params.append(tipo)
+        if username:
+            condiciones.append('username = ?')
+            params.append(username)
+        if desde is not None:
+            condiciones.append('ts >= ?')
+            params.append(desde)
+
+        query = 'SELECT * FROM eventos_auth'
+        if condiciones:
+            query += ' WHERE ' + ' AND '.join(condiciones)
+        query += ' ORDER BY ts DESC LIMIT ?'
+        params.append(limite)
+
+        conn = self._conectar()
+        conn.row_factory = sqlite3.Row
+        rows = conn.execute(query, params).fetchall()
+        conn.close()
+        return [dict(row) for row in rows]
+
+
+class JsonlAuditSink:
+    """Archivos JSONL con rotación: audit.jsonl, audit.jsonl.1, ..."""
+
+    def __init__(self, directorio, max_bytes=10 * 1024 * 1024, copias=5):
+        os.makedirs(directorio, exist_ok=True)
+        self.path = os.path.join(directorio, 'audit.jsonl')
+        self.max_bytes = max_bytes
+        self.copias = copias
+
+    def _rotar(self):
+        for i in range(self.copias - 1, 0, -1):
+            origen = f'{self.path}.{i}'
+            if os.path.exists(origen):
+                os.replace(origen, f'{self.path}.{i + 1}')
+        os.replace(self.path, f'{self.path}.1')
+
+    def escribir(self, eventos):
+        if os.path.exists(self.path) and os.path.getsize(self.path) >= self.max_bytes:
+            self._rotar()
+        lineas = ''.join(json.dumps(e, ensure_ascii=False) + '\n' for e in eventos)
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(lineas)
+
+    def consultar(self, tipo=None, username=None, desde=None, limite=100):
+        # Solo se lee el archivo actual, del final hacia el principio
+        if not os.path.exists(self.path):
+            return []
+        with open(self.path, encoding='utf-8') as f:
+            lineas = f.readlines()
+
+        resultado = []
+        for linea in reversed(lineas):
+            evento = json.loads(linea)
+            if desde is not None and evento['ts'] < desde:
+                break
+            if tipo and evento['tipo'] != tipo:
+                continue
+            if username and evento['username'] != username:
+                continue
+            resultado.append(evento)
+            if len(resultado) >= limite:
+                break
+        return resultado
+
+
+# ============================================================================
+# REGISTRO CON BUFFER CIRCULAR
+# ============================================================================
+
+class AuditLog:
+    """
+    Buffer circular + volcado por lotes en segundo plano
+
+    registrar() solo añade un diccionario al deque; el hilo de volcado
+    escribe cuando hay `lote` eventos pendientes o cada `intervalo`
+    segundos, lo que ocurra primero. Tras escribir cada lote se llama a
+    los suscriptores (p. ej. los rollups de analytics.py) con ese lote.
+    """
+
+    def __init__(self, sink, capacidad=10000, lote=200, intervalo=1.0):
+        self.sink = sink
+        self.lote = lote
+        self.intervalo = intervalo
+        self.descartados = 0
+        self.suscriptores = []
+        self._buffer = deque(maxlen=capacidad)
+        self._lock = threading.Lock()
+        self._pendiente = threading.Event()
+        self._detener = threading.Event()
+        self._hilo = threading.Thread(
+            target=self._bucle, name='securelink-audit', daemon=True
+        )
+        self._hilo.start()
+        atexit.register(self.cerrar)
+
+    def suscribir(self, callback):
+        """callback(eventos) se ejecuta en el hilo de volcado tras cada lote"""
+        self.suscriptores.append(callback)
+
+    def registrar(self, tipo, username=None, user_id=None, rol=None, ip=None, detalle=None):
+        """Apunta un evento; no hace I/O"""
+        evento = {
+            'ts': time.time(),
+            'tipo': tipo,
+            'username': username,
+            'user_id': user_id,
+            'rol': rol,
+            'ip': ip,
+            'detalle': detalle,
+        }
+        with self._lock:
+            if len(self._buffer) == self._buffer.maxlen:
+                self.descartados += 1
+            self._buffer.append(evento)
+            if len(self._buffer) >= self.lote:
+                self._pendiente.set()
+
+    def volcar(self):
+        """Escribe todos los eventos pendientes en el destino"""
+        while True:
+            with self._lock:
+                if not self._buffer:
+                    return
+                eventos = [self._buffer.popleft() for _ in range(min(self.lote, len(self._buffer)))]
+            try:
+                self.sink.escribir(eventos)
+            except Exception as e:
+                print(f"Error al volcar auditoría ({len(eventos)} eventos): {e}")
+                self._devolver(eventos)
+                return
+            for callback in self.suscriptores:
+                try:
+                    callback(eventos)
+                except Exception as e:
+                    print(f"Error en suscriptor de auditoría: {e}")
+
+    def _devolver(self, eventos):
+        """
+        Vuelve a poner al principio del buffer un lote que no se pudo escribir
+
+        Si mientras tanto se llenó, se descartan los más antiguos del lote
+        (nunca los eventos nuevos) y se cuentan en `descartados`.
+        """
+        with self._lock:
+            sobran = max(0, len(eventos) - (self._buffer.maxlen - len(self._buffer)))
+            self.descartados += sobran
+            self._buffer.extendleft(reversed(eventos[sobran:]))
+
+    def _bucle(self):
+        while not self._detener.is_set():
+            self._pendiente.wait(self.intervalo)
+            self._pendiente.clear()
+            self.volcar()
+
+    def cerrar(self):
+        """Detiene el hilo y vuelca lo que quede en el buffer"""
+        self._detener.set()
+        self._pendiente.set()
+        self._hilo.join(timeout=5)
+        self.volcar()
+
+    def pendientes(self):
+        return len(self._buffer)
+
+    def consultar(self, tipo=None, username=None, desde=None, limite=100):
+        """Eventos más recientes primero (incluye los aún no volcados)"""
+        self.volcar()
+        return self.sink.consultar(tipo=tipo, username=username, desde=desde, limite=limite)
+
+
+def crear_audit_log(database, destino='sqlite', directorio='logs'):
+    """destino: 'sqlite' (tabla eventos_auth) o 'jsonl' (archivos rotados)"""
+    if destino == 'sqlite':
+        return AuditLog(SQLiteAuditSink(database))
+    if destino == 'jsonl':
+        return AuditLog(JsonlAuditSink(directorio))
+    raise ValueError(f'Destino de auditoría desconocido: {destino}')
@@ -0,0 +1,566 @@
+"""
+================================================================================
+SECURELINK - Backups online y snapshots
+================================================================================
+Copias de seguridad de securelink.db (y de sus shards) sin parar la
+aplicación:
+
+- La copia usa la API de backup online de SQLite por pasos de pocas
+  páginas, con una pausa entre pasos para no acaparar el disco ni el
+  lock de lectura frente a las peticiones en curso. Cada escritura de
+  otra conexión reinicia la copia; tras MAX_REINICIOS se copia de una
+  vez, en una sola transacción de lectura, para que termine aunque haya
+  escrituras continuas. El primario está en modo WAL (ver storage.py),
+  así que esa copia no bloquea a los escritores.
+- Snapshots completos o incrementales. Un incremental solo guarda las
+  páginas que cambiaron respecto al snapshot anterior (se comparan los
+  hashes de página guardados en cada snapshot). Restaurar un snapshot
+  reconstruye el archivo tal y como estaba en ese momento.
+- Todo se guarda comprimido con gzip.
+- Restauración verificada: el archivo reconstruido se comprueba con su
+  SHA-256 y con PRAGMA integrity_check antes de reemplazar nada.
+
+Estructura en disco:
+    backups/<id>/manifest.json
+    backups/<id>/<archivo>.gz         copia completa del archivo
+    backups/<id>/<archivo>.delta.gz   páginas cambiadas (incremental)
+    backups/<id>/<archivo>.hashes     hashes de página para el siguiente
+
+Ejemplos:
+    python backup.py crear
+    python backup.py crear --completa
+    python backup.py listar
+    python backup.py verificar 20240101T120000-incremental
+    python backup.py restaurar 20240101T120000-incremental
+    python backup.py purgar --conservar 2
+================================================================================
+"""
+
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import struct
+import sys
+import tempfile
+import threading
+import time
+import zlib
+
+# Páginas copiadas por paso y pausa (segundos) entre pasos
+PAGINAS_POR_PASO = 64
+PAUSA_PASO = 0.005
+# Reinicios por escrituras concurrentes antes de copiar en un solo paso
+MAX_REINICIOS = 3
+# Incrementales seguidos antes de forzar una copia completa
+MAX_INCREMENTALES = 24
+
+COMPLETA = 'completa'
+INCREMENTAL = 'incremental'
+
+TAM_HASH = 16
+CABECERA_PAGINA = struct.Struct('>I')
+
+
+class BackupError(Exception):
+    """Snapshot inexistente, incompleto o que no supera la verificación"""
+
+
+class _CopiaReiniciada(Exception):
+    """La copia por pasos se reinició demasiadas veces"""
+
+
+# ============================================================================
+# COPIA ONLINE Y PÁGINAS
+# ============================================================================
+
+def copia_online(origen, destino, paginas=PAGINAS_POR_PASO, pausa=PAUSA_PASO,
+                 max_reinicios=MAX_REINICIOS):
+    """
+    Copia consistente de una base de datos en uso
+
+    Si otra conexión escribe durante la copia, SQLite la reinicia desde
+    el principio; con escrituras continuas la copia por pasos no acabaría
+    nunca. Tras `max_reinicios` se abandona y se copia todo en un paso
+    (pages=-1): dentro de una sola transacción de lectura, así que no se
+    reinicia. Con el origen en modo WAL las escrituras siguen durante la
+    copia (van al -wal); en modo DELETE esperarían al lock hasta el final.
+    Se usa la API de backup y no VACUUM INTO porque conserva la
+    disposición de las páginas, y de eso dependen los incrementales.
+
+    La copia se deja en modo DELETE: un archivo WAL abierto con mode=ro
+    (réplicas, verificación) dejaría -wal y -shm junto a él.
+    """
+    anterior = [None]
+    reinicios = [0]
+
+    def progreso(estado, restantes, total):
+        # Tras un reinicio quedan tantas páginas como al principio, o más
+        # (un paso BUSY/LOCKED no copia nada y no cuenta)
+        if estado == sqlite3.SQLITE_OK and anterior[0] is not None and restantes >= anterior[0]:
+            reinicios[0] += 1
+            if reinicios[0] > max_reinicios:
+                raise _CopiaReiniciada()
+        anterior[0] = restantes
+        if restantes and pausa:
+            time.sleep(pausa)
+
+    fuente = sqlite3.connect(origen)
+    copia = sqlite3.connect(destino)
+    try:
+        try:
+            fuente.backup(copia, pages=paginas, progress=progreso)
+        except _CopiaReiniciada:
+            print(f"⚠️  {os.path.basename(origen)}: {max_reinicios} reinicios por escrituras, "
+                  f"se copia en un solo paso")
+            fuente.backup(copia, pages=-1)
+        copia.execute('PRAGMA journal_mode = DELETE')
+    finally:
+        copia.close()
+        fuente.close()
+
+
+def tam_pagina(path):
+    conn = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+    try:
+        return conn.execute('PRAGMA page_size').fetchone()[0]
+    finally:
+        conn.close()
+
+
+def leer_paginas(path, page_size):
+    """Genera (número, contenido) de cada página del archivo"""
+    with open(path, 'rb') as f:
+        numero = 0
+        while True:
+            pagina = f.read(page_size)
+            if not pagina:
+                break
+            yield numero, pagina
+            numero += 1
+
+
+def _hash_pagina(pagina):
+    return hashlib.blake2b(pagina, digest_size=TAM_HASH).digest()
+
+
+def _leer_hashes(path):
+    with open(path, 'rb') as f:
+        datos = f.read()
+    return [datos[i:i + TAM_HASH] for i in range(0, len(datos), TAM_HASH)]
+
+
+def verificar_archivo(path, sha256=None):
+    """Lanza BackupError si el archivo no coincide con su hash o está dañado"""
+    if sha256 is not None:
+        h = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for bloque in iter(lambda: f.read(1024 * 1024), b''):
+                h.update(bloque)
+        if h.hexdigest() != sha256:
+            raise BackupError(f'{os.path.basename(path)}: el SHA-256 no coincide')
+
+    conn = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+    try:
+        resultado = conn.execute('PRAGMA integrity_check').fetchone()[0]
+    except sqlite3.DatabaseError as e:
+        resultado = str(e)
+    finally:
+        conn.close()
+    if resultado != 'ok':
+        raise BackupError(f'{os.path.basename(path)}: integrity_check -> {resultado}')
+
+
+# ============================================================================
+# GESTOR DE SNAPSHOTS
+# ============================================================================
+
+def archivos_de_storage(database, storage=None):
+    """DATABASE más los archivos de cada shard (las réplicas no se copian)"""
+    archivos = [database]
+    for shard in getattr(storage, 'shards', []):
+        archivos.append(shard.database)
+    return archivos
+
+
+class GestorBackups:
+    """Crea, lista, verifica y restaura snapshots de un conjunto de archivos"""
+
+    def __init__(self, archivos, directorio='backups', paginas=PAGINAS_POR_PASO,
+                 pausa=PAUSA_PASO, max_incrementales=MAX_INCREMENTALES):
+        self.archivos = {os.path.basename(path): path for path in archivos}
+        self.directorio = directorio
+        self.paginas = paginas
+        self.pausa = pausa
+        self.max_incrementales = max_incrementales
+        self._lock = threading.Lock()
+        self.en_curso = False
+        self.ultimo_error = None
+
+    # --- Manifiestos -------------------------------------------------------
+
+    def _ruta(self, snapshot_id, nombre=''):
+        return os.path.join(self.directorio, snapshot_id, nombre)
+
+    def manifiesto(self, snapshot_id):
+        path = self._ruta(snapshot_id, 'manifest.json')
+        if not os.path.exists(path):
+            raise BackupError(f'Snapshot inexistente o incompleto: {snapshot_id}')
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+
+    def listar(self):
+        """Manifiestos de todos los snapshots completos en disco, del más antiguo al más reciente"""
+        if not os.path.isdir(self.directorio):
+            return []
+        snapshots = []
+        for snapshot_id in sorted(os.listdir(self.directorio)):
+            if os.path.exists(self._ruta(snapshot_id, 'manifest.json')):
+                snapshots.append(self.manifiesto(snapshot_id))
+        return snapshots
+
+    def cadena(self, snapshot_id):
+        """Snapshots necesarios para reconstruir snapshot_id, desde la copia completa"""
+        cadena = []
+        actual = snapshot_id
+        while actual is not None:
+            manifiesto = self.manifiesto(actual)
+            cadena.append(manifiesto)
+            actual = manifiesto['padre']
+        return list(reversed(cadena))
+
+    def _nuevo_id(self, tipo):
+        base = time.strftime('%Y%m%dT%H%M%S')
+        snapshot_id = f'{base}-{tipo}'
+        n = 1
+        while os.path.exists(self._ruta(snapshot_id)):
+            snapshot_id = f'{base}.{n}-{tipo}'
+            n += 1
+        return snapshot_id
+
+    # --- Crear -------------------------------------------------------------
+
+    def crear(self, completa=False):
+        """
+        Crea un snapshot y devuelve su manifiesto
+
+        Es incremental salvo que se pida completa, no haya snapshots
+        previos o la cadena ya tenga max_incrementales incrementales.
+        """
+        if not self._reservar():
+            raise BackupError('Ya hay un backup en curso')
+        return self._ejecutar(completa)
+
+    def _reservar(self):
+        with self._lock:
+            if self.en_curso:
+                return False
+            self.en_curso = True
+            return True
+
+    def _ejecutar(self, completa):
+        try:
+            manifiesto = self._crear(completa)
+            self.ultimo_error = None
+            return manifiesto
+        except Exception as e:
+            self.ultimo_error = str(e)
+            raise
+        finally:
+            self.en_curso = False
+
+    def _crear(self, completa):
+        inicio = time.monotonic()
+        previos = self.listar()
+        padre = previos[-1] if previos else None
+        if padre is not None and not completa:
+            incrementales = 0
+            for manifiesto in reversed(previos):
+                if manifiesto['tipo'] == COMPLETA:
+                    break
+                incrementales += 1
+            completa = incrementales >= self.max_incrementales
+        tipo = COMPLETA if completa or padre is None else INCREMENTAL
+
+        snapshot_id = self._nuevo_id(tipo)
+        # Se escribe en un directorio temporal: un snapshot a medias nunca
+        # aparece en listar()
+        temporal = self._ruta(snapshot_id + '.tmp')
+        os.makedirs(temporal)
+        manifiesto = {
+            'id': snapshot_id,
+            'tipo': tipo,
+            'padre': padre['id'] if tipo == INCREMENTAL else None,
+            'creado': time.time(),
+            'archivos': {},
+        }
+        try:
+            for nombre, path in self.archivos.items():
+                if not os.path.exists(path):
+                    continue
+                anterior = padre['archivos'].get(nombre) if tipo == INCREMENTAL else None
+                manifiesto['archivos'][nombre] = self._copiar_archivo(
+                    path, temporal, nombre, anterior, padre and padre['id']
+                )
+            manifiesto['duracion'] = time.monotonic() - inicio
+            with open(os.path.join(temporal, 'manifest.json'), 'w', encoding='utf-8') as f:
+                json.dump(manifiesto, f, indent=2)
+            os.replace(temporal, self._ruta(snapshot_id))
+        except BaseException:
+            shutil.rmtree(temporal, ignore_errors=True)
+            raise
+        return manifiesto
+
+    def _copiar_archivo(self, path, temporal, nombre, anterior, padre_id):
+        with tempfile.TemporaryDirectory(dir=temporal) as tmp:
+            copia = os.path.join(tmp, nombre)
+            copia_online(path, copia, self.paginas, self.pausa)
+            page_size = tam_pagina(copia)
+
+            hashes_previos = None
+            if anterior is not None and anterior['page_size'] == page_size:
+                hashes_previos = _leer_hashes(self._ruta(padre_id, nombre + '.hashes'))
+
+            sha = hashlib.sha256()
+            hashes = []
+            cambiadas = 0
+            if hashes_previos is None:
+                salida = gzip.open(os.path.join(temporal, nombre + '.gz'), 'wb')
+            else:
+                salida = gzip.open(os.path.join(temporal, nombre + '.delta.gz'), 'wb')
+
+            with salida:
+                for numero, pagina in leer_paginas(copia, page_size):
+                    sha.update(pagina)
+                    digest = _hash_pagina(pagina)
+                    hashes.append(digest)
+                    if hashes_previos is None:
+                        salida.write(pagina)
+                    elif numero >= len(hashes_previos) or hashes_previos[numero] != digest:
+                        salida.write(CABECERA_PAGINA.pack(numero))
+                        salida.write(pagina)
+                        cambiadas += 1
+
+        with open(os.path.join(temporal, nombre + '.hashes'), 'wb') as f:
+            f.write(b''.join(hashes))
+
+        return {
+            'modo': COMPLETA if hashes_previos is None else INCREMENTAL,
+            'page_size': page_size,
+            'paginas': len(hashes),
+            'paginas_guardadas': len(hashes) if hashes_previos is None else cambiadas,
+            'sha256': sha.hexdigest(),
+        }
+
+    def crear_en_segundo_plano(self, completa=False):
+        """Lanza crear() en un hilo; False si ya hay un backup en curso"""
+        if not self._reservar():
+            return False
+
+        def tarea():
+            try:
+                manifiesto = self._ejecutar(completa)
+                print(f"💾 Backup {manifiesto['id']} en {manifiesto['duracion']:.1f}s")
+            except Exception as e:
+                print(f"Error en el backup: {e}")
+
+        threading.Thread(target=tarea, name='securelink-backup', daemon=True).start()
+        return True
+
+    # --- Reconstruir y restaurar -------------------------------------------
+
+    def reconstruir(self, snapshot_id, nombre, destino):
+        """Escribe en destino el archivo `nombre` tal y como era en snapshot_id"""
+        cadena = self.cadena(snapshot_id)
+        final = cadena[-1]['archivos'].get(nombre)
+        if final is None:
+            raise BackupError(f'{nombre} no está en el snapshot {snapshot_id}')
+
+        # Desde la última copia completa de este archivo dentro de la cadena
+        inicio = max(
+            i for i, m in enumerate(cadena)
+            if m['archivos'].get(nombre, {}).get('modo') == COMPLETA
+        )
+        try:
+            self._aplicar_cadena(cadena[inicio:], nombre, destino)
+        except (OSError, EOFError, zlib.error) as e:
+            raise BackupError(f'{nombre}: snapshot dañado ({e})')
+
+        verificar_archivo(destino, final['sha256'])
+
+    def _aplicar_cadena(self, cadena, nombre, destino):
+        with gzip.open(self._ruta(cadena[0]['id'], nombre + '.gz'), 'rb') as datos, \
+                open(destino, 'wb') as f:
+            shutil.copyfileobj(datos, f, 1024 * 1024)
+
+        with open(destino, 'r+b') as f:
+            for manifiesto in cadena[1:]:
+                info = manifiesto['archivos'][nombre]
+                page_size = info['page_size']
+                with gzip.open(self._ruta(manifiesto['id'], nombre + '.delta.gz'), 'rb') as delta:
+                    while True:
+                        cabecera = delta.read(CABECERA_PAGINA.size)
+                        if not cabecera:
+                            break
+                        numero, = CABECERA_PAGINA.unpack(cabecera)
+                        pagina = delta.read(page_size)
+                        if len(cabecera) != CABECERA_PAGINA.size or len(pagina) != page_size:
+                            raise EOFError('delta truncado')
+                        f.seek(numero * page_size)
+                        f.write(pagina)
+                f.truncate(info['paginas'] * page_size)
+
+    def verificar(self, snapshot_id):
+        """Reconstruye cada archivo en un temporal y lo verifica; no toca nada"""
+        manifiesto = self.manifiesto(snapshot_id)
+        with tempfile.TemporaryDirectory() as tmp:
+            for nombre in manifiesto['archivos']:
+                self.reconstruir(snapshot_id, nombre, os.path.join(tmp, nombre))
+        return manifiesto
+
+    def restaurar(self, snapshot_id, directorio_destino=None):
+        """
+        Restaura todos los archivos de un snapshot
+
+        Primero se reconstruyen y verifican todos; solo si todos están bien
+        se reemplazan los originales (o se escriben en directorio_destino).
+        La aplicación debe estar parada.
+        """
+        manifiesto = self.manifiesto(snapshot_id)
+        destinos = {}
+        for nombre in manifiesto['archivos']:
+            if directorio_destino is not None:
+                destinos[nombre] = os.path.join(directorio_destino, nombre)
+            else:
+                destinos[nombre] = self.archivos.get(nombre, nombre)
+
+        temporales = {}
+        try:
+            for nombre, destino in destinos.items():
+                os.makedirs(os.path.dirname(os.path.abspath(destino)), exist_ok=True)
+                temporales[nombre] = destino + '.restaurando'
+                self.reconstruir(snapshot_id, nombre, temporales[nombre])
+
+            for nombre, destino in destinos.items():
+                # Un journal huérfano se aplicaría sobre el archivo restaurado
+                for sufijo in ('-journal', '-wal', '-shm'):
+                    if os.path.exists(destino + sufijo):
+                        os.remove(destino + sufijo)
+                os.replace(temporales.pop(nombre), destino)
+        finally:
+            for temporal in temporales.values():
+                if os.path.exists(temporal):
+                    os.remove(temporal)
+        return manifiesto
+
+    # --- Retención ---------------------------------------------------------
+
+    def purgar(self, conservar=2):
+        """Conserva las `conservar` cadenas más recientes; devuelve los ids borrados"""
+        snapshots = self.listar()
+        completas = [i for i, m in enumerate(snapshots) if m['tipo'] == COMPLETA]
+        if len(completas) <= conservar:
+            return []
+        corte = completas[-conservar] if conservar > 0 else len(snapshots)
+        borrados = []
+        for manifiesto in snapshots[:corte]:
+            shutil.rmtree(self._ruta(manifiesto['id']))
+            borrados.append(manifiesto['id'])
+        return borrados
+
+    def estado(self):
+        """Resumen para el panel de administración"""
+        snapshots = self.listar()
+        return {
+            'en_curso': self.en_curso,
+            'ultimo_error': self.ultimo_error,
+            'snapshots': [
+                {
+                    'id': m['id'],
+                    'tipo': m['tipo'],
+                    'padre': m['padre'],
+                    'creado': m['creado'],
+                    'duracion': m['duracion'],
+                    'archivos': len(m['archivos']),
+                    'paginas_guardadas': sum(a['paginas_guardadas'] for a in m['archivos'].values()),
+                    'bytes': sum(
+                        os.path.getsize(self._ruta(m['id'], n))
+                        for n in os.listdir(self._ruta(m['id']))
+                    ),
+                }
+                for m in reversed(snapshots)
+            ],
+        }
+
+
+# ============================================================================
+# LÍNEA DE COMANDOS
+# ============================================================================
+
+def print_header(text):
+    """Imprime un encabezado decorado"""
+    print("\n" + "="*70)
+    print(text.center(70))
+    print("="*70)
+
+
+def main():
+    from storage import crear_storage
+
+    parser = argparse.ArgumentParser(description='Backups online de SECURELINK')
+    parser.add_argument('--db', default='securelink.db', help='Base de datos principal')
+    parser.add_argument('--shards', type=int, default=1, help='Número de shards (backend sharded)')
+    parser.add_argument('--directorio', default='backups', help='Directorio de snapshots')
+    parser.add_argument('--paginas', type=int, default=PAGINAS_POR_PASO, help='Páginas por paso')
+    parser.add_argument('--pausa', type=float, default=PAUSA_PASO, help='Pausa entre pasos (s)')
+    sub = parser.add_subparsers(dest='comando', required=True)
+    crear = sub.add_parser('crear', help='Crear un snapshot')
+    crear.add_argument('--completa', action='store_true', help='Forzar copia completa')
+    sub.add_parser('listar', help='Listar snapshots')
+    verificar = sub.add_parser('verificar', help='Reconstruir y verificar sin restaurar')
+    verificar.add_argument('snapshot')
+    restaurar = sub.add_parser('restaurar', help='Restaurar un snapshot (con la app parada)')
+    restaurar.add_argument('snapshot')
+    restaurar.add_argument('--destino', help='Directorio donde escribir en vez de reemplazar')
+    purgar = sub.add_parser('purgar', help='Borrar cadenas antiguas')
+    purgar.add_argument('--conservar', type=int, default=2, help='Cadenas completas a conservar')
+    args = parser.parse_args()
+
+    backend = 'sharded' if args.shards > 1 else 'sqlite'
+    storage = crear_storage(args.db, backend, args.shards)
+    gestor = GestorBackups(
+        archivos_de_storage(args.db, storage), args.directorio, args.paginas, args.pausa
+    )
+
+    print_header("💾 SECURELINK - BACKUPS")
+
+    try:
+        if args.comando == 'crear':
+            m = gestor.crear(args.completa)
+            guardadas = sum(a['paginas_guardadas'] for a in m['archivos'].values())
+            print(f"✅ Snapshot {m['id']} ({guardadas} páginas guardadas, {m['duracion']:.2f}s)")
+        elif args.comando == 'listar':
+            for s in gestor.estado()['snapshots']:
+                print(f"   {s['id']:38} {s['paginas_guardadas']:>9} págs {s['bytes'] / 1e6:8.2f} MB")
+        elif args.comando == 'verificar':
+            gestor.verificar(args.snapshot)
+            print(f"✅ Snapshot {args.snapshot} verificado")
+        elif args.comando == 'restaurar':
+            m = gestor.restaurar(args.snapshot, args.destino)
+            for nombre in m['archivos']:
+                print(f"   ✅ {nombre}")
+            print(f"♻️  Snapshot {args.snapshot} restaurado")
+        elif args.comando == 'purgar':
+            for snapshot_id in gestor.purgar(args.conservar):
+                print(f"   🗑️  {snapshot_id}")
+    except BackupError as e:
+        print(f"❌ {e}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,272 @@
+"""
+================================================================================
+SECURELINK - Generador de datos de carga
+================================================================================
+Llena la tabla usuarios con cientos de miles o millones de filas realistas
+para pruebas de rendimiento, y guarda/restaura el resultado como snapshot
+comprimido.
+
+- Determinista: con la misma --semilla se obtienen los mismos usuarios.
+- No calcula un bcrypt por usuario: usa un pool pequeño de hashes reales
+  (cost 12) de las contraseñas Carga0!..CargaN! El usuario número i tiene
+  la contraseña Carga{i % pool}! para poder hacer login en benchmarks.
+- Inserción masiva con PRAGMAs de carga (sin journal ni fsync) y el índice
+  de email creado al final.
+
+Ejemplos:
+    python generar_datos.py --usuarios 100000
+    python generar_datos.py --usuarios 1000000 --shards 4 --snapshot carga_1m.tar.gz
+    python generar_datos.py --restaurar carga_1m.tar.gz
+================================================================================
+"""
+
+import argparse
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tarfile
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import bcrypt
+
+from storage import SCHEMA_VERSION, ShardedSQLiteStorage, SQLiteStorage
+
+NOMBRES = [
+    'juan', 'maria', 'jose', 'ana', 'luis', 'carmen', 'carlos', 'laura', 'pedro',
+    'lucia', 'miguel', 'sofia', 'javier', 'elena', 'diego', 'paula', 'andres',
+    'marta', 'jorge', 'isabel', 'pablo', 'sara', 'fernando', 'julia', 'raul',
+]
+APELLIDOS = [
+    'garcia', 'rodriguez', 'gonzalez', 'fernandez', 'lopez', 'martinez', 'sanchez',
+    'perez', 'gomez', 'martin', 'jimenez', 'ruiz', 'hernandez', 'diaz', 'moreno',
+    'alvarez', 'romero', 'alonso', 'gutierrez', 'navarro', 'torres', 'ramirez',
+]
+
+LOTE_INSERT = 50000
+
+PRAGMAS_CARGA = [
+    'PRAGMA journal_mode = OFF',
+    'PRAGMA synchronous = OFF',
+    'PRAGMA locking_mode = EXCLUSIVE',
+    'PRAGMA temp_store = MEMORY',
+    'PRAGMA cache_size = -262144',
+]
+
+
+def print_header(text):
+    """Imprime un encabezado decorado"""
+    print("\n" + "="*70)
+    print(text.center(70))
+    print("="*70)
+
+
+def parse_mezcla(texto):
+    """'admin=0.01,usuario=0.8,invitado=0.19' -> [('admin', 0.01), ...]"""
+    mezcla = []
+    for parte in texto.split(','):
+        rol, peso = parte.split('=')
+        mezcla.append((rol.strip(), float(peso)))
+    return mezcla
+
+
+def pool_hashes(tamano):
+    """Hashes bcrypt reales (cost 12) de Carga0!..Carga{tamano-1}!"""
+    def calcular(i):
+        return bcrypt.hashpw(f'Carga{i}!'.encode('utf-8'), bcrypt.gensalt(rounds=12)).decode('utf-8')
+
+    # bcrypt libera el GIL: el pool se calcula en paralelo
+    with ThreadPoolExecutor() as pool:
+        return list(pool.map(calcular, range(tamano)))
+
+
+def generar_filas(args, hashes, inicio):
+    """
+    Genera tuplas listas para INSERT
+
+    Actividad: las fechas de alta se reparten en los últimos --dias días;
+    una parte nunca ha iniciado sesión y el resto tiene un último acceso
+    con distribución exponencial (la mayoría recientes).
+    """
+    rng = random.Random(args.semilla)
+    roles, pesos = zip(*parse_mezcla(args.roles))
+    ahora = datetime(2024, 1, 1) if args.fecha_fija else datetime.now()
+    formato = '%Y-%m-%d %H:%M:%S'
+
+    for n in range(args.usuarios):
+        i = inicio + n
+        nombre = rng.choice(NOMBRES)
+        apellido = rng.choice(APELLIDOS)
+        username = f'{nombre}.{apellido}.{i}'
+        creado = ahora - timedelta(seconds=rng.uniform(0, args.dias * 86400))
+
+        if rng.random() < args.sin_acceso:
+            ultimo = None
+        else:
+            atras = min(rng.expovariate(1 / (args.dias_actividad * 86400)),
+                        (ahora - creado).total_seconds())
+            ultimo = (ahora - timedelta(seconds=atras)).strftime(formato)
+
+        yield (
+            username,
+            hashes[i % len(hashes)],
+            rng.choices(roles, pesos)[0],
+            f'{nombre.capitalize()} {apellido.capitalize()}',
+            f'{username}@example.com',
+            creado.strftime(formato),
+            ultimo,
+            1 if rng.random() < args.activos else 0,
+        )
+
+
+def destinos(args):
+    """Backends y función de reparto (None si es un solo archivo)"""
+    if args.shards > 1:
+        sharded = ShardedSQLiteStorage(args.db, args.shards)
+        return sharded.shards, lambda username: sharded.shard_index(username)
+    return [SQLiteStorage(args.db)], None
+
+
+def cargar(args):
+    """Genera e inserta los usuarios; devuelve cuántos se insertaron"""
+    backends, reparto = destinos(args)
+
+    if args.reemplazar:
+        for backend in backends:
+            if os.path.exists(backend.database):
+                os.remove(backend.database)
+
+    print(f"🔐 Calculando pool de {args.pool} hashes bcrypt...")
+    hashes = pool_hashes(args.pool)
+
+    conexiones = []
+    inicio = 0
+    for backend in backends:
+        backend.init_schema()
+        conn = sqlite3.connect(backend.database)
+        for pragma in PRAGMAS_CARGA:
+            conn.execute(pragma)
+        # Sufijo de los usernames nuevos: con COUNT(*) chocaría tras borrar
+        # filas. La secuencia de AUTOINCREMENT nunca retrocede.
+        inicio += conn.execute(
+            "SELECT COALESCE((SELECT seq FROM sqlite_sequence WHERE name = 'usuarios'), 0)"
+        ).fetchone()[0]
+        # El índice de email se reconstruye al final: es más rápido que mantenerlo
+        conn.execute('DROP INDEX IF EXISTS idx_usuarios_email')
+        conn.execute('BEGIN')
+        conexiones.append(conn)
+
+    sql = '''
+        INSERT INTO usuarios (username, password_hash, rol, nombre_completo, email,
+                              fecha_creacion, ultimo_acceso, activo)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    '''
+    pendientes = [[] for _ in conexiones]
+    total = 0
+    t0 = time.perf_counter()
+
+    for fila in generar_filas(args, hashes, inicio):
+        idx = reparto(fila[0]) if reparto else 0
+        pendientes[idx].append(fila)
+        if len(pendientes[idx]) >= LOTE_INSERT:
+            conexiones[idx].executemany(sql, pendientes[idx])
+            total += len(pendientes[idx])
+            pendientes[idx] = []
+            print(f"   ... {total:>10,} usuarios ({total / (time.perf_counter() - t0):,.0f}/s)")
+
+    for conn, filas in zip(conexiones, pendientes):
+        if filas:
+            conn.executemany(sql, filas)
+            total += len(filas)
+        conn.execute('COMMIT')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_usuarios_email ON usuarios (email)')
+        conn.execute('ANALYZE')
+        conn.close()
+
+    for backend in backends:
+        backend.marcar_version(SCHEMA_VERSION)
+
+    print(f"✅ {total:,} usuarios insertados en {time.perf_counter() - t0:.1f}s")
+    return total
+
+
+def snapshot(args, destino):
+    """
+    Guarda la base de datos (o todos sus shards) en un .tar.gz
+
+    Cada archivo se copia antes con VACUUM INTO: copia consistente y compacta.
+    """
+    backends, _ = destinos(args)
+    with tempfile.TemporaryDirectory() as tmp, tarfile.open(destino, 'w:gz') as tar:
+        for backend in backends:
+            copia = os.path.join(tmp, os.path.basename(backend.database))
+            conn = sqlite3.connect(backend.database)
+            conn.execute('VACUUM INTO ?', (copia,))
+            conn.close()
+            tar.add(copia, arcname=os.path.basename(backend.database))
+    print(f"📦 Snapshot guardado: {destino} ({os.path.getsize(destino) / 1e6:.1f} MB)")
+
+
+def restaurar(args, origen):
+    """Extrae un snapshot junto a --db, sustituyendo los archivos existentes"""
+    directorio = os.path.dirname(os.path.abspath(args.db))
+    os.makedirs(directorio, exist_ok=True)
+    with tarfile.open(origen, 'r:gz') as tar:
+        for miembro in tar.getmembers():
+            if not miembro.isfile() or os.path.basename(miembro.name) != miembro.name:
+                print(f"⚠️  Se ignora entrada no válida: {miembro.name}")
+                continue
+            temporal = os.path.join(directorio, miembro.name + '.restaurando')
+            with tar.extractfile(miembro) as datos, open(temporal, 'wb') as f:
+                shutil.copyfileobj(datos, f, 1024 * 1024)
+            destino = os.path.join(directorio, miembro.name)
+            # Un journal huérfano se aplicaría sobre el archivo restaurado
+            for sufijo in ('-journal', '-wal', '-shm'):
+                if os.path.exists(destino + sufijo):
+                    os.remove(destino + sufijo)
+            os.replace(temporal, destino)
+            print(f"   ✅ {miembro.name}")
+    print(f"♻️  Snapshot restaurado desde {origen}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generador de datos de carga de SECURELINK')
+    parser.add_argument('--db', default='securelink.db', help='Base de datos destino')
+    parser.add_argument('--usuarios', type=int, default=100000, help='Usuarios a generar')
+    parser.add_argument('--roles', default='admin=0.01,usuario=0.8,invitado=0.19',
+                        help='Mezcla de roles rol=peso,...')
+    parser.add_argument('--activos', type=float, default=0.95, help='Fracción con activo=1')
+    parser.add_argument('--sin-acceso', type=float, default=0.2,
+                        help='Fracción que nunca ha iniciado sesión')
+    parser.add_argument('--dias', type=int, default=730, help='Antigüedad máxima de las altas')
+    parser.add_argument('--dias-actividad', type=float, default=14,
+                        help='Media (días) desde el último acceso')
+    parser.add_argument('--pool', type=int, default=8, help='Tamaño del pool de hashes bcrypt')
+    parser.add_argument('--semilla', type=int, default=42)
+    parser.add_argument('--fecha-fija', action='store_true',
+                        help='Fechas relativas a 2024-01-01 en vez de ahora (salida reproducible)')
+    parser.add_argument('--shards', type=int, default=1,
+                        help='Repartir en N archivos como el backend sharded')
+    parser.add_argument('--reemplazar', action='store_true', help='Borrar la base de datos antes')
+    parser.add_argument('--snapshot', metavar='ARCHIVO', help='Guardar snapshot .tar.gz al terminar')
+    parser.add_argument('--restaurar', metavar='ARCHIVO', help='Restaurar un snapshot y salir')
+    args = parser.parse_args()
+
+    print_header("🧪 SECURELINK - GENERADOR DE DATOS DE CARGA")
+
+    if args.restaurar:
+        restaurar(args, args.restaurar)
+        return 0
+
+    cargar(args)
+    if args.snapshot:
+        snapshot(args, args.snapshot)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,234 @@
+"""
+Cola de correo saliente de SECURELINK
+
+Las peticiones solo insertan el mensaje en la tabla cola_correo; un hilo
+en segundo plano la vacía por lotes a través de un transporte:
+
+- FileTransport: escribe cada mensaje como .eml en un directorio
+  (suficiente para desarrollo y pruebas)
+- SMTPTransport: una conexión SMTP por lote (vale con un servidor de
+  depuración local, p. ej. `python -m aiosmtpd -n -l localhost:1025`)
+
+Los mensajes que fallan se reintentan hasta MAX_INTENTOS veces.
+
+Cada worker tiene su propio hilo de envío. Antes de enviar un lote, el
+hilo reclama las filas con un UPDATE atómico que fija `reclamado` a un
+plazo; otro worker no toca esas filas hasta que el plazo vence. Así un
+mensaje no se envía dos veces, y si un worker muere a mitad de lote sus
+mensajes vuelven a la cola al vencer el plazo.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+
+MAX_INTENTOS = 5
+# Segundos que un worker se reserva las filas de un lote
+PLAZO_RECLAMO = 300
+
+SCHEMA_COLA = [
+    '''
+    CREATE TABLE IF NOT EXISTS cola_correo (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        destinatario TEXT NOT NULL,
+        asunto TEXT NOT NULL,
+        cuerpo TEXT NOT NULL,
+        creado REAL NOT NULL,
+        enviado REAL,
+        intentos INTEGER NOT NULL DEFAULT 0,
+        error TEXT,
+        reclamado REAL
+    )
+    ''',
+    'CREATE INDEX IF NOT EXISTS idx_cola_pendientes ON cola_correo (enviado, id)',
+]
+
+
+# ============================================================================
+# TRANSPORTES
+# ============================================================================
+
+def construir_mensaje(remitente, fila):
+    # email y smtplib solo se importan cuando de verdad se envía algo
+    from email.message import EmailMessage
+
+    mensaje = EmailMessage()
+    mensaje['From'] = remitente
+    mensaje['To'] = fila['destinatario']
+    mensaje['Subject'] = fila['asunto']
+    mensaje.set_content(fila['cuerpo'])
+    return mensaje
+
+
+class FileTransport:
+    """Guarda cada mensaje en <directorio>/<id>.eml"""
+
+    def __init__(self, directorio, remitente):
+        os.makedirs(directorio, exist_ok=True)
+        self.directorio = directorio
+        self.remitente = remitente
+
+    def enviar_lote(self, filas):
+        """Devuelve {id: None si se envió, texto del error si no}"""
+        resultado = {}
+        for fila in filas:
+            path = os.path.join(self.directorio, f"{fila['id']}.eml")
+            with open(path, 'wb') as f:
+                f.write(bytes(construir_mensaje(self.remitente, fila)))
+            resultado[fila['id']] = None
+        return resultado
+
+
+class SMTPTransport:
+    """Envía el lote completo por una sola conexión SMTP"""
+
+    def __init__(self, host, port, remitente, usuario=None, password=None, tls=False):
+        self.host = host
+        self.port = port
+        self.remitente = remitente
+        self.usuario = usuario
+        self.password = password
+        self.tls = tls
+
+    def enviar_lote(self, filas):
+        import smtplib
+
+        resultado = {}
+        with smtplib.SMTP(self.host, self.port, timeout=30) as smtp:
+            if self.tls:
+                smtp.starttls()
+            if self.usuario:
+                smtp.login(self.usuario, self.password)
+            for fila in filas:
+                try:
+                    smtp.send_message(construir_mensaje(self.remitente, fila))
+                    resultado[fila['id']] = None
+                except smtplib.SMTPException as e:
+                    resultado[fila['id']] = str(e)
+        return resultado
+
+
+# ============================================================================
+# COLA PERSISTENTE
+# ============================================================================
+
+class MailQueue:
+    """Cola en SQLite + hilo que la vacía por lotes"""
+
+    def __init__(self, database, transport, lote=50, intervalo=2.0):
+        self.database = database
+        self.transport = transport
+        self.lote = lote
+        self.intervalo = intervalo
+        self._esquema_listo = False
+        self._pendiente = threading.Event()
+        self._hilo = None
+
+    def connect(self):
+        conn = sqlite3.connect(self.database)
+        conn.row_factory = sqlite3.Row
+        if not self._esquema_listo:
+            for sentencia in SCHEMA_COLA:
+                conn.execute(sentencia)
+            columnas = {row['name'] for row in conn.execute('PRAGMA table_info(cola_correo)')}
+            if 'reclamado' not in columnas:
+                conn.execute('ALTER TABLE cola_correo ADD COLUMN reclamado REAL')
+            conn.commit()
+            self._esquema_listo = True
+        return conn
+
+    def encolar(self, destinatario, asunto, cuerpo):
+        """Guarda el mensaje y despierta al hilo de envío; no espera al envío"""
+        conn = self.connect()
+        with conn:
+            conn.execute(
+                'INSERT INTO cola_correo (destinatario, asunto, cuerpo, creado) '
+                'VALUES (?, ?, ?, ?)',
+                (destinatario, asunto, cuerpo, time.time())
+            )
+        conn.close()
+        self.iniciar()
+        self._pendiente.set()
+
+    def reclamar_lote(self, conn):
+        """Reserva hasta `lote` mensajes pendientes para este worker y los devuelve"""
+        ahora = time.time()
+        with conn:
+            filas = conn.execute('''
+                UPDATE cola_correo SET reclamado = ?
+                WHERE id IN (
+                    SELECT id FROM cola_correo
+                    WHERE enviado IS NULL AND intentos < ?
+                      AND (reclamado IS NULL OR reclamado < ?)
+                    ORDER BY id LIMIT ?
+                )
+                RETURNING *
+            ''', (ahora + PLAZO_RECLAMO, MAX_INTENTOS, ahora, self.lote)).fetchall()
+        return sorted(filas, key=lambda fila: fila['id'])
+
+    def procesar_lote(self):
+        """Envía hasta `lote` mensajes pendientes; devuelve cuántos se intentaron"""
+        conn = self.connect()
+        filas = self.reclamar_lote(conn)
+        if not filas:
+            conn.close()
+            return 0
+
+        try:
+            resultado = self.transport.enviar_lote(filas)
+        except Exception as e:
+            resultado = {fila['id']: str(e) for fila in filas}
+
+        ahora = time.time()
+        with conn:
+            conn.executemany(
+                'UPDATE cola_correo SET enviado = ?, intentos = intentos + 1, error = NULL, '
+                'reclamado = NULL WHERE id = ?',
+                [(ahora, id_) for id_, error in resultado.items() if error is None]
+            )
+            conn.executemany(
+                'UPDATE cola_correo SET intentos = intentos + 1, error = ?, reclamado = NULL '
+                'WHERE id = ?',
+                [(error, id_) for id_, error in resultado.items() if error is not None]
+            )
+        conn.close()
+        return len(filas)
+
+    def _bucle(self):
+        while True:
+            self._pendiente.wait(self.intervalo)
+            self._pendiente.clear()
+            try:
+                # Si el lote salió lleno puede haber más esperando
+                while self.procesar_lote() == self.lote:
+                    pass
+            except Exception as e:
+                print(f"Error en la cola de correo: {e}")
+
+    def iniciar(self):
+        """Arranca el hilo de envío (una sola vez)"""
+        if self._hilo is None:
+            self._hilo = threading.Thread(
+                target=self._bucle, name='securelink-mail', daemon=True
+            )
+            self._hilo.start()
+
+    def pendientes(self):
+        conn = self.connect()
+        total = conn.execute(
+            'SELECT COUNT(*) FROM cola_correo WHERE enviado IS NULL AND intentos < ?',
+            (MAX_INTENTOS,)
+        ).fetchone()[0]
+        conn.close()
+        return total
+
+
+def crear_transport(tipo, remitente, directorio='correo_saliente',
+                    host='localhost', port=1025, usuario=None, password=None, tls=False):
+    """tipo: 'archivo' (por defecto) o 'smtp'"""
+    if tipo == 'archivo':
+        return FileTransport(directorio, remitente)
+    if tipo == 'smtp':
+        return SMTPTransport(host, port, remitente, usuario, password, tls)
+    raise ValueError(f'Transporte de correo desconocido: {tipo}')
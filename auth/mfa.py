@@ -0,0 +1,362 @@
+"""
+Segundo factor TOTP (RFC 6238) de SECURELINK
+
+Solo usa la biblioteca estándar (hmac, hashlib):
+
+- Los secretos se guardan cifrados en la tabla mfa (HMAC-SHA256 en modo
+  contador como flujo de cifrado + etiqueta HMAC, cifrar-y-autenticar).
+  Descifrados se guardan unos segundos en una caché del proceso.
+- Anti-repetición: por usuario solo se guarda el último contador TOTP
+  aceptado; un código se acepta si su contador es mayor. Es un UPDATE
+  condicional, así que dos peticiones con el mismo código no pasan ambas.
+- Códigos de respaldo de un solo uso, guardados como SHA-256 (tienen
+  entropía suficiente; no hace falta bcrypt y así cuestan microsegundos).
+- Límite de intentos en la tabla mfa, no en la sesión: cada verificación
+  reserva un intento con un UPDATE condicional antes de comprobar el
+  código. Tras `max_fallos` intentos seguidos sin acierto el usuario
+  queda bloqueado `bloqueo` segundos, aunque se reenvíe una cookie vieja.
+"""
+
+import base64
+import hashlib
+import hmac
+import os
+import secrets
+import sqlite3
+import struct
+import threading
+import time
+from urllib.parse import quote
+
+PASO = 30
+DIGITOS = 6
+# Pasos de tolerancia a cada lado por desfase de reloj
+VENTANA = 1
+CODIGOS_RESPALDO = 10
+
+SCHEMA_MFA = [
+    '''
+    CREATE TABLE IF NOT EXISTS mfa (
+        user_id INTEGER PRIMARY KEY,
+        secreto_cifrado TEXT NOT NULL,
+        activo INTEGER NOT NULL DEFAULT 0,
+        ultimo_contador INTEGER NOT NULL DEFAULT 0,
+        creado REAL NOT NULL,
+        fallos INTEGER NOT NULL DEFAULT 0,
+        bloqueado_hasta REAL NOT NULL DEFAULT 0
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS mfa_respaldo (
+        codigo_hash TEXT PRIMARY KEY,
+        user_id INTEGER NOT NULL,
+        usado INTEGER NOT NULL DEFAULT 0
+    )
+    ''',
+    'CREATE INDEX IF NOT EXISTS idx_mfa_respaldo_user ON mfa_respaldo (user_id)',
+]
+
+
+# ============================================================================
+# TOTP
+# ============================================================================
+
+def generar_secreto():
+    """Secreto aleatorio de 160 bits en base32 (formato de las apps TOTP)"""
+    return base64.b32encode(secrets.token_bytes(20)).decode('ascii')
+
+
+def _clave(secreto_b32):
+    return base64.b32decode(secreto_b32.upper() + '=' * (-len(secreto_b32) % 8))
+
+
+def codigo_totp(clave, contador):
+    """Código HOTP (RFC 4226) para una clave en bytes y un contador"""
+    digest = hmac.new(clave, struct.pack('>Q', contador), hashlib.sha1).digest()
+    desplazamiento = digest[-1] & 0x0F
+    valor = struct.unpack('>I', digest[desplazamiento:desplazamiento + 4])[0] & 0x7FFFFFFF
+    return str(valor % 10 ** DIGITOS).zfill(DIGITOS)
+
+
+def contador_valido(clave, codigo, ahora=None):
+    """Contador TOTP que corresponde al código dentro de la ventana, o None"""
+    if not codigo or len(codigo) != DIGITOS or not codigo.isdigit():
+        return None
+    actual = int((time.time() if ahora is None else ahora) // PASO)
+    for contador in range(actual - VENTANA, actual + VENTANA + 1):
+        if hmac.compare_digest(codigo_totp(clave, contador), codigo):
+            return contador
+    return None
+
+
+def uri_otpauth(secreto_b32, cuenta, emisor='SECURELINK'):
+    """URI para dar de alta la cuenta en una app de autenticación"""
+    return (
+        f'otpauth://totp/{quote(emisor)}:{quote(cuenta)}'
+        f'?secret={secreto_b32}&issuer={quote(emisor)}&digits={DIGITOS}&period={PASO}'
+    )
+
+
+# ============================================================================
+# CIFRADO DE SECRETOS
+# ============================================================================
+
+class CifradorSecretos:
+    """
+    Cifrado autenticado con HMAC-SHA256 de la biblioteca estándar
+
+    formato: base64(nonce[16] | texto_cifrado | etiqueta[32])
+    """
+
+    def __init__(self, clave_maestra):
+        self.clave_cifrado = hmac.new(clave_maestra, b'mfa-cifrado', hashlib.sha256).digest()
+        self.clave_mac = hmac.new(clave_maestra, b'mfa-mac', hashlib.sha256).digest()
+
+    def _flujo(self, nonce, longitud):
+        bloques = []
+        for i in range((longitud + 31) // 32):
+            bloques.append(hmac.new(
+                self.clave_cifrado, nonce + struct.pack('>I', i), hashlib.sha256
+            ).digest())
+        return b''.join(bloques)[:longitud]
+
+    def cifrar(self, texto):
+        datos = texto.encode('utf-8')
+        nonce = os.urandom(16)
+        cifrado = bytes(a ^ b for a, b in zip(datos, self._flujo(nonce, len(datos))))
+        etiqueta = hmac.new(self.clave_mac, nonce + cifrado, hashlib.sha256).digest()
+        return base64.b64encode(nonce + cifrado + etiqueta).decode('ascii')
+
+    def descifrar(self, token):
+        crudo = base64.b64decode(token)
+        nonce, cifrado, etiqueta = crudo[:16], crudo[16:-32], crudo[-32:]
+        esperada = hmac.new(self.clave_mac, nonce + cifrado, hashlib.sha256).digest()
+        if not hmac.compare_digest(etiqueta, esperada):
+            raise ValueError('Secreto MFA alterado o clave incorrecta')
+        return bytes(a ^ b for a, b in zip(cifrado, self._flujo(nonce, len(cifrado)))).decode('utf-8')
+
+
+# ============================================================================
+# ALMACÉN MFA
+# ============================================================================
+
+def _hash_respaldo(codigo):
+    return hashlib.sha256(codigo.replace('-', '').lower().encode('utf-8')).hexdigest()
+
+
+class MFAStore:
+    """Alta, verificación y baja del segundo factor por usuario"""
+
+    def __init__(self, database, clave_maestra, ttl_cache=60.0, max_fallos=5, bloqueo=300):
+        self.database = database
+        self.cifrador = CifradorSecretos(clave_maestra)
+        self.ttl_cache = ttl_cache
+        self.max_fallos = max_fallos
+        self.bloqueo = bloqueo
+        self._esquema_listo = False
+        self._cache = {}    # user_id -> (expira, clave en bytes)
+        self._lock = threading.Lock()
+
+    def connect(self):
+        conn = sqlite3.connect(self.database)
+        conn.row_factory = sqlite3.Row
+        if not self._esquema_listo:
+            for sentencia in SCHEMA_MFA:
+                conn.execute(sentencia)
+            columnas = {row['name'] for row in conn.execute('PRAGMA table_info(mfa)')}
+            if 'fallos' not in columnas:
+                conn.execute('ALTER TABLE mfa ADD COLUMN fallos INTEGER NOT NULL DEFAULT 0')
+                conn.execute('ALTER TABLE mfa ADD COLUMN bloqueado_hasta REAL NOT NULL DEFAULT 0')
+            conn.commit()
+            self._esquema_listo = True
+        return conn
+
+    # --- Estado ------------------------------------------------------------
+
+    def activo(self, user_id):
+        conn = self.connect()
+        row = conn.execute('SELECT activo FROM mfa WHERE user_id = ?', (user_id,)).fetchone()
+        conn.close()
+        return bool(row and row['activo'])
+
+    def bloqueado(self, user_id):
+        """Segundos que quedan de bloqueo por demasiados intentos (0 si ninguno)"""
+        conn = self.connect()
+        row = conn.execute('SELECT bloqueado_hasta FROM mfa WHERE user_id = ?', (user_id,)).fetchone()
+        conn.close()
+        return max(0.0, row['bloqueado_hasta'] - time.time()) if row else 0.0
+
+    def codigos_respaldo_restantes(self, user_id):
+        conn = self.connect()
+        total = conn.execute(
+            'SELECT COUNT(*) FROM mfa_respaldo WHERE user_id = ? AND usado = 0', (user_id,)
+        ).fetchone()[0]
+        conn.close()
+        return total
+
+    # --- Alta y baja -------------------------------------------------------
+
+    def iniciar_alta(self, user_id):
+        """Guarda un secreto nuevo sin activar y lo devuelve en base32"""
+        secreto = generar_secreto()
+        conn = self.connect()
+        with conn:
+            conn.execute('''
+                INSERT INTO mfa (user_id, secreto_cifrado, activo, ultimo_contador, creado)
+                VALUES (?, ?, 0, 0, ?)
+                ON CONFLICT (user_id) DO UPDATE SET
+                    secreto_cifrado = excluded.secreto_cifrado,
+                    activo = 0, ultimo_contador = 0, creado = excluded.creado,
+                    fallos = 0, bloqueado_hasta = 0
+            ''', (user_id, self.cifrador.cifrar(secreto), time.time()))
+        conn.close()
+        self._olvidar(user_id)
+        return secreto
+
+    def secreto_pendiente(self, user_id):
+        """Secreto en base32 de un alta sin confirmar, o None"""
+        conn = self.connect()
+        row = conn.execute(
+            'SELECT secreto_cifrado FROM mfa WHERE user_id = ? AND activo = 0', (user_id,)
+        ).fetchone()
+        conn.close()
+        return self.cifrador.descifrar(row['secreto_cifrado']) if row else None
+
+    def confirmar_alta(self, user_id, codigo):
+        """
+        Activa MFA si el código es correcto para el secreto pendiente
+
+        Devuelve la lista de códigos de respaldo (se muestran una sola vez)
+        o None si el código no es válido.
+        """
+        secreto = self.secreto_pendiente(user_id)
+        if secreto is None:
+            return None
+        contador = contador_valido(_clave(secreto), codigo)
+        if contador is None:
+            return None
+
+        respaldo = [
+            f'{secrets.token_hex(4)}-{secrets.token_hex(4)}' for _ in range(CODIGOS_RESPALDO)
+        ]
+        conn = self.connect()
+        with conn:
+            conn.execute(
+                'UPDATE mfa SET activo = 1, ultimo_contador = ? WHERE user_id = ?',
+                (contador, user_id)
+            )
+            conn.execute('DELETE FROM mfa_respaldo WHERE user_id = ?', (user_id,))
+            conn.executemany(
+                'INSERT INTO mfa_respaldo (codigo_hash, user_id) VALUES (?, ?)',
+                [(_hash_respaldo(c), user_id) for c in respaldo]
+            )
+        conn.close()
+        self._olvidar(user_id)
+        return respaldo
+
+    def desactivar(self, user_id):
+        conn = self.connect()
+        with conn:
+            conn.execute('DELETE FROM mfa WHERE user_id = ?', (user_id,))
+            conn.execute('DELETE FROM mfa_respaldo WHERE user_id = ?', (user_id,))
+        conn.close()
+        self._olvidar(user_id)
+
+    # --- Verificación ------------------------------------------------------
+
+    def _clave_usuario(self, user_id):
+        ahora = time.monotonic()
+        entrada = self._cache.get(user_id)
+        if entrada is not None and entrada[0] > ahora:
+            return entrada[1]
+
+        conn = self.connect()
+        row = conn.execute(
+            'SELECT secreto_cifrado FROM mfa WHERE user_id = ? AND activo = 1', (user_id,)
+        ).fetchone()
+        conn.close()
+        if row is None:
+            return None
+
+        clave = _clave(self.cifrador.descifrar(row['secreto_cifrado']))
+        with self._lock:
+            self._cache[user_id] = (ahora + self.ttl_cache, clave)
+        return clave
+
+    def _olvidar(self, user_id):
+        with self._lock:
+            self._cache.pop(user_id, None)
+
+    def verificar(self, user_id, codigo):
+        """
+        Acepta un código TOTP o un código de respaldo
+
+        Un código TOTP ya usado (o uno anterior) se rechaza. Con el
+        usuario bloqueado se rechaza cualquier código sin comprobarlo.
+        """
+        codigo = (codigo or '').strip().replace(' ', '')
+        clave = self._clave_usuario(user_id)
+        if clave is None or not self._reservar_intento(user_id):
+            return False
+
+        contador = contador_valido(clave, codigo)
+        if contador is not None:
+            conn = self.connect()
+            with conn:
+                cursor = conn.execute(
+                    'UPDATE mfa SET ultimo_contador = ? '
+                    'WHERE user_id = ? AND activo = 1 AND ultimo_contador < ?',
+                    (contador, user_id, contador)
+                )
+            conn.close()
+            valido = cursor.rowcount == 1
+        else:
+            valido = self._usar_respaldo(user_id, codigo)
+
+        if valido:
+            self._reiniciar_fallos(user_id)
+        return valido
+
+    def _reservar_intento(self, user_id):
+        """
+        Cuenta el intento antes de comprobar el código; False si está bloqueado
+
+        Es un solo UPDATE condicional, así que peticiones simultáneas no
+        pueden colarse todas antes de que se anote el fallo. El intento
+        que llega a max_fallos pone el bloqueo y el contador vuelve a cero.
+        """
+        ahora = time.time()
+        conn = self.connect()
+        with conn:
+            row = conn.execute('''
+                UPDATE mfa SET
+                    fallos = CASE WHEN fallos + 1 >= :maximo THEN 0 ELSE fallos + 1 END,
+                    bloqueado_hasta = CASE WHEN fallos + 1 >= :maximo
+                                           THEN :ahora + :bloqueo ELSE bloqueado_hasta END
+                WHERE user_id = :user_id AND activo = 1 AND bloqueado_hasta <= :ahora
+                RETURNING user_id
+            ''', {'maximo': self.max_fallos, 'ahora': ahora, 'bloqueo': self.bloqueo,
+                  'user_id': user_id}).fetchone()
+        conn.close()
+        return row is not None
+
+    def _reiniciar_fallos(self, user_id):
+        conn = self.connect()
+        with conn:
+            conn.execute(
+                'UPDATE mfa SET fallos = 0, bloqueado_hasta = 0 WHERE user_id = ?', (user_id,)
+            )
+        conn.close()
+
+    def _usar_respaldo(self, user_id, codigo):
+        if not codigo:
+            return False
+        conn = self.connect()
+        with conn:
+            row = conn.execute(
+                'UPDATE mfa_respaldo SET usado = 1 '
+                'WHERE codigo_hash = ? AND user_id = ? AND usado = 0 RETURNING user_id',
+                (_hash_respaldo(codigo), user_id)
+            ).fetchone()
+        conn.close()
+        return row is not None
@@ -0,0 +1,171 @@
+"""
+Salud, disponibilidad y estado del proceso de SECURELINK
+
+Cada worker lleva sus propios contadores en memoria, así que consultar
+el estado no toca la base de datos salvo la comprobación de que responde
+(cacheada un segundo):
+
+- Peticiones en curso y bcrypt en curso: un worker atascado detrás de
+  bcrypt o de un lock de la base de datos deja de estar disponible.
+- Tasa de errores 5xx en la última ventana, por segundos.
+- Memoria (RSS), hilos y tiempo en marcha del proceso.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def memoria_proceso():
+    """RSS actual y máximo del proceso en MB (None si no se puede medir)"""
+    actual = maximo = None
+    try:
+        with open('/proc/self/statm') as f:
+            actual = int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1e6
+    except (OSError, ValueError, AttributeError):
+        pass
+    if resource is not None:
+        # ru_maxrss está en KB en Linux
+        maximo = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1e3
+    return {'rss_mb': actual, 'max_rss_mb': maximo}
+
+
+class MonitorSalud:
+    """Contadores del worker y comprobaciones de disponibilidad"""
+
+    def __init__(self, archivos_db, max_en_vuelo=32, max_hashes=8, max_tasa_errores=0.2,
+                 ventana=60, min_peticiones=20, timeout_db=0.25):
+        self.archivos_db = archivos_db
+        self.max_en_vuelo = max_en_vuelo
+        self.max_hashes = max_hashes
+        self.max_tasa_errores = max_tasa_errores
+        self.min_peticiones = min_peticiones
+        self.timeout_db = timeout_db
+        self.inicio = time.time()
+        self.en_vuelo = 0
+        self.hashes_en_curso = 0
+        # [segundo, peticiones, errores] de los últimos `ventana` segundos
+        self._segundos = deque(maxlen=ventana)
+        self._db_cache = (0.0, None)
+        self._lock = threading.Lock()
+
+    # --- Contadores --------------------------------------------------------
+
+    def inicio_peticion(self):
+        with self._lock:
+            self.en_vuelo += 1
+
+    def fin_peticion(self):
+        with self._lock:
+            self.en_vuelo -= 1
+
+    def registrar_respuesta(self, status):
+        segundo = int(time.time())
+        with self._lock:
+            if not self._segundos or self._segundos[-1][0] != segundo:
+                self._segundos.append([segundo, 0, 0])
+            self._segundos[-1][1] += 1
+            if status >= 500:
+                self._segundos[-1][2] += 1
+
+    @contextmanager
+    def hash_en_curso(self):
+        """Envuelve cada operación bcrypt para medir la cola de hashes"""
+        with self._lock:
+            self.hashes_en_curso += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.hashes_en_curso -= 1
+
+    def errores_recientes(self):
+        """(peticiones, errores 5xx) dentro de la ventana"""
+        limite = int(time.time()) - self._segundos.maxlen
+        with self._lock:
+            filas = [s for s in self._segundos if s[0] > limite]
+        return sum(s[1] for s in filas), sum(s[2] for s in filas)
+
+    # --- Base de datos -----------------------------------------------------
+
+    def comprobar_db(self):
+        """
+        None si todos los archivos responden; si no, texto del error
+
+        PRAGMA schema_version necesita el lock compartido, así que un
+        escritor atascado con el lock exclusivo también se detecta.
+        """
+        ahora = time.monotonic()
+        cacheado, resultado = self._db_cache
+        if ahora - cacheado < 1.0:
+            return resultado
+
+        resultado = None
+        for path in self.archivos_db:
+            try:
+                conn = sqlite3.connect(f'file:{path}?mode=ro', uri=True, timeout=self.timeout_db)
+                try:
+                    conn.execute('PRAGMA schema_version').fetchone()
+                finally:
+                    conn.close()
+            except sqlite3.Error as e:
+                resultado = f'{os.path.basename(path)}: {e}'
+                break
+        self._db_cache = (ahora, resultado)
+        return resultado
+
+    # --- Informes ----------------------------------------------------------
+
+    def disponibilidad(self):
+        """(preparado, comprobaciones) para /readyz"""
+        peticiones, errores = self.errores_recientes()
+        tasa = errores / peticiones if peticiones else 0.0
+        error_db = self.comprobar_db()
+
+        comprobaciones = {
+            'db': {'ok': error_db is None, 'error': error_db},
+            'peticiones_en_curso': {
+                'ok': self.en_vuelo <= self.max_en_vuelo,
+                'valor': self.en_vuelo, 'maximo': self.max_en_vuelo,
+            },
+            'bcrypt_en_curso': {
+                'ok': self.hashes_en_curso <= self.max_hashes,
+                'valor': self.hashes_en_curso, 'maximo': self.max_hashes,
+            },
+            'tasa_errores': {
+                # Con pocas peticiones un solo error no saca al worker del balanceador
+                'ok': peticiones < self.min_peticiones or tasa <= self.max_tasa_errores,
+                'valor': round(tasa, 4), 'maximo': self.max_tasa_errores,
+                'peticiones': peticiones, 'errores': errores,
+            },
+        }
+        return all(c['ok'] for c in comprobaciones.values()), comprobaciones
+
+    def estado(self):
+        """Memoria, hilos, tiempo en marcha y contadores de este worker"""
+        peticiones, errores = self.errores_recientes()
+        hilos = threading.enumerate()
+        return {
+            'pid': os.getpid(),
+            'uptime_s': round(time.time() - self.inicio, 1),
+            'memoria': memoria_proceso(),
+            'hilos': {
+                'total': len(hilos),
+                'nombres': sorted(h.name for h in hilos),
+            },
+            'peticiones': {
+                'en_curso': self.en_vuelo,
+                'bcrypt_en_curso': self.hashes_en_curso,
+                'ventana_s': self._segundos.maxlen,
+                'total': peticiones,
+                'errores_5xx': errores,
+            },
+        }
@@ -0,0 +1,651 @@
+"""
+Backends de almacenamiento de SECURELINK
+
+Define la interfaz que usa app.py para usuarios, sesiones y estadísticas,
+con tres implementaciones:
+
+- SQLiteStorage: un único archivo SQLite (comportamiento por defecto)
+- ShardedSQLiteStorage: reparte los usuarios en varios archivos SQLite
+  según un hash del username
+- ReplicatedSQLiteStorage: escribe en el archivo primario y sirve las
+  lecturas tolerantes a datos antiguos desde una réplica
+
+Las lecturas aceptan max_staleness (segundos): None exige datos del
+primario; un número permite leer de una réplica con esa antigüedad.
+
+Los archivos del primario se abren en modo WAL (journal_mode=WAL, se
+guarda en el propio archivo): lectores y copias de backup no bloquean a
+los escritores. Las copias (réplicas y backups) quedan en modo DELETE.
+"""
+
+import heapq
+import hashlib
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+ROLES = ('admin', 'usuario', 'invitado')
+
+# Se guarda en PRAGMA user_version cuando el esquema y los datos iniciales
+# están listos; al arrancar basta leerlo para saltarse la inicialización
+SCHEMA_VERSION = 2
+
+SCHEMA_USUARIOS = '''
+    CREATE TABLE IF NOT EXISTS usuarios (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        username TEXT UNIQUE NOT NULL,
+        password_hash TEXT NOT NULL,
+        rol TEXT NOT NULL CHECK(rol IN ('admin', 'usuario', 'invitado')),
+        nombre_completo TEXT NOT NULL,
+        email TEXT NOT NULL,
+        fecha_creacion TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        ultimo_acceso TIMESTAMP,
+        activo INTEGER DEFAULT 1,
+        email_verificado INTEGER DEFAULT 0
+    )
+'''
+
+# Máximo de ids por sentencia en las operaciones masivas (límite de variables)
+LOTE_IDS = 500
+
+# Columnas añadidas después de la primera versión: (nombre, definición)
+MIGRACIONES_USUARIOS = [
+    ('email_verificado', 'INTEGER DEFAULT 0'),
+]
+
+
+class UsuarioExistenteError(Exception):
+    """Se lanza al intentar crear un usuario cuyo username ya existe"""
+
+
+# ============================================================================
+# INTERFAZ
+# ============================================================================
+
+class StorageBackend:
+    """
+    Interfaz común de almacenamiento
+
+    Los usuarios se devuelven como diccionarios con las columnas de la
+    tabla usuarios. Los ids son globales: un id devuelto por el backend
+    puede volver a pasarse a obtener_usuario() sin saber dónde vive.
+    """
+
+    # --- Esquema -----------------------------------------------------------
+
+    def init_schema(self):
+        """Crea las tablas necesarias si no existen"""
+        raise NotImplementedError
+
+    def version_esquema(self):
+        """Versión guardada en PRAGMA user_version (0 si no se ha marcado)"""
+        raise NotImplementedError
+
+    def marcar_version(self, version):
+        """Guarda la versión del esquema en PRAGMA user_version"""
+        raise NotImplementedError
+
+    def iniciar(self):
+        """Prepara los archivos y arranca tareas en segundo plano (si las tiene)"""
+
+    # --- Usuarios ----------------------------------------------------------
+
+    def contar_usuarios(self):
+        """Número total de usuarios registrados"""
+        raise NotImplementedError
+
+    def obtener_usuario(self, user_id, max_staleness=None):
+        """Devuelve el usuario con ese id o None"""
+        raise NotImplementedError
+
+    def obtener_usuario_por_username(self, username, solo_activos=False, max_staleness=None):
+        """Devuelve el usuario con ese username o None"""
+        raise NotImplementedError
+
+    def obtener_usuario_por_email(self, email):
+        """Devuelve el primer usuario con ese email o None"""
+        raise NotImplementedError
+
+    def listar_usuarios(self, max_staleness=None):
+        """Todos los usuarios ordenados por fecha de creación descendente"""
+        raise NotImplementedError
+
+    def crear_usuario(self, username, password_hash, rol, nombre_completo, email):
+        """
+        Inserta un usuario y devuelve su id
+
+        Lanza UsuarioExistenteError si el username ya está en uso.
+        """
+        raise NotImplementedError
+
+    def actualizar_password(self, user_id, password_hash):
+        """Sustituye el hash de la contraseña del usuario"""
+        raise NotImplementedError
+
+    def marcar_email_verificado(self, user_id):
+        """Marca el email del usuario como verificado"""
+        raise NotImplementedError
+
+    def modificar_usuarios(self, ids, activo=None, rol=None):
+        """
+        Cambia activo y/o rol de varios usuarios en una sola transacción
+
+        Devuelve el número de usuarios modificados.
+        """
+        raise NotImplementedError
+
+    def eliminar_usuarios(self, ids):
+        """Borra varios usuarios en una sola transacción; devuelve cuántos"""
+        raise NotImplementedError
+
+    # --- Sesiones ----------------------------------------------------------
+
+    def registrar_acceso(self, user_id):
+        """Marca el inicio de sesión del usuario (columna ultimo_acceso)"""
+        raise NotImplementedError
+
+    # --- Estadísticas ------------------------------------------------------
+
+    def estadisticas(self, max_staleness=None):
+        """Totales por rol y de usuarios activos"""
+        raise NotImplementedError
+
+
+def _stats_vacias():
+    return {'total': 0, 'admins': 0, 'usuarios': 0, 'invitados': 0, 'activos': 0}
+
+
+def _cambios(activo, rol):
+    """Columnas a actualizar en modificar_usuarios()"""
+    cambios = {}
+    if activo is not None:
+        cambios['activo'] = 1 if activo else 0
+    if rol is not None:
+        if rol not in ROLES:
+            raise ValueError(f'Rol inválido: {rol}')
+        cambios['rol'] = rol
+    return cambios
+
+
+def _modificar_en(conn, ids, cambios, esquema='main'):
+    """
+    UPDATE (o DELETE si cambios es None) de usuarios por id en trozos de
+    LOTE_IDS, dentro de la transacción abierta en conn
+    """
+    total = 0
+    for i in range(0, len(ids), LOTE_IDS):
+        trozo = ids[i:i + LOTE_IDS]
+        marcas = ', '.join('?' * len(trozo))
+        if cambios is None:
+            cursor = conn.execute(
+                f'DELETE FROM {esquema}.usuarios WHERE id IN ({marcas})', trozo
+            )
+        else:
+            columnas = ', '.join(f'{columna} = ?' for columna in cambios)
+            cursor = conn.execute(
+                f'UPDATE {esquema}.usuarios SET {columnas} WHERE id IN ({marcas})',
+                [*cambios.values(), *trozo]
+            )
+        total += cursor.rowcount
+    return total
+
+
+# ============================================================================
+# SQLITE (UN SOLO ARCHIVO)
+# ============================================================================
+
+class SQLiteStorage(StorageBackend):
+    """Almacenamiento en un único archivo SQLite"""
+
+    def __init__(self, database):
+        self.database = database
+
+    def connect(self):
+        """Abre una conexión nueva con row_factory = sqlite3.Row"""
+        conn = sqlite3.connect(self.database)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def connect_lectura(self, max_staleness=None):
+        """Conexión para lecturas; sin réplica siempre es el primario"""
+        return self.connect()
+
+    def init_schema(self):
+        conn = self.connect()
+        conn.execute(SCHEMA_USUARIOS)
+        columnas = {row['name'] for row in conn.execute('PRAGMA table_info(usuarios)')}
+        for nombre, definicion in MIGRACIONES_USUARIOS:
+            if nombre not in columnas:
+                conn.execute(f'ALTER TABLE usuarios ADD COLUMN {nombre} {definicion}')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_usuarios_email ON usuarios (email)')
+        conn.commit()
+        conn.close()
+
+    def iniciar(self):
+        # En cada arranque: generar_datos carga con journal_mode=OFF y un
+        # snapshot restaurado puede venir en modo DELETE
+        conn = self.connect()
+        conn.execute('PRAGMA journal_mode = WAL')
+        conn.close()
+
+    def version_esquema(self):
+        conn = self.connect()
+        version = conn.execute('PRAGMA user_version').fetchone()[0]
+        conn.close()
+        return version
+
+    def marcar_version(self, version):
+        conn = self.connect()
+        conn.execute(f'PRAGMA user_version = {int(version)}')
+        conn.close()
+
+    def contar_usuarios(self):
+        conn = self.connect()
+        count = conn.execute('SELECT COUNT(*) FROM usuarios').fetchone()[0]
+        conn.close()
+        return count
+
+    def obtener_usuario(self, user_id, max_staleness=None):
+        conn = self.connect_lectura(max_staleness)
+        row = conn.execute('SELECT * FROM usuarios WHERE id = ?', (user_id,)).fetchone()
+        conn.close()
+        return dict(row) if row else None
+
+    def obtener_usuario_por_username(self, username, solo_activos=False, max_staleness=None):
+        query = 'SELECT * FROM usuarios WHERE username = ?'
+        if solo_activos:
+            query += ' AND activo = 1'
+        conn = self.connect_lectura(max_staleness)
+        row = conn.execute(query, (username,)).fetchone()
+        conn.close()
+        return dict(row) if row else None
+
+    def obtener_usuario_por_email(self, email):
+        conn = self.connect()
+        row = conn.execute(
+            'SELECT * FROM usuarios WHERE email = ? ORDER BY id LIMIT 1', (email,)
+        ).fetchone()
+        conn.close()
+        return dict(row) if row else None
+
+    def listar_usuarios(self, max_staleness=None):
+        conn = self.connect_lectura(max_staleness)
+        rows = conn.execute('''
+            SELECT * FROM usuarios
+            ORDER BY fecha_creacion DESC
+        ''').fetchall()
+        conn.close()
+        return [dict(row) for row in rows]
+
+    def crear_usuario(self, username, password_hash, rol, nombre_completo, email):
+        conn = self.connect()
+        try:
+            cursor = conn.execute('''
+                INSERT INTO usuarios (username, password_hash, rol, nombre_completo, email)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (username, password_hash, rol, nombre_completo, email))
+            conn.commit()
+            return cursor.lastrowid
+        except sqlite3.IntegrityError as e:
+            if 'username' in str(e):
+                raise UsuarioExistenteError(username) from e
+            raise
+        finally:
+            conn.close()
+
+    def actualizar_password(self, user_id, password_hash):
+        conn = self.connect()
+        conn.execute(
+            'UPDATE usuarios SET password_hash = ? WHERE id = ?', (password_hash, user_id)
+        )
+        conn.commit()
+        conn.close()
+
+    def marcar_email_verificado(self, user_id):
+        conn = self.connect()
+        conn.execute('UPDATE usuarios SET email_verificado = 1 WHERE id = ?', (user_id,))
+        conn.commit()
+        conn.close()
+
+    def modificar_usuarios(self, ids, activo=None, rol=None):
+        cambios = _cambios(activo, rol)
+        if not ids or not cambios:
+            return 0
+        conn = self.connect()
+        with conn:
+            total = _modificar_en(conn, list(ids), cambios)
+        conn.close()
+        return total
+
+    def eliminar_usuarios(self, ids):
+        if not ids:
+            return 0
+        conn = self.connect()
+        with conn:
+            total = _modificar_en(conn, list(ids), None)
+        conn.close()
+        return total
+
+    def registrar_acceso(self, user_id):
+        conn = self.connect()
+        conn.execute('''
+            UPDATE usuarios
+            SET ultimo_acceso = CURRENT_TIMESTAMP
+            WHERE id = ?
+        ''', (user_id,))
+        conn.commit()
+        conn.close()
+
+    def estadisticas(self, max_staleness=None):
+        conn = self.connect_lectura(max_staleness)
+        rows = conn.execute('''
+            SELECT rol, COUNT(*) AS total, SUM(activo = 1) AS activos
+            FROM usuarios
+            GROUP BY rol
+        ''').fetchall()
+        conn.close()
+
+        stats = _stats_vacias()
+        for row in rows:
+            stats['total'] += row['total']
+            stats['activos'] += row['activos'] or 0
+            if row['rol'] == 'admin':
+                stats['admins'] = row['total']
+            elif row['rol'] == 'usuario':
+                stats['usuarios'] = row['total']
+            elif row['rol'] == 'invitado':
+                stats['invitados'] = row['total']
+        return stats
+
+
+# ============================================================================
+# SQLITE PARTICIONADO (SHARDING POR HASH DE USERNAME)
+# ============================================================================
+
+# _modificar_todos() adjunta los demás shards a la conexión del primero y
+# SQLite admite como mucho 10 bases adjuntas (SQLITE_MAX_ATTACHED)
+MAX_SHARDS = 11
+
+
+class ShardedSQLiteStorage(StorageBackend):
+    """
+    Reparte la tabla usuarios entre varios archivos SQLite
+
+    - El shard de un usuario se elige con hash(username) % num_shards,
+      así login y registro solo tocan un archivo.
+    - Los ids globales codifican el shard: id_global = id_local * N + shard.
+      Con eso obtener_usuario() va directo al archivo correcto.
+    - listar_usuarios() y estadisticas() consultan todos los shards y
+      combinan los resultados.
+    """
+
+    def __init__(self, database, num_shards=4, shard_factory=SQLiteStorage):
+        if not 1 <= num_shards <= MAX_SHARDS:
+            raise ValueError(f'num_shards debe estar entre 1 y {MAX_SHARDS}')
+        base, ext = os.path.splitext(database)
+        self.database = database
+        self.num_shards = num_shards
+        self.shards = [
+            shard_factory(f'{base}.shard{i}{ext or ".db"}')
+            for i in range(num_shards)
+        ]
+
+    # --- Enrutado ----------------------------------------------------------
+
+    def shard_index(self, username):
+        """Índice de shard estable para un username"""
+        digest = hashlib.blake2b(username.encode('utf-8'), digest_size=8).digest()
+        return int.from_bytes(digest, 'big') % self.num_shards
+
+    def _id_global(self, id_local, shard):
+        return id_local * self.num_shards + shard
+
+    def _globalizar(self, user, shard):
+        if user is not None:
+            user['id'] = self._id_global(user['id'], shard)
+        return user
+
+    def _localizar(self, user_id):
+        user_id = int(user_id)
+        return self.shards[user_id % self.num_shards], user_id // self.num_shards
+
+    # --- Interfaz ----------------------------------------------------------
+
+    def init_schema(self):
+        for shard in self.shards:
+            shard.init_schema()
+
+    def version_esquema(self):
+        return min(shard.version_esquema() for shard in self.shards)
+
+    def marcar_version(self, version):
+        for shard in self.shards:
+            shard.marcar_version(version)
+
+    def iniciar(self):
+        for shard in self.shards:
+            shard.iniciar()
+
+    def contar_usuarios(self):
+        return sum(shard.contar_usuarios() for shard in self.shards)
+
+    def obtener_usuario(self, user_id, max_staleness=None):
+        shard, id_local = self._localizar(user_id)
+        user = shard.obtener_usuario(id_local, max_staleness)
+        return self._globalizar(user, int(user_id) % self.num_shards)
+
+    def obtener_usuario_por_username(self, username, solo_activos=False, max_staleness=None):
+        idx = self.shard_index(username)
+        user = self.shards[idx].obtener_usuario_por_username(
+            username, solo_activos, max_staleness
+        )
+        return self._globalizar(user, idx)
+
+    def listar_usuarios(self, max_staleness=None):
+        # Cada shard ya devuelve su lista ordenada; se mezclan sin reordenar todo
+        listas = [
+            [self._globalizar(u, idx) for u in shard.listar_usuarios(max_staleness)]
+            for idx, shard in enumerate(self.shards)
+        ]
+        return list(heapq.merge(
+            *listas,
+            key=lambda u: u['fecha_creacion'] or '',
+            reverse=True
+        ))
+
+    def obtener_usuario_por_email(self, email):
+        # El email no es la clave de reparto: se consulta cada shard
+        for idx, shard in enumerate(self.shards):
+            user = shard.obtener_usuario_por_email(email)
+            if user is not None:
+                return self._globalizar(user, idx)
+        return None
+
+    def crear_usuario(self, username, password_hash, rol, nombre_completo, email):
+        idx = self.shard_index(username)
+        id_local = self.shards[idx].crear_usuario(
+            username, password_hash, rol, nombre_completo, email
+        )
+        return self._id_global(id_local, idx)
+
+    def actualizar_password(self, user_id, password_hash):
+        shard, id_local = self._localizar(user_id)
+        shard.actualizar_password(id_local, password_hash)
+
+    def marcar_email_verificado(self, user_id):
+        shard, id_local = self._localizar(user_id)
+        shard.marcar_email_verificado(id_local)
+
+    def _modificar_todos(self, ids, cambios):
+        """
+        Aplica el cambio en todos los shards implicados con una única
+        transacción: los shards se adjuntan (ATTACH) a la conexión del
+        primero y SQLite confirma todos los archivos de forma atómica.
+        Por eso num_shards no puede pasar de MAX_SHARDS.
+        """
+        grupos = {}
+        for user_id in ids:
+            idx = int(user_id) % self.num_shards
+            grupos.setdefault(idx, []).append(int(user_id) // self.num_shards)
+        if not grupos:
+            return 0
+
+        conn = self.shards[0].connect()
+        for idx in grupos:
+            if idx != 0:
+                conn.execute(f'ATTACH DATABASE ? AS s{idx}', (self.shards[idx].database,))
+        total = 0
+        with conn:
+            for idx, locales in grupos.items():
+                esquema = 'main' if idx == 0 else f's{idx}'
+                total += _modificar_en(conn, locales, cambios, esquema)
+        conn.close()
+        return total
+
+    def modificar_usuarios(self, ids, activo=None, rol=None):
+        cambios = _cambios(activo, rol)
+        if not cambios:
+            return 0
+        return self._modificar_todos(ids, cambios)
+
+    def eliminar_usuarios(self, ids):
+        return self._modificar_todos(ids, None)
+
+    def registrar_acceso(self, user_id):
+        shard, id_local = self._localizar(user_id)
+        shard.registrar_acceso(id_local)
+
+    def estadisticas(self, max_staleness=None):
+        stats = _stats_vacias()
+        for shard in self.shards:
+            for clave, valor in shard.estadisticas(max_staleness).items():
+                stats[clave] += valor
+        return stats
+
+
+# ============================================================================
+# SQLITE CON RÉPLICA DE LECTURA
+# ============================================================================
+
+class ReplicatedSQLiteStorage(SQLiteStorage):
+    """
+    Separa escrituras y lecturas en dos archivos SQLite
+
+    - Todas las escrituras van al primario (database).
+    - Un hilo en segundo plano copia el primario a la réplica cada
+      `intervalo` segundos con backup.copia_online (API de backup online,
+      con límite de reinicios si hay escrituras). La copia se hace a un
+      archivo temporal propio de cada proceso que luego reemplaza a la
+      réplica, así los lectores nunca ven una réplica a medio copiar.
+    - Una lectura usa la réplica solo si su antigüedad es <= max_staleness;
+      si no, lee del primario.
+    """
+
+    def __init__(self, database, intervalo=5.0, replica=None, paginas=256):
+        super().__init__(database)
+        base, ext = os.path.splitext(database)
+        self.replica = replica or f'{base}.replica{ext or ".db"}'
+        self.intervalo = intervalo
+        # Páginas por paso de la copia
+        self.paginas = paginas
+        self.ultima_sincronizacion = None
+        self._lock = threading.Lock()
+        self._hilo = None
+
+    # --- Sincronización ----------------------------------------------------
+
+    def sincronizar_replica(self):
+        """Copia el primario a la réplica (backup online por páginas)"""
+        from backup import copia_online
+
+        with self._lock:
+            inicio = time.monotonic()
+            # Temporal único: otros procesos (workers, el reloader) copian a la vez
+            fd, temporal = tempfile.mkstemp(
+                dir=os.path.dirname(os.path.abspath(self.replica)),
+                prefix=os.path.basename(self.replica) + '.', suffix='.tmp'
+            )
+            os.close(fd)
+            try:
+                copia_online(self.database, temporal, self.paginas, pausa=0)
+                os.replace(temporal, self.replica)
+            finally:
+                if os.path.exists(temporal):
+                    os.remove(temporal)
+            # La antigüedad se mide desde el inicio de la copia
+            self.ultima_sincronizacion = inicio
+
+    def _bucle_replica(self):
+        while True:
+            time.sleep(self.intervalo)
+            try:
+                self.sincronizar_replica()
+            except Exception as e:
+                # Cualquier error mataría el hilo y la réplica dejaría de actualizarse
+                print(f"Error al sincronizar réplica: {e}")
+
+    def iniciar_replicacion(self):
+        """Hace una copia inicial y arranca el hilo de sincronización"""
+        if self._hilo is not None:
+            return
+        self.sincronizar_replica()
+        self._hilo = threading.Thread(
+            target=self._bucle_replica, name='securelink-replica', daemon=True
+        )
+        self._hilo.start()
+
+    def antiguedad_replica(self):
+        """Segundos desde la última sincronización (None si no hay réplica)"""
+        if self.ultima_sincronizacion is None:
+            return None
+        return time.monotonic() - self.ultima_sincronizacion
+
+    # --- Lecturas ----------------------------------------------------------
+
+    def connect_lectura(self, max_staleness=None):
+        if max_staleness is not None:
+            antiguedad = self.antiguedad_replica()
+            if antiguedad is not None and antiguedad <= max_staleness:
+                conn = sqlite3.connect(f'file:{self.replica}?mode=ro', uri=True)
+                conn.row_factory = sqlite3.Row
+                return conn
+        return self.connect()
+
+    def iniciar(self):
+        super().iniciar()
+        self.iniciar_replicacion()
+
+    def obtener_usuario(self, user_id, max_staleness=None):
+        user = super().obtener_usuario(user_id, max_staleness)
+        if user is None and max_staleness is not None:
+            # Un usuario recién creado puede no estar aún en la réplica
+            user = super().obtener_usuario(user_id)
+        return user
+
+
+# ============================================================================
+# FÁBRICA
+# ============================================================================
+
+def crear_storage(database, backend='sqlite', num_shards=4, replica_intervalo=None):
+    """
+    Crea el backend configurado
+
+    backend: 'sqlite' (por defecto) o 'sharded'
+    replica_intervalo: segundos entre copias a la réplica de lectura;
+        None o 0 desactiva las réplicas. Con 'sharded' cada shard tiene
+        su propia réplica.
+    """
+    if replica_intervalo:
+        def archivo(path):
+            return ReplicatedSQLiteStorage(path, replica_intervalo)
+    else:
+        archivo = SQLiteStorage
+
+    if backend == 'sqlite':
+        return archivo(database)
+    if backend == 'sharded':
+        return ShardedSQLiteStorage(database, num_shards, shard_factory=archivo)
+    raise ValueError(f'Backend de almacenamiento desconocido: {backend}')
@@ -0,0 +1,101 @@
+"""
+Renderizado de plantillas de SECURELINK
+
+- Caché de bytecode de Jinja en disco: las plantillas se compilan una vez
+  y los workers nuevos cargan el bytecode en lugar de recompilar.
+- Caché de fragmentos: la etiqueta {% cache 'nombre', clave... %} guarda
+  en memoria el HTML de bloques que solo dependen de su clave (por ejemplo
+  el navbar según session.rol). Las claves incluyen el id de despliegue,
+  así un despliegue nuevo invalida todos los fragmentos.
+"""
+
+import hashlib
+import os
+
+from jinja2 import FileSystemBytecodeCache, nodes
+from jinja2.ext import Extension
+
+
+class FragmentCacheExtension(Extension):
+    """
+    Etiqueta {% cache 'navbar', session.rol %}...{% endcache %}
+
+    El contenido del bloque se renderiza la primera vez para cada clave y
+    después se sirve desde environment.fragment_cache.
+    """
+
+    tags = {'cache'}
+
+    def __init__(self, environment):
+        super().__init__(environment)
+        environment.extend(fragment_cache_prefix='', fragment_cache=None)
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        args = [parser.parse_expression()]
+        while parser.stream.skip_if('comma'):
+            args.append(parser.parse_expression())
+        body = parser.parse_statements(('name:endcache',), drop_needle=True)
+        return nodes.CallBlock(
+            self.call_method('_cache_support', [nodes.List(args)]), [], [], body
+        ).set_lineno(lineno)
+
+    def _cache_support(self, partes, caller):
+        cache = self.environment.fragment_cache
+        if cache is None:
+            return caller()
+
+        clave = (self.environment.fragment_cache_prefix,) + tuple(partes)
+        html = cache.get(clave)
+        if html is None:
+            html = caller()
+            cache[clave] = html
+        return html
+
+
+def calcular_deploy_id(template_folder):
+    """
+    Identificador del despliegue actual
+
+    Usa SECURELINK_DEPLOY_ID si está definido; si no, un hash de las
+    rutas, tamaños y fechas de modificación de las plantillas.
+    """
+    deploy_id = os.environ.get('SECURELINK_DEPLOY_ID')
+    if deploy_id:
+        return deploy_id
+
+    digest = hashlib.sha1()
+    for raiz, _, archivos in sorted(os.walk(template_folder)):
+        for nombre in sorted(archivos):
+            path = os.path.join(raiz, nombre)
+            info = os.stat(path)
+            digest.update(f'{path}:{info.st_size}:{info.st_mtime_ns}'.encode('utf-8'))
+    return digest.hexdigest()[:12]
+
+
+def configurar_plantillas(app, cache_dir):
+    """Activa la caché de bytecode en disco y la caché de fragmentos"""
+    os.makedirs(cache_dir, exist_ok=True)
+
+    env = app.jinja_env
+    env.bytecode_cache = FileSystemBytecodeCache(cache_dir)
+    env.add_extension(FragmentCacheExtension)
+    env.fragment_cache = {}
+    env.fragment_cache_prefix = calcular_deploy_id(
+        os.path.join(app.root_path, app.template_folder)
+    )
+
+
+def precompilar_plantillas(app):
+    """
+    Compila todas las plantillas al arrancar
+
+    Devuelve el número de plantillas compiladas. Las que ya estaban en la
+    caché de bytecode solo se cargan.
+    """
+    env = app.jinja_env
+    nombres = env.list_templates(extensions=['html'])
+    for nombre in nombres:
+        env.get_template(nombre)
+    return len(nombres)
+
@@ -0,0 +1,890 @@
+"""
+Pruebas de SECURELINK
+
+Ejecutar desde esta carpeta:
+    python -m pytest -q test_auth.py
+"""
+
+import os
+import json
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+import gzip
+from argparse import Namespace
+
+import pytest
+
+import assets
+import analytics
+import audit
+import backup
+import generar_datos
+import mfa
+import tokens
+from mailer import MailQueue
+from storage import MAX_SHARDS, SCHEMA_VERSION, ReplicatedSQLiteStorage, SQLiteStorage, ShardedSQLiteStorage
+from usercache import UserCache
+
+
+# ============================================================================
+# APLICACIÓN
+# ============================================================================
+
+@pytest.fixture(scope='module')
+def securelink(tmp_path_factory):
+    """Módulo app con su base de datos en una carpeta temporal"""
+    # DATABASE y las carpetas de logs/correo son relativas al directorio
+    # actual. No se vuelve al anterior: el hilo de correo sigue abriendo
+    # la base de datos hasta que termina pytest.
+    os.chdir(tmp_path_factory.mktemp('securelink'))
+    import app
+    app.init_db()
+    yield app
+    app.audit_log.volcar()
+
+
+def iniciar_sesion(securelink, username, password):
+    cliente = securelink.app.test_client()
+    respuesta = cliente.post('/login', data={'username': username, 'password': password})
+    assert respuesta.status_code == 302
+    return cliente
+
+
+def test_plantillas_precompiladas_al_importar(securelink):
+    # Sin pasar por __main__, como un worker WSGI
+    assert securelink.TOTAL_PLANTILLAS == len(securelink.app.jinja_env.list_templates(extensions=['html']))
+    assert len(os.listdir(securelink.TEMPLATE_CACHE_DIR)) >= securelink.TOTAL_PLANTILLAS
+
+    cliente = iniciar_sesion(securelink, 'juan.perez', 'Usuario123!')
+    assert cliente.get('/perfil').status_code == 200
+    claves = securelink.app.jinja_env.fragment_cache
+    assert any(clave[1] == 'perfil-seguridad' for clave in claves)
+
+
+# ============================================================================
+# ALMACENAMIENTO CON SHARDS
+# ============================================================================
+
+@pytest.fixture
+def sharded(tmp_path):
+    storage = ShardedSQLiteStorage(str(tmp_path / 'securelink.db'), num_shards=3)
+    storage.init_schema()
+    return storage
+
+
+def crear(storage, username):
+    return storage.crear_usuario(username, 'hash', 'usuario', username.title(), f'{username}@x.com')
+
+
+def test_id_global_codifica_el_shard(sharded):
+    ids = {f'usuario{i}': crear(sharded, f'usuario{i}') for i in range(30)}
+
+    assert len(set(ids.values())) == len(ids)
+    for username, user_id in ids.items():
+        assert user_id % sharded.num_shards == sharded.shard_index(username)
+        user = sharded.obtener_usuario(user_id)
+        assert user['username'] == username
+        assert user['id'] == user_id
+        assert sharded.obtener_usuario_por_username(username)['id'] == user_id
+
+
+def test_id_local_vive_en_su_shard(sharded):
+    user_id = crear(sharded, 'ana')
+    shard = sharded.shards[user_id % sharded.num_shards]
+    conn = sqlite3.connect(shard.database)
+    username = conn.execute(
+        'SELECT username FROM usuarios WHERE id = ?', (user_id // sharded.num_shards,)
+    ).fetchone()[0]
+    conn.close()
+    assert username == 'ana'
+
+
+def test_shard_index_estable(sharded):
+    otro = ShardedSQLiteStorage(sharded.database, num_shards=3)
+    for i in range(50):
+        assert otro.shard_index(f'u{i}') == sharded.shard_index(f'u{i}')
+
+
+def test_listar_usuarios_mezcla_shards_por_fecha(sharded):
+    fechas = {}
+    for i in range(24):
+        username = f'usuario{i}'
+        user_id = crear(sharded, username)
+        # Fechas intercaladas entre shards, sin relación con el orden de alta
+        fechas[username] = f'2024-01-{(i * 7) % 24 + 1:02d} 10:00:00'
+        shard = sharded.shards[user_id % sharded.num_shards]
+        conn = sqlite3.connect(shard.database)
+        conn.execute(
+            'UPDATE usuarios SET fecha_creacion = ? WHERE id = ?',
+            (fechas[username], user_id // sharded.num_shards)
+        )
+        conn.commit()
+        conn.close()
+
+    usuarios = sharded.listar_usuarios()
+
+    assert [u['username'] for u in usuarios] == sorted(fechas, key=fechas.get, reverse=True)
+    assert {u['id'] % sharded.num_shards for u in usuarios} == {0, 1, 2}
+    for u in usuarios:
+        assert sharded.obtener_usuario(u['id'])['username'] == u['username']
+
+
+def test_shards_limitados_por_attach(tmp_path):
+    with pytest.raises(ValueError):
+        ShardedSQLiteStorage(str(tmp_path / 'securelink.db'), num_shards=MAX_SHARDS + 1)
+
+    storage = ShardedSQLiteStorage(str(tmp_path / 'securelink.db'), num_shards=MAX_SHARDS)
+    storage.init_schema()
+    ids = [crear(storage, f'usuario{i}') for i in range(60)]
+    assert {user_id % MAX_SHARDS for user_id in ids} == set(range(MAX_SHARDS))
+    assert storage.modificar_usuarios(ids, activo=0) == len(ids)
+    assert all(storage.obtener_usuario(user_id)['activo'] == 0 for user_id in ids)
+
+
+
+# ============================================================================
+# RÉPLICA DE LECTURA
+# ============================================================================
+
+@pytest.fixture
+def replicado(tmp_path):
+    storage = ReplicatedSQLiteStorage(str(tmp_path / 'securelink.db'), intervalo=3600)
+    storage.init_schema()
+    crear(storage, 'ana')
+    storage.sincronizar_replica()
+    # Solo en el primario hasta la siguiente sincronización
+    crear(storage, 'luis')
+    return storage
+
+
+def test_replica_sirve_lecturas_tolerantes(replicado):
+    assert [u['username'] for u in replicado.listar_usuarios(max_staleness=60)] == ['ana']
+    assert {u['username'] for u in replicado.listar_usuarios()} == {'ana', 'luis'}
+    assert replicado.obtener_usuario_por_username('luis', max_staleness=60) is None
+    assert replicado.obtener_usuario_por_username('luis')['username'] == 'luis'
+
+
+def test_replica_demasiado_antigua_lee_del_primario(replicado):
+    replicado.ultima_sincronizacion = time.monotonic() - 120
+    assert {u['username'] for u in replicado.listar_usuarios(max_staleness=60)} == {'ana', 'luis'}
+
+
+def test_replica_obtener_usuario_recurre_al_primario(replicado):
+    user_id = replicado.obtener_usuario_por_username('luis')['id']
+    assert replicado.obtener_usuario(user_id, max_staleness=60)['username'] == 'luis'
+
+
+def test_replica_sincroniza_con_escrituras_continuas(replicado, tmp_path):
+    conn = sqlite3.connect(replicado.database)
+    conn.executemany(
+        'INSERT INTO usuarios (username, password_hash, rol, nombre_completo, email) '
+        "VALUES (?, ?, 'usuario', 'Carga', 'carga@x.com')",
+        [(f'carga{i}', 'x' * 300) for i in range(20000)]
+    )
+    conn.commit()
+    conn.close()
+    # Pasos de una página: cualquier escritura entre pasos reinicia la copia
+    replicado.paginas = 1
+    parar = threading.Event()
+
+    def escritor():
+        conn = sqlite3.connect(replicado.database, timeout=30)
+        while not parar.is_set():
+            conn.execute("UPDATE usuarios SET ultimo_acceso = datetime('now') WHERE username = 'ana'")
+            conn.commit()
+            escrituras[0] += 1
+            time.sleep(0.0005)
+        conn.close()
+
+    escrituras = [0]
+    hilo_escritor = threading.Thread(target=escritor)
+    hilo_escritor.start()
+    while escrituras[0] == 0:
+        time.sleep(0.001)
+    try:
+        hilo = threading.Thread(target=replicado.sincronizar_replica)
+        hilo.start()
+        hilo.join(timeout=30)
+        assert not hilo.is_alive()
+    finally:
+        parar.set()
+        hilo_escritor.join()
+
+    assert len(replicado.listar_usuarios(max_staleness=60)) == 20002
+    assert not [n for n in os.listdir(tmp_path) if n.endswith('.tmp')]
+
+def test_restaurar_snapshot_borra_journals_huerfanos(tmp_path):
+    args = Namespace(db=str(tmp_path / 'securelink.db'), shards=1)
+    storage = SQLiteStorage(args.db)
+    storage.init_schema()
+    crear(storage, 'ana')
+    generar_datos.snapshot(args, str(tmp_path / 'snapshot.tar.gz'))
+
+    for sufijo in ('-journal', '-wal', '-shm'):
+        with open(args.db + sufijo, 'wb') as f:
+            f.write(b'restos de otra base de datos')
+    generar_datos.restaurar(args, str(tmp_path / 'snapshot.tar.gz'))
+
+    assert not any(os.path.exists(args.db + s) for s in ('-journal', '-wal', '-shm'))
+    assert storage.obtener_usuario_por_username('ana') is not None
+
+def test_cargar_tras_borrar_no_repite_usernames(tmp_path, monkeypatch):
+    # Un solo nombre posible: el username solo se distingue por el sufijo
+    monkeypatch.setattr(generar_datos, 'NOMBRES', ['ana'])
+    monkeypatch.setattr(generar_datos, 'APELLIDOS', ['ruiz'])
+    args = Namespace(
+        db=str(tmp_path / 'securelink.db'), usuarios=5, roles='usuario=1', activos=1.0,
+        sin_acceso=0.2, dias=30, dias_actividad=7, pool=1, semilla=42, fecha_fija=True,
+        shards=1, reemplazar=False
+    )
+    generar_datos.cargar(args)
+    storage = SQLiteStorage(args.db)
+    # Los primeros: COUNT(*) bajaría a 3 y repetiría los sufijos 3 y 4
+    ids = sorted(u['id'] for u in storage.listar_usuarios())
+    storage.eliminar_usuarios(ids[:2])
+
+    assert generar_datos.cargar(args) == 5
+    assert len(storage.listar_usuarios()) == 8
+
+# ============================================================================
+# BACKUPS
+# ============================================================================
+
+def test_copia_online_termina_con_escrituras_continuas(tmp_path, capsys):
+    origen = str(tmp_path / 'origen.db')
+    conn = sqlite3.connect(origen)
+    conn.execute('CREATE TABLE datos (id INTEGER PRIMARY KEY, valor BLOB)')
+    conn.executemany('INSERT INTO datos (valor) VALUES (?)', [(os.urandom(200),) for _ in range(2000)])
+    conn.commit()
+    conn.close()
+
+    parar = threading.Event()
+    escrituras = [0]
+
+    def escritor():
+        conn = sqlite3.connect(origen, timeout=30)
+        while not parar.is_set():
+            conn.execute('UPDATE datos SET valor = ? WHERE id = ?',
+                         (os.urandom(200), escrituras[0] % 2000 + 1))
+            conn.commit()
+            escrituras[0] += 1
+            time.sleep(0.0005)
+        conn.close()
+
+    hilo_escritor = threading.Thread(target=escritor)
+    hilo_escritor.start()
+    while escrituras[0] == 0:
+        time.sleep(0.001)
+    try:
+        hilo_copia = threading.Thread(
+            target=backup.copia_online, args=(origen, str(tmp_path / 'copia.db'), 1, 0.001)
+        )
+        hilo_copia.start()
+        hilo_copia.join(timeout=30)
+        assert not hilo_copia.is_alive()
+    finally:
+        parar.set()
+        hilo_escritor.join()
+
+    assert 'en un solo paso' in capsys.readouterr().out
+    conn = sqlite3.connect(str(tmp_path / 'copia.db'))
+    assert conn.execute('PRAGMA integrity_check').fetchone()[0] == 'ok'
+    assert conn.execute('SELECT COUNT(*) FROM datos').fetchone()[0] == 2000
+    conn.close()
+
+def test_copia_en_un_paso_no_bloquea_escrituras(tmp_path):
+    storage = SQLiteStorage(str(tmp_path / 'securelink.db'))
+    storage.init_schema()
+    storage.iniciar()
+    conn = storage.connect()
+    assert conn.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+    conn.execute('CREATE TABLE datos (id INTEGER PRIMARY KEY, valor BLOB)')
+    conn.executemany('INSERT INTO datos (valor) VALUES (?)', [(os.urandom(1000),) for _ in range(20000)])
+    conn.commit()
+    conn.close()
+
+    copiando = threading.Event()
+    bloqueos, escrituras = [], [0]
+
+    def escritor():
+        # Sin espera: en modo DELETE fallaría mientras dura la copia
+        conn = sqlite3.connect(storage.database, timeout=0)
+        while copiando.is_set():
+            try:
+                conn.execute('UPDATE datos SET valor = ? WHERE id = 1', (os.urandom(1000),))
+                conn.commit()
+                escrituras[0] += 1
+            except sqlite3.OperationalError as e:
+                conn.rollback()
+                bloqueos.append(str(e))
+        conn.close()
+
+    copiando.set()
+    hilo_escritor = threading.Thread(target=escritor)
+    hilo_escritor.start()
+    try:
+        backup.copia_online(storage.database, str(tmp_path / 'copia.db'), paginas=-1, pausa=0)
+    finally:
+        copiando.clear()
+        hilo_escritor.join()
+
+    assert not bloqueos
+    assert escrituras[0] > 0
+    # La copia no arrastra el modo WAL: se abre en solo lectura sin dejar -wal/-shm
+    copia = sqlite3.connect(f'file:{tmp_path / "copia.db"}?mode=ro', uri=True)
+    assert copia.execute('PRAGMA journal_mode').fetchone()[0] == 'delete'
+    assert copia.execute('SELECT COUNT(*) FROM datos').fetchone()[0] == 20000
+    copia.close()
+    assert not os.path.exists(str(tmp_path / 'copia.db-wal'))
+
+# ============================================================================
+# ARCHIVOS ESTÁTICOS
+# ============================================================================
+
+CSS_PRUEBA = b'body { color: #123456; }\n' * 200
+
+
+@pytest.fixture
+def pipeline(tmp_path):
+    from flask import Flask
+
+    static = tmp_path / 'static'
+    (static / 'css').mkdir(parents=True)
+    (static / 'css' / 'custom.css').write_bytes(CSS_PRUEBA)
+    app = Flask(__name__, static_folder=str(static))
+    return app, assets.AssetPipeline(app, str(tmp_path / 'cache'))
+
+
+def test_assets_con_huella_inmutables_y_etag(pipeline):
+    app, pipe = pipeline
+    cliente = app.test_client()
+    with app.test_request_context():
+        url = pipe.asset_url('css/custom.css')
+    assert url != '/assets/css/custom.css'
+
+    respuesta = cliente.get(url)
+    assert respuesta.data == CSS_PRUEBA
+    assert respuesta.cache_control.max_age == assets.MAX_AGE_INMUTABLE
+    assert respuesta.cache_control.immutable
+    etag = respuesta.headers['ETag']
+
+    respuesta = cliente.get(url, headers={'If-None-Match': etag})
+    assert respuesta.status_code == 304
+
+
+def test_assets_sin_huella_se_revalidan(pipeline):
+    app, _ = pipeline
+    respuesta = app.test_client().get('/assets/css/custom.css')
+    assert respuesta.status_code == 200
+    assert respuesta.cache_control.no_cache
+    assert not respuesta.cache_control.immutable
+
+
+def test_assets_negocia_accept_encoding(pipeline):
+    app, pipe = pipeline
+    cliente = app.test_client()
+    with app.test_request_context():
+        url = pipe.asset_url('css/custom.css')
+
+    plano = cliente.get(url)
+    assert 'Content-Encoding' not in plano.headers
+    assert 'Accept-Encoding' in plano.headers['Vary']
+
+    comprimido = cliente.get(url, headers={'Accept-Encoding': 'gzip'})
+    assert comprimido.headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(comprimido.data) == CSS_PRUEBA
+    # Cada variante tiene su propio ETag
+    assert comprimido.headers['ETag'] != plano.headers['ETag']
+    assert not [n for n in os.listdir(pipe.cache_dir) if n.endswith('.tmp')]
+
+
+def test_vendor_sirve_fuentes_locales(tmp_path, monkeypatch):
+    css_google = (
+        "@font-face { src: url(https://fonts.gstatic.com/s/inter/v13/a.woff2) format('woff2'); }\n"
+        "@font-face { src: url(https://fonts.gstatic.com/s/inter/v13/a.woff2) format('woff2'); }\n"
+    )
+    descargas = {'https://fonts.gstatic.com/s/inter/v13/a.woff2': b'wOF2'}
+    for url, _ in assets.CDN_ASSETS.values():
+        descargas.setdefault(url, css_google.encode('utf-8') if 'googleapis' in url else b'/* */')
+    monkeypatch.setattr(assets, '_descargar', descargas.__getitem__)
+
+    assets.vendor(str(tmp_path))
+
+    carpeta = tmp_path / 'vendor' / 'fonts'
+    css = (carpeta / 'inter.css').read_text()
+    assert 'gstatic' not in css
+    assert css.count('url(./a.woff2)') == 2
+    assert (carpeta / 'a.woff2').read_bytes() == b'wOF2'
+
+
+def test_plantillas_usan_fuente_local_tras_vendor(pipeline):
+    app, pipe = pipeline
+    with app.test_request_context():
+        assert pipe.cdn_url('fuentes_css').startswith('https://fonts.googleapis.com/')
+    local = os.path.join(pipe.static_folder, assets.CDN_ASSETS['fuentes_css'][1])
+    os.makedirs(os.path.dirname(local))
+    with open(local, 'w') as f:
+        f.write('@font-face {}')
+    pipe.construir()
+    with app.test_request_context():
+        assert pipe.cdn_local('fuentes_css')
+        assert pipe.cdn_url('fuentes_css').startswith('/assets/vendor/fonts/inter.')
+
+# ============================================================================
+# CACHÉ DE USUARIOS
+# ============================================================================
+
+def test_revocacion_inmediata_en_otros_workers(tmp_path):
+    storage = SQLiteStorage(str(tmp_path / 'securelink.db'))
+    storage.init_schema()
+    user_id = crear(storage, 'ana')
+    # Dos workers, cada uno con su caché; el TTL no llega a vencer
+    worker_a = UserCache(storage, ttl=3600)
+    worker_b = UserCache(storage, ttl=3600)
+    assert worker_b.obtener(user_id)['activo'] == 1
+
+    storage.modificar_usuarios([user_id], activo=0)
+    worker_a.invalidar([user_id])
+
+    assert worker_b.obtener(user_id)['activo'] == 0
+    assert worker_a.obtener(user_id)['activo'] == 0
+
+def test_cache_no_reutiliza_lectura_hecha_durante_revocacion(tmp_path):
+    storage = SQLiteStorage(str(tmp_path / 'securelink.db'))
+    storage.init_schema()
+    user_id = crear(storage, 'ana')
+    otro_id = crear(storage, 'luis')
+    worker_a = UserCache(storage, ttl=3600)
+    worker_b = UserCache(storage, ttl=3600)
+    leer = storage.obtener_usuario
+
+    def lectura_lenta(uid):
+        # Se lee el registro antiguo y, antes de guardarlo, otro worker
+        # revoca y otro hilo de este worker ya ve la generación nueva
+        storage.obtener_usuario = leer
+        user = leer(uid)
+        storage.modificar_usuarios([uid], activo=0)
+        worker_a.invalidar([uid])
+        worker_b.obtener(otro_id)
+        return user
+
+    storage.obtener_usuario = lectura_lenta
+    assert worker_b.obtener(user_id)['activo'] == 1
+    assert worker_b.obtener(user_id)['activo'] == 0
+
+
+# ============================================================================
+# AUDITORÍA
+# ============================================================================
+
+class SinkIntermitente:
+    """Falla las primeras `fallos` escrituras; llama a `al_escribir` antes de cada una"""
+
+    def __init__(self, fallos=1, al_escribir=None):
+        self.fallos = fallos
+        self.al_escribir = al_escribir
+        self.escritos = []
+
+    def escribir(self, eventos):
+        if self.al_escribir:
+            self.al_escribir()
+        if self.fallos:
+            self.fallos -= 1
+            raise sqlite3.OperationalError('database is locked')
+        self.escritos.extend(eventos)
+
+
+def test_auditoria_reintenta_lote_fallido():
+    sink = SinkIntermitente(fallos=1)
+    log = audit.AuditLog(sink, lote=1000, intervalo=3600)
+    for username in ('a', 'b', 'c'):
+        log.registrar(audit.LOGIN_OK, username)
+
+    log.volcar()
+    assert sink.escritos == []
+    assert log.pendientes() == 3
+
+    log.volcar()
+    assert [e['username'] for e in sink.escritos] == ['a', 'b', 'c']
+    assert log.descartados == 0
+    log.cerrar()
+
+
+def test_auditoria_cuenta_descartes_al_devolver_lote():
+    nuevos = []
+    log = None
+
+    def registrar_durante_escritura():
+        if not nuevos:
+            nuevos.extend(['d', 'e'])
+            for username in nuevos:
+                log.registrar(audit.LOGIN_OK, username)
+
+    sink = SinkIntermitente(fallos=1, al_escribir=registrar_durante_escritura)
+    log = audit.AuditLog(sink, capacidad=3, lote=1000, intervalo=3600)
+    for username in ('a', 'b', 'c'):
+        log.registrar(audit.LOGIN_OK, username)
+
+    log.volcar()
+    assert log.descartados == 2
+    log.volcar()
+    # Se conservan el más reciente del lote fallido y los eventos nuevos, en orden
+    assert [e['username'] for e in sink.escritos] == ['c', 'd', 'e']
+    log.cerrar()
+
+
+# ============================================================================
+# ANALÍTICA
+# ============================================================================
+
+def login(user_id, ts, tipo=audit.LOGIN_OK, rol='usuario'):
+    return {'tipo': tipo, 'rol': rol, 'ts': ts, 'user_id': user_id}
+
+
+@pytest.fixture
+def rollups(tmp_path):
+    # Sin compactación automática: cada prueba decide cuándo compactar
+    return analytics.RollupEngine(str(tmp_path / 'rollups.db'), intervalo_compactacion=float('inf'))
+
+
+def test_rollups_cuentan_logins_y_activos(rollups):
+    t = 1_700_000_000
+    rollups.procesar([login(1, t), login(1, t + 1), login(2, t + 2), login(3, t + 3, audit.LOGIN_FALLO)])
+
+    bucket, = rollups.serie('hora', 1, ahora=t)
+    assert (bucket['ok'], bucket['fallo']) == (3, 1)
+    assert bucket['tasa_fallo'] == 0.25
+    assert bucket['por_rol']['usuario'] == {'ok': 3, 'fallo': 1, 'activos': 2}
+
+
+def test_rollups_compactar_respeta_margen(rollups):
+    t = analytics.inicio_bucket(1_700_000_000, 'minuto')
+    rollups.procesar([login(1, t)])
+    # Cerrado hace 10 s: sigue en el detalle y un evento tardío no duplica
+    rollups.compactar(ahora=t + 70)
+    rollups.procesar([login(1, t + 5), login(2, t + 6)])
+    rollups.compactar(ahora=t + 60 + rollups.margen + 1)
+
+    bucket = rollups.serie('minuto', 2, ahora=t + 60)[0]
+    assert bucket['bucket'] == t
+    assert bucket['por_rol']['usuario']['activos'] == 2
+
+
+def test_rollups_eventos_tardios_no_duplican_activos(rollups):
+    t = analytics.inicio_bucket(1_700_000_000, 'dia')
+    rollups.procesar([login(1, t + 10), login(2, t + 20)])
+    rollups.compactar(ahora=t + 2 * 86400)
+    # Lote reintentado o volcado con retraso tras compactar
+    rollups.procesar([login(1, t + 30)])
+    rollups.compactar(ahora=t + 3 * 86400)
+
+    bucket = rollups.serie('dia', 4, ahora=t + 3 * 86400)[0]
+    assert bucket['bucket'] == t
+    assert bucket['ok'] == 3
+    assert bucket['por_rol']['usuario']['activos'] == 2
+
+
+def test_rollups_retencion(rollups):
+    t = analytics.inicio_bucket(1_700_000_000, 'hora')
+    rollups.procesar([login(1, t)])
+    rollups.compactar(ahora=t + analytics.RETENCION['minuto'] + 3600)
+
+    conn = rollups.connect()
+    granularidades = {f[0] for f in conn.execute('SELECT DISTINCT granularidad FROM rollups_auth')}
+    conn.close()
+    assert granularidades == {'hora', 'dia'}
+    assert analytics.max_buckets('minuto') == analytics.RETENCION['minuto'] // 60
+    assert analytics.max_buckets('dia') == 500
+
+# ============================================================================
+# COLA DE CORREO Y TOKENS
+# ============================================================================
+
+class TransportAnotador:
+    """Apunta los ids enviados; `durante_envio` se ejecuta a mitad de lote"""
+
+    def __init__(self, durante_envio=None):
+        self.enviados = []
+        self.durante_envio = durante_envio
+
+    def enviar_lote(self, filas):
+        if self.durante_envio:
+            self.durante_envio()
+        self.enviados.extend(fila['id'] for fila in filas)
+        return {fila['id']: None for fila in filas}
+
+
+def test_cola_correo_dos_workers_no_duplican(tmp_path):
+    database = str(tmp_path / 'correo.db')
+    transporte_b = TransportAnotador()
+    worker_b = MailQueue(database, transporte_b, lote=3)
+    # B intenta vaciar la cola mientras A está enviando su lote
+    transporte_a = TransportAnotador(durante_envio=worker_b.procesar_lote)
+    worker_a = MailQueue(database, transporte_a, lote=3)
+
+    conn = worker_a.connect()
+    with conn:
+        conn.executemany(
+            'INSERT INTO cola_correo (destinatario, asunto, cuerpo, creado) VALUES (?, ?, ?, ?)',
+            [(f'u{i}@x.com', 'asunto', 'cuerpo', time.time()) for i in range(5)]
+        )
+    conn.close()
+
+    worker_a.procesar_lote()
+    worker_a.procesar_lote()
+
+    assert transporte_a.enviados == [1, 2, 3]
+    assert transporte_b.enviados == [4, 5]
+    assert worker_a.pendientes() == 0
+
+
+def test_cola_correo_reclama_filas_con_plazo_vencido(tmp_path):
+    database = str(tmp_path / 'correo.db')
+    transporte = TransportAnotador()
+    worker = MailQueue(database, transporte)
+    conn = worker.connect()
+    with conn:
+        conn.execute(
+            'INSERT INTO cola_correo (destinatario, asunto, cuerpo, creado, reclamado) '
+            'VALUES (?, ?, ?, ?, ?)', ('a@x.com', 'a', 'a', time.time(), time.time() + 60)
+        )
+        conn.execute(
+            'INSERT INTO cola_correo (destinatario, asunto, cuerpo, creado, reclamado) '
+            'VALUES (?, ?, ?, ?, ?)', ('b@x.com', 'b', 'b', time.time(), time.time() - 1)
+        )
+    conn.close()
+
+    worker.procesar_lote()
+    # La fila 1 sigue reservada por otro worker; la 2 tenía el plazo vencido
+    assert transporte.enviados == [2]
+
+
+def test_tokens_purga_usados_y_caducados(tmp_path):
+    store = tokens.TokenStore(str(tmp_path / 'tokens.db'), intervalo_purga=0)
+    usado = store.emitir(1, tokens.RESET_PASSWORD, ttl=3600)
+    assert store.consumir(usado, tokens.RESET_PASSWORD) == 1
+    store.emitir(2, tokens.VERIFICAR_EMAIL, ttl=-1)
+    vigente = store.emitir(3, tokens.RESET_PASSWORD, ttl=3600)
+
+    conn = store.connect()
+    filas = conn.execute('SELECT user_id FROM tokens_cuenta').fetchall()
+    conn.close()
+    assert [f[0] for f in filas] == [3]
+    assert store.validar(vigente, tokens.RESET_PASSWORD) == 3
+
+
+def test_enlace_de_correo_no_usa_la_cabecera_host(securelink):
+    cliente = securelink.app.test_client()
+    respuesta = cliente.post(
+        '/recuperar', data={'email': 'juan.perez@securelink.com'},
+        headers={'Host': 'atacante.example'}
+    )
+    assert respuesta.status_code == 302
+
+    conn = securelink.mail_queue.connect()
+    cuerpo = conn.execute(
+        'SELECT cuerpo FROM cola_correo WHERE destinatario = ? ORDER BY id DESC',
+        ('juan.perez@securelink.com',)
+    ).fetchone()['cuerpo']
+    conn.close()
+    assert 'atacante.example' not in cuerpo
+    assert f'{securelink.BASE_URL}/restablecer/' in cuerpo
+
+def test_restablecer_password_cierra_sesiones_abiertas(securelink):
+    cliente = iniciar_sesion(securelink, 'maria.lopez', 'Usuario123!')
+    assert cliente.get('/perfil').status_code == 200
+
+    user_id = securelink.storage.obtener_usuario_por_username('maria.lopez')['id']
+    token = securelink.tokens_cuenta.emitir(user_id, tokens.RESET_PASSWORD, ttl=3600)
+    respuesta = securelink.app.test_client().post(f'/restablecer/{token}', data={
+        'password': 'OtraClave123!', 'password_confirm': 'OtraClave123!'
+    })
+    assert respuesta.status_code == 302
+
+    respuesta = cliente.get('/perfil')
+    assert respuesta.status_code == 302
+    assert '/login' in respuesta.headers['Location']
+    iniciar_sesion(securelink, 'maria.lopez', 'OtraClave123!')
+
+
+# ============================================================================
+# SEGUNDO FACTOR (MFA)
+# ============================================================================
+
+@pytest.mark.parametrize('instante, esperado', [
+    # RFC 6238, apéndice B (SHA-1): últimos DIGITOS de cada código de 8 cifras
+    (59, '94287082'),
+    (1111111109, '07081804'),
+    (1111111111, '14050471'),
+    (1234567890, '89005924'),
+    (2000000000, '69279037'),
+])
+def test_totp_vectores_rfc6238(instante, esperado):
+    clave = b'12345678901234567890'
+    assert mfa.codigo_totp(clave, instante // mfa.PASO) == esperado[-mfa.DIGITOS:]
+    assert mfa.contador_valido(clave, esperado[-mfa.DIGITOS:], ahora=instante) == instante // mfa.PASO
+
+
+@pytest.fixture
+def mfa_store(tmp_path):
+    store = mfa.MFAStore(str(tmp_path / 'mfa.db'), b'clave-maestra', max_fallos=3, bloqueo=60)
+    secreto = store.iniciar_alta(7)
+    clave = mfa._clave(secreto)
+    respaldo = store.confirmar_alta(7, mfa.codigo_totp(clave, int(time.time() // mfa.PASO) - 1))
+    assert respaldo is not None
+    return store, clave, respaldo
+
+
+def test_mfa_rechaza_codigo_repetido(mfa_store):
+    store, clave, _ = mfa_store
+    codigo = mfa.codigo_totp(clave, int(time.time() // mfa.PASO))
+    assert store.verificar(7, codigo)
+    assert not store.verificar(7, codigo)
+
+
+def test_mfa_codigos_respaldo_de_un_solo_uso(mfa_store):
+    store, _, respaldo = mfa_store
+    assert store.codigos_respaldo_restantes(7) == len(respaldo)
+    assert store.verificar(7, respaldo[0].upper())
+    assert not store.verificar(7, respaldo[0])
+    assert store.codigos_respaldo_restantes(7) == len(respaldo) - 1
+
+
+def test_mfa_bloqueo_tras_fallos(mfa_store):
+    store, clave, respaldo = mfa_store
+    for _ in range(3):
+        assert not store.verificar(7, '000000')
+    assert store.bloqueado(7) > 0
+    # Bloqueado, ni siquiera un código correcto pasa
+    assert not store.verificar(7, mfa.codigo_totp(clave, int(time.time() // mfa.PASO)))
+    assert not store.verificar(7, respaldo[0])
+
+
+def test_mfa_acierto_reinicia_fallos(mfa_store):
+    store, _, respaldo = mfa_store
+    for codigo in ('000000', '000000', respaldo[0], '000000', '000000'):
+        store.verificar(7, codigo)
+    assert store.bloqueado(7) == 0
+
+
+def test_mfa_bloqueo_sobrevive_a_cookie_reenviada(securelink):
+    user_id = securelink.storage.obtener_usuario_por_username('invitado')['id']
+    store = securelink.obtener_mfa_store()
+    clave = mfa._clave(store.iniciar_alta(user_id))
+    store.confirmar_alta(user_id, mfa.codigo_totp(clave, int(time.time() // mfa.PASO) - 1))
+
+    cliente = securelink.app.test_client()
+    respuesta = cliente.post('/login', data={'username': 'invitado', 'password': 'Invitado123!'})
+    assert respuesta.headers['Location'].endswith('/login/mfa')
+    cookie = cliente.get_cookie('session').value
+
+    for _ in range(securelink.MFA_MAX_INTENTOS * 3):
+        cliente.set_cookie('session', cookie)
+        cliente.post('/login/mfa', data={'codigo': '000000'})
+
+    cliente.set_cookie('session', cookie)
+    codigo = mfa.codigo_totp(clave, int(time.time() // mfa.PASO))
+    respuesta = cliente.post('/login/mfa', data={'codigo': codigo})
+    assert respuesta.headers['Location'].endswith('/login')
+    assert store.bloqueado(user_id) > 0
+
+
+# ============================================================================
+# ESTADO DEL WORKER
+# ============================================================================
+
+def test_estado_no_se_fia_de_loopback(securelink, monkeypatch):
+    monkeypatch.setattr(securelink, 'ESTADO_TOKEN', 's3creto')
+    monkeypatch.setattr(securelink, 'ESTADO_IPS', {'10.0.0.9'})
+    cliente = securelink.app.test_client()
+
+    assert cliente.get('/estado', environ_base={'REMOTE_ADDR': '127.0.0.1'}).status_code == 403
+    assert cliente.get('/estado', headers={'X-Estado-Token': 'otro'}).status_code == 403
+    assert cliente.get('/estado', headers={'X-Estado-Token': 's3creto'}).status_code == 200
+    assert cliente.get('/estado', environ_base={'REMOTE_ADDR': '10.0.0.9'}).status_code == 200
+
+    admin = iniciar_sesion(securelink, 'admin', 'Admin123!')
+    assert admin.get('/estado', environ_base={'REMOTE_ADDR': '10.0.0.1'}).status_code == 200
+
+
+# ============================================================================
+# ACCIONES DE ADMINISTRACIÓN
+# ============================================================================
+
+def test_accion_masiva_queda_en_auditoria(securelink):
+    user_id = crear(securelink.storage, 'auditado')
+    admin = iniciar_sesion(securelink, 'admin', 'Admin123!')
+    respuesta = admin.post('/admin/usuarios/accion', json={
+        'ids': [user_id], 'accion': 'cambiar_rol', 'rol': 'invitado'
+    })
+    assert respuesta.get_json()['afectados'] == 1
+
+    eventos = securelink.audit_log.consultar(tipo=audit.CUENTA_ADMIN, username='auditado')
+    assert len(eventos) == 1
+    assert eventos[0]['detalle'] == 'cambiar_rol usuario -> invitado por admin'
+
+def test_formulario_masivo_exige_token_csrf(securelink):
+    user_id = crear(securelink.storage, 'protegido')
+    admin = securelink.app.test_client()
+    respuesta = admin.post('/login', data={'username': 'admin', 'password': 'Admin123!'})
+    assert 'SameSite=Lax' in respuesta.headers['Set-Cookie']
+
+    datos = {'ids': [user_id], 'accion': 'desactivar'}
+    assert admin.post('/admin/usuarios/accion', data=datos).status_code == 302
+    assert securelink.storage.obtener_usuario(user_id)['activo'] == 1
+
+    with admin.session_transaction() as sesion:
+        datos['csrf_token'] = sesion['csrf_token']
+    assert admin.post('/admin/usuarios/accion', data=datos).status_code == 302
+    assert securelink.storage.obtener_usuario(user_id)['activo'] == 0
+
+
+# ============================================================================
+# VERIFICACIÓN PREVIA AL DESPLIEGUE
+# ============================================================================
+
+VERIFICAR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'verificar.py')
+
+
+def verificar(tmp_path, version, *opciones):
+    """Ejecuta verificar.py como en un despliegue contra una base de datos nueva"""
+    storage = SQLiteStorage(str(tmp_path / 'securelink.db'))
+    storage.init_schema()
+    storage.marcar_version(version)
+    return subprocess.run(
+        [sys.executable, VERIFICAR, '--db', storage.database, *opciones],
+        capture_output=True, encoding='utf-8', timeout=60,
+        env={**os.environ, 'PYTHONIOENCODING': 'utf-8'}
+    )
+
+
+def test_verificar_json_sin_errores_sale_con_cero(tmp_path):
+    proceso = verificar(tmp_path, SCHEMA_VERSION, '--json')
+    assert proceso.returncode == 0, proceso.stdout
+
+    salida = json.loads(proceso.stdout)
+    assert salida['ok'] is True
+    assert salida['errores'] == 0
+    assert salida['avisos'] == sum(1 for r in salida['resultados'] if r['estado'] == 'aviso')
+    grupos = {r['grupo'] for r in salida['resultados']}
+    assert grupos == {'estructura', 'dependencias', 'rutas', 'plantillas', 'assets', 'base_datos'}
+    esquema = [r for r in salida['resultados'] if r['nombre'] == 'securelink.db: esquema']
+    assert esquema[0]['estado'] == 'ok'
+
+def test_verificar_con_errores_sale_con_uno(tmp_path):
+    # Una base de datos más nueva que el código es un error, no un aviso
+    proceso = verificar(tmp_path, SCHEMA_VERSION + 1, '--json')
+    assert proceso.returncode == 1
+
+    salida = json.loads(proceso.stdout)
+    assert salida['ok'] is False
+    assert salida['errores'] == 1
+    esquema = [r for r in salida['resultados'] if r['nombre'] == 'securelink.db: esquema']
+    assert esquema[0]['estado'] == 'error'
+
+    proceso = verificar(tmp_path, SCHEMA_VERSION + 1)
+    assert proceso.returncode == 1
+    assert 'HAY PROBLEMAS' in proceso.stdout
@@ -0,0 +1,115 @@
+"""
+Tokens de un solo uso de SECURELINK
+
+Se usan para restablecer contraseñas y verificar emails. En la base de
+datos solo se guarda el SHA-256 del token: quien lea la tabla no puede
+usarlos. consumir() los invalida de forma atómica, así un mismo enlace
+no sirve dos veces aunque lleguen dos peticiones a la vez.
+
+Los tokens usados o caducados se purgan desde emitir(), como mucho una
+vez cada `intervalo_purga` segundos.
+"""
+
+import hashlib
+import secrets
+import sqlite3
+import time
+
+RESET_PASSWORD = 'reset_password'
+VERIFICAR_EMAIL = 'verificar_email'
+
+SCHEMA_TOKENS = [
+    '''
+    CREATE TABLE IF NOT EXISTS tokens_cuenta (
+        token_hash TEXT PRIMARY KEY,
+        user_id INTEGER NOT NULL,
+        proposito TEXT NOT NULL,
+        expira REAL NOT NULL,
+        usado INTEGER NOT NULL DEFAULT 0
+    )
+    ''',
+    'CREATE INDEX IF NOT EXISTS idx_tokens_user ON tokens_cuenta (user_id, proposito)',
+]
+
+
+def _hash(token):
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+
+class TokenStore:
+    """Emisión y consumo de tokens guardados en tokens_cuenta"""
+
+    def __init__(self, database, intervalo_purga=3600):
+        self.database = database
+        self.intervalo_purga = intervalo_purga
+        self._ultima_purga = None
+        self._esquema_listo = False
+
+    def connect(self):
+        conn = sqlite3.connect(self.database)
+        if not self._esquema_listo:
+            for sentencia in SCHEMA_TOKENS:
+                conn.execute(sentencia)
+            conn.commit()
+            self._esquema_listo = True
+        return conn
+
+    def emitir(self, user_id, proposito, ttl):
+        """
+        Crea un token nuevo y devuelve su valor en claro
+
+        Los tokens anteriores del mismo usuario y propósito que no se
+        usaron quedan invalidados.
+        """
+        token = secrets.token_urlsafe(32)
+        conn = self.connect()
+        with conn:
+            conn.execute(
+                'UPDATE tokens_cuenta SET usado = 1 '
+                'WHERE user_id = ? AND proposito = ? AND usado = 0',
+                (user_id, proposito)
+            )
+            conn.execute(
+                'INSERT INTO tokens_cuenta (token_hash, user_id, proposito, expira) '
+                'VALUES (?, ?, ?, ?)',
+                (_hash(token), user_id, proposito, time.time() + ttl)
+            )
+        conn.close()
+
+        if self._ultima_purga is None or time.monotonic() - self._ultima_purga >= self.intervalo_purga:
+            self.purgar()
+        return token
+
+    def validar(self, token, proposito):
+        """user_id del token si es válido, sin consumirlo; None si no"""
+        conn = self.connect()
+        row = conn.execute(
+            'SELECT user_id FROM tokens_cuenta '
+            'WHERE token_hash = ? AND proposito = ? AND usado = 0 AND expira > ?',
+            (_hash(token), proposito, time.time())
+        ).fetchone()
+        conn.close()
+        return row[0] if row else None
+
+    def consumir(self, token, proposito):
+        """Marca el token como usado y devuelve su user_id; None si no es válido"""
+        conn = self.connect()
+        with conn:
+            row = conn.execute(
+                'UPDATE tokens_cuenta SET usado = 1 '
+                'WHERE token_hash = ? AND proposito = ? AND usado = 0 AND expira > ? '
+                'RETURNING user_id',
+                (_hash(token), proposito, time.time())
+            ).fetchone()
+        conn.close()
+        return row[0] if row else None
+
+    def purgar(self):
+        """Borra tokens usados o caducados"""
+        self._ultima_purga = time.monotonic()
+        conn = self.connect()
+        with conn:
+            conn.execute(
+                'DELETE FROM tokens_cuenta WHERE usado = 1 OR expira <= ?', (time.time(),)
+            )
+        conn.close()
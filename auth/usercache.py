@@ -0,0 +1,100 @@
+"""
+Caché de registros de usuario de SECURELINK
+
+Las sesiones de Flask viven en la cookie, así que para poder revocarlas
+cada petición protegida comprueba que el usuario sigue existiendo, activo
+y con el mismo rol. Esta caché evita leer el usuario en cada petición:
+
+- Sin cambios, un registro se reutiliza durante `ttl` segundos.
+- invalidar() incrementa un contador compartido en la base de datos
+  (tabla generacion_revocacion). Cada entrada guarda la generación leída
+  antes de cargar el usuario y solo vale mientras el contador no cambie,
+  así la revocación es inmediata en todos los workers.
+- Comprobar el contador es barato: PRAGMA data_version en una conexión
+  que se mantiene abierta solo cambia si otra conexión escribió en el
+  archivo, y únicamente entonces se vuelve a leer la generación.
+"""
+
+import sqlite3
+import threading
+import time
+
+SCHEMA_GENERACION = [
+    '''
+    CREATE TABLE IF NOT EXISTS generacion_revocacion (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        generacion INTEGER NOT NULL
+    )
+    ''',
+    'INSERT OR IGNORE INTO generacion_revocacion (id, generacion) VALUES (1, 0)',
+]
+
+
+class UserCache:
+    """user_id -> registro de usuario (o None si no existe), con caducidad"""
+
+    def __init__(self, storage, ttl=5.0, database=None):
+        self.storage = storage
+        self.ttl = ttl
+        # Archivo con el contador compartido (el primario si no se indica)
+        self.database = database or storage.database
+        self._datos = {}    # user_id -> (expira, registro, generación)
+        self._conn = None
+        self._data_version = None
+        self._generacion = None
+        self._esquema_listo = False
+        self._lock = threading.Lock()
+
+    def connect(self, **kwargs):
+        conn = sqlite3.connect(self.database, **kwargs)
+        if not self._esquema_listo:
+            with conn:
+                for sentencia in SCHEMA_GENERACION:
+                    conn.execute(sentencia)
+            self._esquema_listo = True
+        return conn
+
+    def generacion(self):
+        """Valor actual del contador compartido de revocaciones"""
+        with self._lock:
+            if self._conn is None:
+                self._conn = self.connect(check_same_thread=False)
+            version = self._conn.execute('PRAGMA data_version').fetchone()[0]
+            if version != self._data_version:
+                generacion = self._conn.execute(
+                    'SELECT generacion FROM generacion_revocacion WHERE id = 1'
+                ).fetchone()[0]
+                if generacion != self._generacion:
+                    self._datos.clear()
+                    self._generacion = generacion
+                self._data_version = version
+            return self._generacion
+
+    def obtener(self, user_id):
+        # Se lee antes de cargar: un registro cargado durante una revocación
+        # queda guardado con la generación anterior y no se reutiliza
+        generacion = self.generacion()
+        ahora = time.monotonic()
+        entrada = self._datos.get(user_id)
+        if entrada is not None and entrada[0] > ahora and entrada[2] == generacion:
+            return entrada[1]
+
+        # Siempre del primario: una réplica podría tener aún al usuario activo
+        user = self.storage.obtener_usuario(user_id)
+        with self._lock:
+            self._datos[user_id] = (ahora + self.ttl, user, generacion)
+        return user
+
+    def invalidar(self, ids):
+        """Descarta los usuarios aquí y avisa al resto de workers"""
+        # Conexión aparte: así la de generacion() ve el cambio en data_version
+        conn = self.connect()
+        with conn:
+            conn.execute('UPDATE generacion_revocacion SET generacion = generacion + 1 WHERE id = 1')
+        conn.close()
+        with self._lock:
+            for user_id in ids:
+                self._datos.pop(user_id, None)
+
+    def __len__(self):
+        return len(self._datos)
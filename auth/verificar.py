@@ -1,5 +1,91 @@
+"""
+================================================================================
+SECURELINK - Verificación previa al despliegue
+================================================================================
+Comprueba en paralelo que el proyecto está listo para arrancar:
+
+- Estructura: archivos y carpetas imprescindibles.
+- Dependencias: módulos instalados (sin importarlos).
+- Rutas: app.py se analiza con ast (sin ejecutarlo); rutas obligatorias y
+  plantillas usadas por render_template.
+- Plantillas: todas se compilan con Jinja (incluida la etiqueta cache) y
+  cada asset_url('...') debe apuntar a un archivo de static/.
+- Assets: huellas de static/ sin colisiones y variantes .gz/.br de la
+  caché que corresponden a su hash.
+- Base de datos: versión de esquema (SCHEMA_VERSION), columnas, índices y
+  PRAGMAs de cada archivo (DATABASE o sus shards). --completo añade
+  PRAGMA quick_check, que recorre toda la base de datos.
+
+Sale con código 1 si hay algún error (los avisos no cuentan), así puede
+usarse como puerta de despliegue.
+
+Ejemplos:
+    python verificar.py
+    python verificar.py --json
+    python verificar.py --db /srv/securelink.db --shards 4 --completo
+================================================================================
+"""
+
+import argparse
+import ast
+import gzip
+import hashlib
+import importlib.util
+import json
 import os
+import sqlite3
 import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+OK = 'ok'
+AVISO = 'aviso'
+ERROR = 'error'
+
+ICONOS = {OK: '✅', AVISO: '⚠️ ', ERROR: '❌'}
+
+GRUPOS = [
+    ('estructura', '📁 ESTRUCTURA DEL PROYECTO'),
+    ('dependencias', '📦 DEPENDENCIAS'),
+    ('rutas', '🧭 RUTAS DE app.py'),
+    ('plantillas', '🌐 PLANTILLAS'),
+    ('assets', '🎨 ARCHIVOS ESTÁTICOS'),
+    ('base_datos', '🗄️ BASE DE DATOS'),
+]
+
+ARCHIVOS = [
+    ('app.py', 'Código principal de Flask'),
+    ('storage.py', 'Backends de almacenamiento'),
+    ('requirements.txt', 'Dependencias de Python'),
+    ('templates/base.html', 'Plantilla base'),
+    ('templates/login.html', 'Página de login'),
+    ('templates/registro.html', 'Página de registro'),
+    ('templates/404.html', 'Página de error 404'),
+    ('templates/500.html', 'Página de error 500'),
+    ('static/css/custom.css', 'Estilos personalizados'),
+]
+
+CARPETAS = [
+    ('templates', 'Plantillas HTML'),
+    ('static', 'Archivos estáticos'),
+    ('static/css', 'Hojas de estilo'),
+    ('static/js', 'Scripts JavaScript'),
+]
+
+DEPENDENCIAS = [
+    ('flask', True),
+    ('bcrypt', True),
+    ('jinja2', True),
+    ('brotli', False),  # opcional: variantes .br de los assets
+]
+
+RUTAS_OBLIGATORIAS = ['/login', '/registro', '/logout', '/healthz', '/readyz']
+
+INDICES_USUARIOS = ['idx_usuarios_email']
+
+# Con más de esta fracción de páginas libres conviene un VACUUM
+MAX_PAGINAS_LIBRES = 0.25
+
 
 def print_header(text):
     """Imprime un encabezado decorado"""
@@ -7,251 +93,374 @@ def print_header(text):
     print(text.center(70))
     print("="*70)
 
-def check_file(filepath, description):
-    """Verifica si un archivo existe"""
-    exists = os.path.exists(filepath)
-    status = "✅" if exists else "❌"
-    print(f"{status} {description:40} {filepath}")
-    return exists
-
-def check_directory(dirpath, description):
-    """Verifica si un directorio existe"""
-    exists = os.path.isdir(dirpath)
-    status = "✅" if exists else "❌"
-    print(f"{status} {description:40} {dirpath}")
-    return exists
-
-def check_file_content(filepath, search_text):
-    """Verifica si un archivo contiene cierto texto"""
-    try:
-        with open(filepath, 'r', encoding='utf-8') as f:
-            content = f.read()
-            return search_text in content
-    except:
-        return False
 
-def main():
-    """Función principal de verificación"""
-    
-    print_header("🔍 VERIFICACIÓN DE ESTRUCTURA DEL PROYECTO SECURELINK")
-    
-    all_ok = True
-    
-    # ========================================================================
-    # VERIFICAR ARCHIVOS PRINCIPALES
-    # ========================================================================
-    print_header("📄 ARCHIVOS PRINCIPALES")
-    
-    files_main = [
-        ("app.py", "Código principal de Flask"),
-        ("requirements.txt", "Dependencias de Python"),
-        ("README.md", "Documentación del proyecto"),
-    ]
-    
-    for filename, description in files_main:
-        if not check_file(filename, description):
-            all_ok = False
-    
-    # ========================================================================
-    # VERIFICAR CARPETAS
-    # ========================================================================
-    print_header("📁 ESTRUCTURA DE CARPETAS")
-    
-    directories = [
-        ("templates", "Plantillas HTML"),
-        ("static", "Archivos estáticos"),
-        ("static/css", "Hojas de estilo"),
-        ("static/js", "Scripts JavaScript"),
-    ]
-    
-    for dirpath, description in directories:
-        if not check_directory(dirpath, description):
-            all_ok = False
-    
-    # ========================================================================
-    # VERIFICAR TEMPLATES HTML
-    # ========================================================================
-    print_header("🌐 TEMPLATES HTML")
-    
-    templates = [
-        ("templates/base.html", "Plantilla base"),
-        ("templates/login.html", "Página de login"),
-        ("templates/registro.html", "Página de registro"),
-        ("templates/admin.html", "Panel de administración"),
-        ("templates/user.html", "Panel de usuario"),
-        ("templates/guest.html", "Panel de invitado"),
-        ("templates/perfil.html", "Perfil de usuario"),
-    ]
-    
-    for filepath, description in templates:
-        if not check_file(filepath, description):
-            all_ok = False
-    
-    # ========================================================================
-    # VERIFICAR CSS
-    # ========================================================================
-    print_header("🎨 ARCHIVOS CSS")
-    
-    css_files = [
-        ("static/css/custom.css", "Estilos personalizados"),
-    ]
-    
-    for filepath, description in css_files:
-        if not check_file(filepath, description):
-            all_ok = False
-    
-    # ========================================================================
-    # VERIFICAR CONTENIDO CRÍTICO
-    # ========================================================================
-    print_header("🔍 VERIFICACIÓN DE CONTENIDO")
-    
-    checks = []
-    
-    # Verificar app.py
-    if os.path.exists("app.py"):
-        has_bcrypt = check_file_content("app.py", "bcrypt")
-        has_flask = check_file_content("app.py", "Flask")
-        has_login = check_file_content("app.py", "@app.route('/login'")
-        has_registro = check_file_content("app.py", "@app.route('/registro'")
-        
-        checks.append(("app.py usa bcrypt", has_bcrypt))
-        checks.append(("app.py usa Flask", has_flask))
-        checks.append(("app.py tiene ruta /login", has_login))
-        checks.append(("app.py tiene ruta /registro", has_registro))
-    
-    # Verificar base.html
-    if os.path.exists("templates/base.html"):
-        has_css_link = check_file_content("templates/base.html", "custom.css")
-        has_bootstrap = check_file_content("templates/base.html", "bootstrap")
-        
-        checks.append(("base.html carga custom.css", has_css_link))
-        checks.append(("base.html carga Bootstrap", has_bootstrap))
-    
-    # Verificar registro.html
-    if os.path.exists("templates/registro.html"):
-        has_rol_selection = check_file_content("templates/registro.html", 'name="rol"')
-        
-        checks.append(("registro.html tiene selección de rol", has_rol_selection))
-    
-    # Verificar custom.css
-    if os.path.exists("static/css/custom.css"):
-        has_variables = check_file_content("static/css/custom.css", ":root")
-        has_gradient = check_file_content("static/css/custom.css", "gradient")
-        
-        checks.append(("custom.css tiene variables CSS", has_variables))
-        checks.append(("custom.css tiene gradientes", has_gradient))
-    
-    for description, passed in checks:
-        status = "✅" if passed else "❌"
-        print(f"{status} {description}")
-        if not passed:
-            all_ok = False
-    
-    # ========================================================================
-    # VERIFICAR DEPENDENCIAS
-    # ========================================================================
-    print_header("📦 VERIFICACIÓN DE DEPENDENCIAS")
-    
-    try:
-        import flask
-        print(f"✅ Flask instalado (versión {flask.__version__})")
-    except ImportError:
-        print("❌ Flask NO está instalado")
-        all_ok = False
-    
+def resultado(grupo, nombre, estado, detalle=None):
+    return {'grupo': grupo, 'nombre': nombre, 'estado': estado, 'detalle': detalle}
+
+
+def sha256_archivo(path):
+    """Hash del archivo leyendo por bloques (no lo carga entero en memoria)"""
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for bloque in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(bloque)
+    return h.hexdigest()
+
+
+# ============================================================================
+# COMPROBACIONES
+# ============================================================================
+
+def verificar_estructura(args):
+    resultados = []
+    for ruta, descripcion in CARPETAS:
+        existe = os.path.isdir(os.path.join(args.raiz, ruta))
+        resultados.append(resultado('estructura', descripcion, OK if existe else ERROR, ruta))
+    for ruta, descripcion in ARCHIVOS:
+        existe = os.path.isfile(os.path.join(args.raiz, ruta))
+        resultados.append(resultado('estructura', descripcion, OK if existe else ERROR, ruta))
+    return resultados
+
+
+def verificar_dependencias(args):
+    resultados = []
+    for modulo, obligatorio in DEPENDENCIAS:
+        instalado = importlib.util.find_spec(modulo) is not None
+        if instalado:
+            estado, detalle = OK, 'instalado'
+        elif obligatorio:
+            estado, detalle = ERROR, 'NO instalado (pip install -r requirements.txt)'
+        else:
+            estado, detalle = AVISO, 'no instalado (opcional)'
+        resultados.append(resultado('dependencias', modulo, estado, detalle))
+    return resultados
+
+
+def _constante(nodo):
+    return nodo.value if isinstance(nodo, ast.Constant) and isinstance(nodo.value, str) else None
+
+
+def _arbol_app(args):
+    """AST de app.py (se analiza una sola vez aunque lo pidan varios grupos)"""
+    if args.arbol_app is None:
+        path = os.path.join(args.raiz, 'app.py')
+        with open(path, encoding='utf-8') as f:
+            args.arbol_app = ast.parse(f.read(), path)
+    return args.arbol_app
+
+
+def verificar_rutas(args):
     try:
-        import bcrypt
-        print(f"✅ bcrypt instalado")
-    except ImportError:
-        print("❌ bcrypt NO está instalado")
-        all_ok = False
-    
-    # ========================================================================
-    # VERIFICAR BASE DE DATOS
-    # ========================================================================
-    print_header("🗄️ BASE DE DATOS")
-    
-    if os.path.exists("securelink.db"):
-        print("✅ Base de datos existe: securelink.db")
-        
-        # Intentar verificar la estructura
+        _arbol_app(args)
+    except (OSError, SyntaxError) as e:
+        return [resultado('rutas', 'app.py', ERROR, str(e))]
+
+    rutas = set()
+    plantillas = set()
+    for nodo in ast.walk(_arbol_app(args)):
+        if not isinstance(nodo, ast.Call) or not nodo.args:
+            continue
+        funcion = nodo.func
+        if isinstance(funcion, ast.Attribute) and funcion.attr == 'route':
+            rutas.add(_constante(nodo.args[0]))
+        elif isinstance(funcion, ast.Name) and funcion.id == 'render_template':
+            plantillas.add(_constante(nodo.args[0]))
+    rutas.discard(None)
+    plantillas.discard(None)
+
+    resultados = [resultado('rutas', 'app.py', OK, f'{len(rutas)} rutas')]
+    for ruta in RUTAS_OBLIGATORIAS:
+        resultados.append(resultado(
+            'rutas', f'ruta {ruta}', OK if ruta in rutas else ERROR,
+            None if ruta in rutas else 'no definida'
+        ))
+    faltan = sorted(
+        p for p in plantillas
+        if not os.path.isfile(os.path.join(args.raiz, 'templates', p))
+    )
+    resultados.append(resultado(
+        'rutas', 'plantillas de render_template', ERROR if faltan else OK,
+        f'no existen: {", ".join(faltan)}' if faltan else f'{len(plantillas)} plantillas'
+    ))
+    return resultados
+
+
+def verificar_plantillas(args):
+    from jinja2 import Environment, FileSystemLoader, TemplateSyntaxError, nodes
+    from templating import FragmentCacheExtension
+
+    carpeta = os.path.join(args.raiz, 'templates')
+    static = os.path.join(args.raiz, 'static')
+    env = Environment(loader=FileSystemLoader(carpeta), extensions=[FragmentCacheExtension])
+    # Los filtros de @app.template_filter solo existen con la app cargada;
+    # para compilar basta con que el nombre esté registrado
+    for nodo in ast.walk(_arbol_app(args)):
+        if isinstance(nodo, ast.Call) and isinstance(nodo.func, ast.Attribute) \
+                and nodo.func.attr == 'template_filter' and nodo.args:
+            env.filters[_constante(nodo.args[0])] = lambda valor, *a, **k: valor
+
+    def compilar(nombre):
         try:
-            import sqlite3
-            conn = sqlite3.connect("securelink.db")
-            cursor = conn.cursor()
-            
-            # Verificar tabla usuarios
-            cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='usuarios'")
-            if cursor.fetchone():
-                print("✅ Tabla 'usuarios' existe")
-                
-                # Contar usuarios
-                cursor.execute("SELECT COUNT(*) FROM usuarios")
-                count = cursor.fetchone()[0]
-                print(f"✅ Usuarios registrados: {count}")
+            fuente, filename, _ = env.loader.get_source(env, nombre)
+            arbol = env.parse(fuente, nombre, filename)
+            env.compile(arbol, nombre, filename)
+        except TemplateSyntaxError as e:
+            return resultado('plantillas', nombre, ERROR, f'línea {e.lineno}: {e.message}')
+
+        faltan = []
+        for llamada in arbol.find_all(nodes.Call):
+            if isinstance(llamada.node, nodes.Name) and llamada.node.name == 'asset_url' \
+                    and llamada.args and isinstance(llamada.args[0], nodes.Const):
+                if not os.path.isfile(os.path.join(static, llamada.args[0].value)):
+                    faltan.append(llamada.args[0].value)
+        if faltan:
+            return resultado('plantillas', nombre, ERROR, f'asset_url sin archivo: {", ".join(faltan)}')
+        return resultado('plantillas', nombre, OK, 'compila')
+
+    nombres = env.list_templates(extensions=['html'])
+    with ThreadPoolExecutor() as pool:
+        return list(pool.map(compilar, nombres))
+
+
+def verificar_assets(args):
+    from assets import CDN_ASSETS, EXTENSIONES_COMPRIMIBLES
+
+    static = os.path.join(args.raiz, 'static')
+    cache_dir = args.asset_cache or os.path.join(args.raiz, '.asset_cache')
+
+    logicas = []
+    for raiz, _, nombres in os.walk(static):
+        for nombre in nombres:
+            path = os.path.join(raiz, nombre)
+            logicas.append((os.path.relpath(path, static).replace(os.sep, '/'), path))
+
+    with ThreadPoolExecutor() as pool:
+        digests = list(pool.map(lambda item: sha256_archivo(item[1])[:16], logicas))
+
+    resultados = []
+
+    # Misma regla que AssetPipeline.construir(): ruta con los 8 primeros caracteres
+    con_huella = {}
+    for (logica, _), digest in zip(logicas, digests):
+        base, ext = os.path.splitext(logica)
+        con_huella.setdefault(f'{base}.{digest[:8]}{ext}', []).append(logica)
+    colisiones = [rutas for rutas in con_huella.values() if len(rutas) > 1]
+    resultados.append(resultado(
+        'assets', 'huellas', ERROR if colisiones else OK,
+        f'colisión: {colisiones}' if colisiones else f'{len(logicas)} archivos'
+    ))
+
+    # Variantes precomprimidas: deben descomprimir al contenido de su hash
+    if os.path.isdir(cache_dir):
+        vigentes = {
+            digest for (logica, _), digest in zip(logicas, digests)
+            if os.path.splitext(logica)[1].lower() in EXTENSIONES_COMPRIMIBLES
+        }
+
+        def comprobar_variante(nombre):
+            digest, _, sufijo = nombre.partition('.')
+            if digest not in vigentes:
+                return None
+            with open(os.path.join(cache_dir, nombre), 'rb') as f:
+                comprimido = f.read()
+            try:
+                if sufijo == 'gz':
+                    datos = gzip.decompress(comprimido)
+                elif sufijo == 'br':
+                    import brotli
+                    datos = brotli.decompress(comprimido)
+                else:
+                    return None
+            except Exception as e:
+                return nombre, str(e)
+            if hashlib.sha256(datos).hexdigest()[:16] != digest:
+                return nombre, 'el contenido no coincide con su hash'
+            return nombre, None
+
+        variantes = [n for n in os.listdir(cache_dir) if not n.endswith('.tmp')]
+        with ThreadPoolExecutor() as pool:
+            comprobadas = [r for r in pool.map(comprobar_variante, variantes) if r is not None]
+        malas = [f'{nombre} ({error})' for nombre, error in comprobadas if error]
+        resultados.append(resultado(
+            'assets', 'variantes comprimidas', ERROR if malas else OK,
+            ', '.join(malas) if malas else f'{len(comprobadas)} verificadas'
+        ))
+        obsoletas = len(variantes) - len(comprobadas)
+        if obsoletas:
+            resultados.append(resultado(
+                'assets', 'caché de assets', AVISO,
+                f'{obsoletas} variantes de versiones anteriores en {cache_dir}'
+            ))
+    else:
+        resultados.append(resultado(
+            'assets', 'variantes comprimidas', AVISO, 'sin caché (se generará al arrancar)'
+        ))
+
+    faltan = sorted({
+        destino.split('/')[1] for destino in (d for _, d in CDN_ASSETS.values())
+        if not os.path.isfile(os.path.join(static, destino))
+    })
+    resultados.append(resultado(
+        'assets', 'CDN local', AVISO if faltan else OK,
+        f'sin copia local de {", ".join(faltan)} (python assets.py vendor)' if faltan else 'completo'
+    ))
+    return resultados
+
+
+def _verificar_archivo_db(path, args, con_usuarios):
+    from storage import MIGRACIONES_USUARIOS, SCHEMA_VERSION
+
+    nombre = os.path.basename(path)
+    if not os.path.exists(path):
+        return [resultado('base_datos', nombre, AVISO, 'no existe (se creará al ejecutar app.py)')]
+
+    resultados = []
+    conn = sqlite3.connect(f'file:{path}?mode=ro', uri=True, timeout=1.0)
+    try:
+        version = conn.execute('PRAGMA user_version').fetchone()[0]
+        if con_usuarios:
+            if version == SCHEMA_VERSION:
+                estado, detalle = OK, f'v{version}'
+            elif version < SCHEMA_VERSION:
+                estado, detalle = AVISO, f'v{version} < v{SCHEMA_VERSION} (se migrará al arrancar)'
+            else:
+                estado, detalle = ERROR, f'v{version} es más nueva que el código (v{SCHEMA_VERSION})'
+            resultados.append(resultado('base_datos', f'{nombre}: esquema', estado, detalle))
+
+            columnas = {row[1] for row in conn.execute('PRAGMA table_info(usuarios)')}
+            if not columnas:
+                resultados.append(resultado('base_datos', f'{nombre}: tabla usuarios', ERROR, 'no existe'))
             else:
-                print("❌ Tabla 'usuarios' NO existe")
-                all_ok = False
-            
-            conn.close()
+                faltan = [c for c, _ in MIGRACIONES_USUARIOS if c not in columnas]
+                resultados.append(resultado(
+                    'base_datos', f'{nombre}: tabla usuarios',
+                    (AVISO if version < SCHEMA_VERSION else ERROR) if faltan else OK,
+                    f'faltan columnas: {", ".join(faltan)}' if faltan else f'{len(columnas)} columnas'
+                ))
+
+            indices = {row[1] for row in conn.execute('PRAGMA index_list(usuarios)')}
+            faltan = [i for i in INDICES_USUARIOS if i not in indices]
+            resultados.append(resultado(
+                'base_datos', f'{nombre}: índices',
+                (AVISO if version < SCHEMA_VERSION else ERROR) if faltan else OK,
+                f'faltan: {", ".join(faltan)}' if faltan else ', '.join(INDICES_USUARIOS)
+            ))
+
+        journal = conn.execute('PRAGMA journal_mode').fetchone()[0]
+        page_size = conn.execute('PRAGMA page_size').fetchone()[0]
+        paginas = conn.execute('PRAGMA page_count').fetchone()[0]
+        libres = conn.execute('PRAGMA freelist_count').fetchone()[0]
+        fraccion = libres / paginas if paginas else 0.0
+        resultados.append(resultado(
+            'base_datos', f'{nombre}: pragmas', AVISO if fraccion > MAX_PAGINAS_LIBRES else OK,
+            f'journal_mode={journal} page_size={page_size} páginas={paginas} '
+            f'libres={fraccion:.0%}' + (' (conviene VACUUM)' if fraccion > MAX_PAGINAS_LIBRES else '')
+        ))
+
+        if args.completo:
+            check = conn.execute('PRAGMA quick_check').fetchone()[0]
+            resultados.append(resultado(
+                'base_datos', f'{nombre}: quick_check', OK if check == 'ok' else ERROR, check
+            ))
+    except sqlite3.Error as e:
+        resultados.append(resultado('base_datos', nombre, ERROR, str(e)))
+    finally:
+        conn.close()
+    return resultados
+
+
+def verificar_base_datos(args):
+    """DATABASE y, con --shards, cada shard (que es donde está la tabla usuarios)"""
+    archivos = [(args.db, args.shards <= 1)]
+    if args.shards > 1:
+        base, ext = os.path.splitext(args.db)
+        archivos += [(f'{base}.shard{i}{ext or ".db"}', True) for i in range(args.shards)]
+
+    with ThreadPoolExecutor() as pool:
+        partes = pool.map(lambda a: _verificar_archivo_db(a[0], args, a[1]), archivos)
+    return [r for parte in partes for r in parte]
+
+
+COMPROBACIONES = {
+    'estructura': verificar_estructura,
+    'dependencias': verificar_dependencias,
+    'rutas': verificar_rutas,
+    'plantillas': verificar_plantillas,
+    'assets': verificar_assets,
+    'base_datos': verificar_base_datos,
+}
+
+
+def ejecutar(args):
+    """Lanza todos los grupos a la vez; un grupo que falla entero cuenta como error"""
+    def lanzar(grupo):
+        try:
+            return COMPROBACIONES[grupo](args)
         except Exception as e:
-            print(f"⚠️  Error al verificar base de datos: {e}")
-    else:
-        print("⚠️  Base de datos NO existe (se creará al ejecutar app.py)")
-    
-    # ========================================================================
-    # RESUMEN FINAL
-    # ========================================================================
-    print_header("📊 RESUMEN FINAL")
-    
-    if all_ok:
-        print("""
-✅ ¡TODO ESTÁ CORRECTO!
+            return [resultado(grupo, grupo, ERROR, f'{type(e).__name__}: {e}')]
 
-Tu proyecto está correctamente estructurado y listo para ejecutar.
+    with ThreadPoolExecutor(max_workers=len(COMPROBACIONES)) as pool:
+        futuros = {grupo: pool.submit(lanzar, grupo) for grupo, _ in GRUPOS}
+        return {grupo: futuro.result() for grupo, futuro in futuros.items()}
 
-🚀 PRÓXIMOS PASOS:
 
-1. Instalar dependencias (si no lo has hecho):
-   pip install -r requirements.txt
+# ============================================================================
+# SALIDA
+# ============================================================================
 
-2. Ejecutar la aplicación:
-   python app.py
+def imprimir(por_grupo, errores, avisos, duracion):
+    print_header("🔍 VERIFICACIÓN DEL PROYECTO SECURELINK")
 
-3. Abrir el navegador en:
-   http://127.0.0.1:5000
+    for grupo, titulo in GRUPOS:
+        print_header(titulo)
+        for r in por_grupo[grupo]:
+            detalle = f" {r['detalle']}" if r['detalle'] else ''
+            print(f"{ICONOS[r['estado']]} {r['nombre']:40}{detalle}")
 
-4. Iniciar sesión con:
-   Usuario: admin
-   Contraseña: Admin123!
-        """)
+    print_header("📊 RESUMEN FINAL")
+    print(f"\n⏱️  {duracion * 1000:.0f} ms | {errores} errores | {avisos} avisos\n")
+    if errores:
+        print("❌ HAY PROBLEMAS: revisa los elementos marcados con ❌ arriba.")
     else:
-        print("""
-❌ HAY PROBLEMAS EN LA ESTRUCTURA
+        print("✅ ¡TODO ESTÁ CORRECTO! Ejecuta la aplicación con: python app.py")
+    print("="*70)
 
-Revisa los elementos marcados con ❌ arriba.
 
-💡 SOLUCIONES COMUNES:
+def main():
+    parser = argparse.ArgumentParser(description='Verificación previa al despliegue de SECURELINK')
+    parser.add_argument('--raiz', default=os.path.dirname(os.path.abspath(__file__)),
+                        help='Carpeta del proyecto (donde está app.py)')
+    parser.add_argument('--db', default='securelink.db', help='Base de datos principal')
+    parser.add_argument('--shards', type=int, default=1, help='Número de shards (backend sharded)')
+    parser.add_argument('--asset-cache', help='Caché de assets (por defecto <raiz>/.asset_cache)')
+    parser.add_argument('--completo', action='store_true',
+                        help='Incluir PRAGMA quick_check (recorre toda la base de datos)')
+    parser.add_argument('--json', action='store_true', help='Salida en JSON')
+    args = parser.parse_args()
 
-1. Archivos faltantes:
-   - Asegúrate de copiar todos los códigos
-   - Verifica los nombres de archivos (case sensitive)
+    sys.path.insert(0, args.raiz)
+    args.arbol_app = None
 
-2. Carpetas faltantes:
-   mkdir templates static static/css static/js
+    inicio = time.perf_counter()
+    por_grupo = ejecutar(args)
+    duracion = time.perf_counter() - inicio
 
-3. Dependencias faltantes:
-   pip install -r requirements.txt
+    todos = [r for grupo, _ in GRUPOS for r in por_grupo[grupo]]
+    errores = sum(1 for r in todos if r['estado'] == ERROR)
+    avisos = sum(1 for r in todos if r['estado'] == AVISO)
 
-4. CSS no carga:
-   - Verifica que custom.css esté en static/css/
-   - Verifica que base.html tenga la línea:
-     <link rel="stylesheet" href="{{ url_for('static', filename='css/custom.css') }}">
-        """)
-    
-    print("="*70)
-    
-    return 0 if all_ok else 1
+    if args.json:
+        print(json.dumps({
+            'ok': errores == 0,
+            'duracion_ms': round(duracion * 1000, 1),
+            'errores': errores,
+            'avisos': avisos,
+            'resultados': todos,
+        }, ensure_ascii=False, indent=2))
+    else:
+        imprimir(por_grupo, errores, avisos, duracion)
+
+    return 0 if errores == 0 else 1
 
 if __name__ == "__main__":
-    sys.exit(main())
\ No newline at end of file
+    sys.exit(main())